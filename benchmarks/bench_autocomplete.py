@@ -0,0 +1,28 @@
+"""Autocomplete latency per keystroke as the catalog grows.
+
+"cold" prefixes are looked up for the first time since the last write;
+"warm" ones repeat a lookup the index has cached.
+
+Usage: python benchmarks/bench_autocomplete.py [SIZE ...]
+"""
+import tempfile
+
+from common import FIRST_NAMES, WORDS, build_store, make_books, parse_sizes, time_per_call
+
+# Every keystroke of typing each word, e.g. "s", "si", "sil", ...
+PREFIXES = [word[:i] for word in WORDS + [name.lower() for name in FIRST_NAMES] for i in range(1, len(word) + 1)]
+
+
+def main():
+    print(f"{'books':>10} {'cold':>12} {'warm':>12}   (us/keystroke)")
+    for size in parse_sizes([10_000, 100_000]):
+        with tempfile.TemporaryDirectory() as directory:
+            store = build_store(make_books(size), directory)
+            cold_us = time_per_call(store.autocomplete, [(prefix,) for prefix in PREFIXES])
+            warm_us = time_per_call(store.autocomplete, [(prefix,) for prefix in PREFIXES])
+            store.close()
+        print(f"{size:>10} {cold_us:>12.1f} {warm_us:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""Range-filtered and sorted searches with and without the NumPy column mirror.
+
+"indexes" answers every query from the bitmap and sorted indexes, checking
+rows in Python; "columns" evaluates them as vectorized masks over the mirror.
+Requires NumPy.
+
+Usage: python benchmarks/bench_columns.py [SIZE ...]
+"""
+import tempfile
+
+from common import build_store, make_books, parse_sizes, time_per_call
+from storage.backend import BookQuery
+
+QUERIES = {
+    "price range": BookQuery(price_gt=20, price_lte=60),
+    "years by price": BookQuery(year_from=1950, year_to=2000, sort_by="price"),
+    "genre+price by rating": BookQuery(genre="fiction", price_lt=100, sort_by="rating", sort_desc=True),
+    "years page 100": BookQuery(year_from=2000, sort_by="price", page=100),
+}
+REPEAT = 5
+
+
+def main():
+    print(f"{'books':>10} {'path':>8} " + " ".join(f"{name:>22}" for name in QUERIES) + "   (us/query)")
+    for size in parse_sizes([100_000, 1_000_000]):
+        books = make_books(size)
+        for path, mirror in (("indexes", "off"), ("columns", "on")):
+            with tempfile.TemporaryDirectory() as directory:
+                store = build_store(books, directory, column_mirror=mirror)
+                timings = [time_per_call(store.search_books, [(query,)] * REPEAT) for query in QUERIES.values()]
+                store.close()
+            print(f"{size:>10} {path:>8} " + " ".join(f"{us:>22.1f}" for us in timings), flush=True)
+
+
+if __name__ == "__main__":
+    main()
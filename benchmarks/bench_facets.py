@@ -0,0 +1,31 @@
+"""Facet count latency for searches of varying selectivity as the catalog grows.
+
+Usage: python benchmarks/bench_facets.py [SIZE ...]
+"""
+import tempfile
+
+from common import build_store, make_books, parse_sizes, time_per_call
+
+from storage.backend import BookQuery
+
+QUERIES = {
+    "everything": BookQuery(),
+    "genre": BookQuery(genre="fiction"),
+    "tag+year": BookQuery(tag="award", year_from=2000),
+    "author": BookQuery(author="newport 42"),
+}
+REPEAT = 5
+
+
+def main():
+    print(f"{'books':>10} " + " ".join(f"{name:>12}" for name in QUERIES) + "   (us/query)")
+    for size in parse_sizes([10_000, 100_000]):
+        with tempfile.TemporaryDirectory() as directory:
+            store = build_store(make_books(size), directory)
+            timings = [time_per_call(store.facet_counts, [(query,)] * REPEAT) for query in QUERIES.values()]
+            store.close()
+        print(f"{size:>10} " + " ".join(f"{us:>12.1f}" for us in timings))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""Memory footprint of the catalog per 100k books.
+
+"dicts" holds the books as parsed from the JSON snapshot, "records" as the
+JSON store keeps them (BookRecord); "store" is everything a loaded JSON
+store allocates: records plus every index.
+
+Usage: python benchmarks/bench_memory.py [SIZE ...]
+"""
+import gc
+import json
+import tempfile
+import tracemalloc
+
+from common import build_store, make_books, parse_sizes
+
+from storage.records import BookRecord
+
+PER = 100_000
+
+
+def allocated(build):
+    """Bytes still allocated by the object ``build()`` returns, and the object."""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, result
+
+
+def main():
+    print(f"{'books':>10} {'dicts':>12} {'records':>12} {'store':>12}   (MB per {PER:,} books)")
+    for size in parse_sizes([100_000]):
+        books = make_books(size)
+        snapshot = json.dumps(books)
+        del books
+        dicts_bytes, dicts = allocated(lambda: json.loads(snapshot))
+        del dicts
+        # The parsed dicts are dropped once converted, as when the store loads
+        records_bytes, records = allocated(lambda: [BookRecord.from_dict(book) for book in json.loads(snapshot)])
+        del records
+        with tempfile.TemporaryDirectory() as directory:
+            store_bytes, store = allocated(lambda: build_store(json.loads(snapshot), directory))
+            store.close()
+        scale = PER / size / 2 ** 20
+        print(f"{size:>10} {dicts_bytes * scale:>12.1f} {records_bytes * scale:>12.1f} {store_bytes * scale:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+"""Point lookup, update and delete latency by book id as the catalog grows.
+
+Usage: python benchmarks/bench_point_lookups.py [SIZE ...]
+"""
+import random
+import tempfile
+
+from common import build_store, make_books, parse_sizes, time_per_call
+
+OPS = 2000
+
+
+def main():
+    print(f"{'books':>10} {'get_book':>12} {'update_book':>12} {'delete_book':>12}   (us/op)")
+    for size in parse_sizes([1_000, 10_000, 100_000, 1_000_000]):
+        books = make_books(size)
+        with tempfile.TemporaryDirectory() as directory:
+            store = build_store(books, directory)
+            rng = random.Random(1)
+            ids = [book["id"] for book in rng.sample(books, min(OPS, size))]
+            get_us = time_per_call(store.get_book, [(book_id,) for book_id in ids])
+            update_us = time_per_call(store.update_book, [(book_id, {"price": 9.99}) for book_id in ids])
+            delete_us = time_per_call(store.delete_book, [(book_id,) for book_id in ids])
+            store.close()
+        print(f"{size:>10} {get_us:>12.2f} {update_us:>12.2f} {delete_us:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
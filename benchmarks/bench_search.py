@@ -0,0 +1,49 @@
+"""Latency of representative /books/search queries as the catalog grows.
+
+Usage: python benchmarks/bench_search.py [SIZE ...]
+"""
+import tempfile
+
+from common import build_store, make_books, parse_sizes, time_per_call
+from storage.backend import BookQuery
+
+QUERIES = {
+    "tag": BookQuery(tag="award"),
+    "author": BookQuery(author="newport 42"),
+    "title": BookQuery(title="river sha"),
+    "full text": BookQuery(q="river shadows"),
+    "fuzzy author": BookQuery(author="nweport 42", fuzzy=True),
+    "genre+tag": BookQuery(genre="fiction", tag="classic"),
+    "price range": BookQuery(price_gt=20, price_lte=25),
+    "author+years": BookQuery(author="newport 42", year_from=1990),
+    "year": BookQuery(published_year=1999),
+    "all, by price": BookQuery(sort_by="price"),
+}
+REPEAT = 20
+
+
+def main():
+    print(f"{'books':>10} " + " ".join(f"{name:>14}" for name in QUERIES) + "   (us/query)")
+    for size in parse_sizes([10_000, 100_000]):
+        with tempfile.TemporaryDirectory() as directory:
+            store = build_store(make_books(size), directory)
+            timings = [time_per_call(store.search_books, [(query,)] * REPEAT) for query in QUERIES.values()]
+            deep = deep_page_timings(store, size)
+            store.close()
+        print(f"{size:>10} " + " ".join(f"{us:>14.1f}" for us in timings))
+        print(f"{'':>10} deep page by price: offset {deep[0]:.1f} us, cursor {deep[1]:.1f} us")
+
+
+def deep_page_timings(store, size):
+    """Fetching the page halfway through the catalog by offset and by cursor."""
+    page = size // 20
+    offset_query = BookQuery(sort_by="price", page=page)
+    last_book = store.search_books(BookQuery(sort_by="price", page=page - 1))[1][-1]
+    cursor_query = BookQuery(sort_by="price", after=(last_book["price"], last_book["id"]))
+    assert store.search_books(offset_query)[1] == store.search_books(cursor_query)[1]
+    return (time_per_call(store.search_books, [(offset_query,)] * REPEAT),
+            time_per_call(store.search_books, [(cursor_query,)] * REPEAT))
+
+
+if __name__ == "__main__":
+    main()
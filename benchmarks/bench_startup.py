@@ -0,0 +1,50 @@
+"""Time until a JSON store serves its first search after a (re)start.
+
+"json" loads the data files and builds every index; "snapshot" writes the
+binary snapshot. "mapped" is a restart over that snapshot, "first search"
+the search served right after it, and "all indexes" the time to unpickle
+every remaining index.
+
+Usage: python benchmarks/bench_startup.py [SIZE ...]
+"""
+import os
+import tempfile
+import time
+
+from common import build_store, make_books, parse_sizes
+
+from storage.backend import BookQuery
+from storage.json_store import SNAPSHOT_ATTRIBUTES, JsonCatalogStore
+from storage.wal import MutationLog
+
+QUERY = BookQuery(genre="fiction", price_lt=50, sort_by="price")
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return (time.perf_counter() - start) * 1000, result
+
+
+def main():
+    columns = ["json", "snapshot", "mapped", "first search", "all indexes"]
+    print(f"{'books':>10} " + " ".join(f"{name:>12}" for name in columns) + "   (ms)")
+    for size in parse_sizes([10_000, 100_000]):
+        with tempfile.TemporaryDirectory() as directory:
+            # build_store() writes the snapshot as part of the load; time it apart
+            load_ms, store = timed(lambda: build_store(make_books(size), directory))
+            snapshot_ms, _ = timed(store._write_binary_snapshot)
+            store.close()
+            restarted = JsonCatalogStore(store.books_file, store.reviews_file, column_mirror="auto",
+                                         log=MutationLog(os.path.join(directory, "mutations.log"),
+                                                         durability="periodic"))
+            mapped_ms, _ = timed(restarted.load)
+            search_ms, _ = timed(lambda: restarted.search_books(QUERY))
+            rest_ms, _ = timed(lambda: [getattr(restarted, name) for name in SNAPSHOT_ATTRIBUTES])
+            restarted.close()
+        timings = [load_ms - snapshot_ms, snapshot_ms, mapped_ms, search_ms, rest_ms]
+        print(f"{size:>10} " + " ".join(f"{ms:>12.1f}" for ms in timings))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+"""Latency of paging /genres and /authors, with and without a prefix, as the catalog grows.
+
+Usage: python benchmarks/bench_values.py [SIZE ...]
+"""
+import tempfile
+
+from common import build_store, make_books, parse_sizes, time_per_call
+
+CALLS = {
+    "genres": ("genres", ("", 1, 100)),
+    "authors": ("authors", ("", 1, 100)),
+    "authors p50": ("authors", ("", 50, 100)),
+    "authors 'new'": ("authors", ("new", 1, 100)),
+}
+REPEAT = 20
+
+
+def main():
+    print(f"{'books':>10} " + " ".join(f"{name:>14}" for name in CALLS) + "   (us/call)")
+    for size in parse_sizes([10_000, 100_000]):
+        with tempfile.TemporaryDirectory() as directory:
+            store = build_store(make_books(size), directory)
+            timings = [time_per_call(getattr(store, method), [args] * REPEAT) for method, args in CALLS.values()]
+            store.close()
+        print(f"{size:>10} " + " ".join(f"{us:>14.1f}" for us in timings))
+
+
+if __name__ == "__main__":
+    main()
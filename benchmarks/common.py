@@ -0,0 +1,67 @@
+"""Helpers shared by the benchmark scripts: synthetic catalogs and timers."""
+import json
+import os
+import random
+import sys
+import time
+from uuid import UUID
+
+# Allow running as ``python benchmarks/<script>.py`` from the repository root
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from storage.json_store import JsonCatalogStore
+from storage.wal import MutationLog
+
+GENRES = ["Fiction", "Science Fiction", "Fantasy", "Mystery", "Biography", "History",
+          "Self-Help", "Programming", "Business", "Poetry", "Romance", "Travel"]
+FIRST_NAMES = ["John", "Jane", "Sarah", "Cal", "Maya", "Ravi", "Chen", "Olga", "Amir", "Lena"]
+LAST_NAMES = ["Smith", "Doe", "Jones", "Newport", "Patel", "Garcia", "Kim", "Novak", "Haddad", "Berg"]
+WORDS = ["deep", "work", "river", "shadow", "garden", "python", "empire", "silent", "code", "ocean",
+         "habit", "mountain", "secret", "light", "history", "future", "winter", "dream", "stone", "city"]
+TAGS = ["bestseller", "classic", "award", "new", "kids", "illustrated", "series", "translated"]
+
+
+def make_books(n, seed=0):
+    rng = random.Random(seed)
+    books = []
+    for i in range(n):
+        books.append({
+            "title": " ".join(rng.choice(WORDS).capitalize() for _ in range(rng.randint(1, 4))),
+            "author": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {i % 5000}",
+            "genre": rng.choice(GENRES),
+            "price": round(rng.uniform(1, 200), 2),
+            "tags": rng.sample(TAGS, rng.randint(0, 3)),
+            "published_year": rng.randint(1900, 2024),
+            "isbn": str(9780000000000 + i),
+            "id": str(UUID(int=rng.getrandbits(128), version=4)),
+            "rating": round(rng.uniform(0, 5), 2),
+        })
+    return books
+
+
+def build_store(books, directory, **options):
+    """Write ``books`` as a snapshot in ``directory`` and load a store over it;
+    ``options`` are passed on to the store."""
+    books_file = os.path.join(directory, "books.json")
+    reviews_file = os.path.join(directory, "reviews.json")
+    with open(books_file, "w") as f:
+        json.dump(books, f)
+    with open(reviews_file, "w") as f:
+        json.dump([], f)
+    store = JsonCatalogStore(books_file, reviews_file,
+                             log=MutationLog(os.path.join(directory, "mutations.log"), durability="periodic"),
+                             **options)
+    store.load()
+    return store
+
+
+def time_per_call(fn, args_list):
+    """Mean wall time of ``fn(*args)`` over ``args_list``, in microseconds."""
+    start = time.perf_counter()
+    for args in args_list:
+        fn(*args)
+    return (time.perf_counter() - start) / len(args_list) * 1e6
+
+
+def parse_sizes(default):
+    return [int(arg) for arg in sys.argv[1:]] or default
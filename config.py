@@ -0,0 +1,33 @@
+import os
+
+# Storage settings, overridable through environment variables
+
+# Directory of the data files, the mutation log and the binary snapshot
+DATA_DIR = os.getenv("ALONZO_DATA_DIR", "data")
+
+# How mutation log writes reach the disk:
+#   "fsync"    - every write is fsynced before the request returns
+#   "group"    - writes arriving within GROUP_COMMIT_WINDOW_MS share one fsync
+#   "periodic" - writes return immediately and are fsynced every FLUSH_INTERVAL_MS
+DURABILITY = os.getenv("ALONZO_DURABILITY", "group")
+GROUP_COMMIT_WINDOW_MS = float(os.getenv("ALONZO_GROUP_COMMIT_WINDOW_MS", "2"))
+FLUSH_INTERVAL_MS = float(os.getenv("ALONZO_FLUSH_INTERVAL_MS", "1000"))
+
+# Which storage backend serves the catalog: "json" (data files held in
+# memory) or "sqlite" (queries run against SQLITE_FILE)
+STORAGE_BACKEND = os.getenv("ALONZO_STORAGE_BACKEND", "json")
+SQLITE_FILE = os.getenv("ALONZO_SQLITE_FILE", os.path.join(DATA_DIR, "catalog.db"))
+
+# Whether the JSON store mirrors the numeric, genre and author fields into
+# NumPy arrays so broad range filters and sorts run vectorized: "auto" uses
+# the mirror when NumPy is installed, "on" requires NumPy, "off" never does
+COLUMN_MIRROR = os.getenv("ALONZO_COLUMN_MIRROR", "auto")
+
+# How often, at most, a JSON store catches up with the mutation log written
+# by other worker processes while it serves no requests; every request
+# catches up first regardless
+FOLLOW_INTERVAL_MS = float(os.getenv("ALONZO_FOLLOW_INTERVAL_MS", "100"))
+
+# How long the JSON store keeps the books' replaced versions, which is how
+# long a walk pinned with snapshot=true stays readable after a change
+VERSION_RETENTION_S = float(os.getenv("ALONZO_VERSION_RETENTION_S", "300"))
@@ -2,11 +2,13 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import os
 import json
+import config
 from routers import book_router, reviews
+from storage.catalog import catalog, writer
 
 # Initialize data files if they don't exist
 def initialize_data_files():
-    data_dir = "data"
+    data_dir = config.DATA_DIR
     if not os.path.exists(data_dir):
         os.makedirs(data_dir)
     
@@ -22,6 +24,9 @@ def initialize_data_files():
 
 initialize_data_files()
 
+# Load the catalog once; handlers serve reads from memory after this
+catalog.load()
+
 app = FastAPI(
     title="Alonzo Books API",
     description="A RESTful API for a mock online bookstore",
@@ -36,12 +41,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Apply the mutations still queued, then flush the mutation log and save
+# the binary snapshot the next start maps
+@app.on_event("shutdown")
+async def close_catalog():
+    await writer.stop()
+    catalog.close()
+
 # Include routers
 app.include_router(book_router.router, tags=["Books"])
 app.include_router(reviews.router, tags=["Reviews"])
 
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "Welcome to Alonzo Books API. Visit /docs for the API documentation."}
 
 if __name__ == "__main__":
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from pydantic import BaseModel, Field, validator
+from typing import Dict, List, Optional
 from uuid import UUID
 
 # For creating a book (without id and rating)
@@ -22,6 +22,13 @@ class BookUpdate(BaseModel):
     published_year: Optional[int] = Field(None, ge=1000, le=9999)
     isbn: Optional[str] = None
 
+    # Fields may be left out, but not set to null
+    @validator("*", pre=True)
+    def not_null(cls, value):
+        if value is None:
+            raise ValueError("may be omitted but not null")
+        return value
+
 # For returning a complete book object (with id and rating)
 class Book(BookCreate):
     id: str
@@ -32,4 +39,43 @@ class PaginatedBooks(BaseModel):
     total: int
     page: int
     page_size: int
-    books: List[Book]
\ No newline at end of file
+    books: List[Book]
+    # Set when paging with cursors and more books may follow
+    next_cursor: Optional[str] = None
+    # Set when facet counts are requested: facet -> value or bucket -> books
+    facets: Optional[Dict[str, Dict[str, int]]] = None
+    # Set when explain=true: how the search was answered
+    plan: Optional["SearchPlan"] = None
+
+# For explain=true: one step of a search and the whole plan
+class PlanStep(BaseModel):
+    step: str
+    access: str
+    estimated_rows: Optional[int] = None
+    rows: Optional[int] = None
+    ms: float
+
+class SearchPlan(BaseModel):
+    steps: List[PlanStep]
+    ms: float
+
+PaginatedBooks.update_forward_refs()
+
+# For /genres and /authors: a distinct value and the books carrying it
+class CatalogValue(BaseModel):
+    name: str
+    books: int
+    average_rating: float
+
+class PaginatedValues(BaseModel):
+    total: int
+    page: int
+    page_size: int
+    values: List[CatalogValue]
+
+# For autocomplete suggestions
+class Completion(BaseModel):
+    value: str
+    field: str
+    books: int
+    reviews: int
\ No newline at end of file
@@ -1,15 +1,13 @@
-from fastapi import APIRouter, HTTPException, Query, Path, Depends
+from fastapi import APIRouter, HTTPException, Query, Path, Body
 from fastapi import status
-from models.book import Book, BookCreate, BookUpdate, PaginatedBooks
+from models.book import Book, BookCreate, BookUpdate, Completion, PaginatedBooks, PaginatedValues
+from storage.backend import (COMPLETION_FIELDS, SORT_FIELDS, BookQuery, SnapshotExpired, decode_cursor,
+                             decode_snapshot, encode_cursor)
+from storage.catalog import catalog, read, writer
 from typing import List, Optional
 from uuid import uuid4
-import json
-import os
-from collections import defaultdict
 
 router = APIRouter()
-DATA_FILE = "data/books.json"
-REVIEWS_FILE = "data/reviews.json"
 
 # Utility functions
 import logging
@@ -17,108 +15,172 @@ import logging
 # Set up logging configuration
 logging.basicConfig(level=logging.INFO)
 
-def read_books():
-    if not os.path.exists(DATA_FILE):
-        logging.error("Books data file not found.")
-        return []
-    with open(DATA_FILE, "r") as f:
-        try:
-            books = json.load(f)
-            logging.info(f"Loaded {len(books)} books.")
-            return books
-        except json.JSONDecodeError:
-            logging.error("Books data file is malformed.")
-            return []
-
+CURSOR_DESCRIPTION = "Keyset pagination: pass an empty cursor for the first page, then each response's next_cursor"
+SNAPSHOT_DESCRIPTION = ("With an empty cursor: page through the catalog as it is now, "
+                        "unaffected by changes made during the walk")
 
+def parse_cursor(cursor: Optional[str], sort_by: Optional[str], sort_desc: bool):
+    if cursor is None:
+        return None
+    try:
+        return decode_cursor(cursor, sort_by, sort_desc)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-def read_reviews():
-    if not os.path.exists(REVIEWS_FILE):
-        return []
-    with open(REVIEWS_FILE, "r") as f:
+async def parse_snapshot(cursor: Optional[str], snapshot: bool) -> Optional[int]:
+    # Continuing walks carry their version in the cursor; new ones pin the current one
+    if cursor:
         try:
-            return json.load(f)
-        except json.JSONDecodeError:
-            return []
-
-def write_books(books):
-    with open(DATA_FILE, "w") as f:
-        json.dump(books, f, indent=4)
+            return decode_snapshot(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if not snapshot:
+        return None
+    if cursor is None:
+        raise HTTPException(status_code=400, detail="Only cursor pagination can be pinned to a snapshot")
+    version = await read(getattr, catalog, "version")
+    if version is None:
+        raise HTTPException(status_code=400, detail="The storage backend does not support snapshots")
+    return version
+
+async def search(query: BookQuery, explain: bool = False):
+    try:
+        return await read(catalog.explain_search if explain else catalog.search_books, query)
+    except SnapshotExpired as e:
+        raise HTTPException(status_code=410, detail=str(e))
 
-def write_reviews(reviews):
-    with open(REVIEWS_FILE, "w") as f:
-        json.dump(reviews, f, indent=4)
+def next_cursor(query: BookQuery, books: List[dict]) -> Optional[str]:
+    if query.after is None or len(books) < query.page_size:
+        return None
+    return encode_cursor(query, books[-1])
 
 
 # GET all books with pagination and sorting
 @router.get("/books", response_model=PaginatedBooks)
-def get_books(
+async def get_books(
     page: int = Query(1, ge=1, description="Page number"),
     page_size: int = Query(10, ge=1, le=100, description="Number of books per page"),
     sort_by: Optional[str] = Query(None, description="Sort by field (price, rating, published_year)"),
-    sort_desc: bool = Query(False, description="Sort in descending order")
+    sort_desc: bool = Query(False, description="Sort in descending order"),
+    cursor: Optional[str] = Query(None, description=CURSOR_DESCRIPTION),
+    snapshot: bool = Query(False, description=SNAPSHOT_DESCRIPTION)
 ):
-    books = read_books()
+    # Validate sorting if specified
+    if sort_by and sort_by not in SORT_FIELDS:
+        raise HTTPException(status_code=400, detail="Invalid sort field")
     
-    # Apply sorting if specified
-    if sort_by:
-        if sort_by not in ["price", "rating", "published_year"]:
-            raise HTTPException(status_code=400, detail="Invalid sort field")
-        
-        books.sort(key=lambda x: x[sort_by], reverse=sort_desc)
-    
-    # Apply pagination
-    total = len(books)
-    start_idx = (page - 1) * page_size
-    end_idx = min(start_idx + page_size, total)
-    
-    page_books = books[start_idx:end_idx]
+    # Sorting and pagination are applied by the storage backend
+    query = BookQuery(sort_by=sort_by, sort_desc=sort_desc, page=page, page_size=page_size,
+                      after=parse_cursor(cursor, sort_by, sort_desc), snapshot=await parse_snapshot(cursor, snapshot))
+    total, page_books = await search(query)
     
     return {
         "total": total,
         "page": page,
         "page_size": page_size,
-        "books": page_books
+        "books": page_books,
+        "next_cursor": next_cursor(query, page_books)
+    }
+
+# GET search books
+# Declared before /books/{book_id} so "search" is not captured as a book id
+@router.get("/books/search", response_model=PaginatedBooks)
+async def search_books(
+    q: Optional[str] = Query(None, description="Full-text search over title, author and tags, ranked by relevance"),
+    fuzzy: bool = Query(False, description="Tolerate typos in q and in the words of title and author"),
+    title: Optional[str] = Query(None, description="Case-insensitive substring of the title"),
+    author: Optional[str] = None,
+    genre: Optional[str] = None,
+    price_lt: Optional[float] = None,
+    price_lte: Optional[float] = None,
+    price_gt: Optional[float] = None,
+    price_gte: Optional[float] = None,
+    tag: Optional[str] = None,
+    published_year: Optional[int] = None,
+    year_from: Optional[int] = Query(None, description="Earliest published year (inclusive)"),
+    year_to: Optional[int] = Query(None, description="Latest published year (inclusive)"),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(10, ge=1, le=100),
+    sort_by: Optional[str] = None,
+    sort_desc: bool = False,
+    cursor: Optional[str] = Query(None, description=CURSOR_DESCRIPTION),
+    snapshot: bool = Query(False, description=SNAPSHOT_DESCRIPTION),
+    facets: bool = Query(False, description="Also count the matching books per genre, author, tag, price and year range"),
+    facet_size: int = Query(10, ge=1, le=100, description="Most frequent genres, authors and tags to count"),
+    explain: bool = Query(False, description="Also return the query plan with per-step timings")
+):
+    # Sorting logic
+    if sort_by and sort_by not in SORT_FIELDS:
+        raise HTTPException(status_code=400, detail="Invalid sort field")
+    if q and cursor is not None and not sort_by:
+        raise HTTPException(status_code=400, detail="Relevance-ranked results cannot be paged with a cursor; use sort_by")
+
+    # Filters, sorting and pagination are applied by the storage backend
+    query = BookQuery(
+        q=q,
+        fuzzy=fuzzy,
+        title=title,
+        author=author,
+        genre=genre,
+        price_lt=price_lt,
+        price_lte=price_lte,
+        price_gt=price_gt,
+        price_gte=price_gte,
+        tag=tag,
+        published_year=published_year,
+        year_from=year_from,
+        year_to=year_to,
+        sort_by=sort_by,
+        sort_desc=sort_desc,
+        page=page,
+        page_size=page_size,
+        after=parse_cursor(cursor, sort_by, sort_desc),
+        snapshot=await parse_snapshot(cursor, snapshot)
+    )
+    plan = None
+    if explain:
+        total, paginated_books, plan = await search(query, explain=True)
+    else:
+        total, paginated_books = await search(query)
+
+    return {
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+        "books": paginated_books,
+        "next_cursor": next_cursor(query, paginated_books),
+        "facets": await read(catalog.facet_counts, query, facet_size) if facets else None,
+        "plan": plan
     }
 
 # GET book by ID
 @router.get("/books/{book_id}", response_model=Book)
-def get_book(book_id: str = Path(..., description="The ID of the book to get")):
-    books = read_books()
-    for book in books:
-        if book["id"] == book_id:
-            return book
+async def get_book(book_id: str = Path(..., description="The ID of the book to get")):
+    book = await read(catalog.get_book, book_id)
+    if book is not None:
+        return book
     raise HTTPException(status_code=404, detail="Book not found")
 
 # POST new book
 @router.post("/books", response_model=Book, status_code=201)
-def add_book(book: BookCreate):
+async def add_book(book: BookCreate):
     new_book = book.dict()
     new_book["id"] = str(uuid4())
     new_book["rating"] = 0.0
     
-    books = read_books()
-    books.append(new_book)
-    write_books(books)
-    
-    return new_book
+    return await writer.submit(catalog.add_book, new_book)
 
 # PUT update book
 @router.put("/books/{book_id}", response_model=Book)
-def update_book(
+async def update_book(
     book_id: str = Path(..., description="The ID of the book to update"),
-    updated_book: BookUpdate = Depends()
+    updated_book: BookUpdate = Body(...)
 ):
-    books = read_books()
-    for index, book in enumerate(books):
-        if book["id"] == book_id:
-            # Update only provided fields
-            update_data = updated_book.dict(exclude_unset=True)
-            current_book = book.copy()
-            current_book.update(update_data)
-            books[index] = current_book
-            write_books(books)
-            return current_book
+    # Update only provided fields
+    update_data = updated_book.dict(exclude_unset=True)
+    current_book = await writer.submit(catalog.update_book, book_id, update_data)
+    if current_book is not None:
+        return current_book
     
     raise HTTPException(status_code=404, detail="Book not found")
 
@@ -129,23 +191,12 @@ from fastapi import HTTPException
 import traceback  # Optional, for better debugging during development
 
 @router.delete("/books/{book_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_book(book_id: str = Path(..., description="The ID of the book to delete")):
+async def delete_book(book_id: str = Path(..., description="The ID of the book to delete")):
     try:
-        books = read_books()
-        book_exists = any(book["id"] == book_id for book in books)
-
-        if not book_exists:
+        # Remove the book together with its associated reviews
+        if not await writer.submit(catalog.delete_book, book_id):
             raise HTTPException(status_code=404, detail="Book not found")
 
-        # Remove the book
-        updated_books = [book for book in books if book["id"] != book_id]
-        write_books(updated_books)
-
-        # Also remove associated reviews
-        reviews = read_reviews()
-        updated_reviews = [review for review in reviews if review.get("book_id") != book_id]
-        write_reviews(updated_reviews)
-
         return None
 
     except HTTPException:
@@ -154,86 +205,33 @@ def delete_book(book_id: str = Path(..., description="The ID of the book to dele
         # Optional for logging: print(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
 
-# GET all genres
-@router.get("/genres", response_model=List[str])
-def get_genres():
-    books = read_books()
-    genres = set()
-    for book in books:
-        genres.add(book["genre"])
-    return sorted(list(genres))
-
-# GET all authors
-@router.get("/authors", response_model=List[str])
-def get_authors():
-    books = read_books()
-    authors = set()
-    for book in books:
-        authors.add(book["author"])
-    return sorted(list(authors))
-
-# GET search books
-# GET search books
-@router.get("/books/search", response_model=PaginatedBooks)
-def search_books(
-    author: Optional[str] = None,
-    genre: Optional[str] = None,
-    price_lt: Optional[float] = None,
-    price_lte: Optional[float] = None,
-    price_gt: Optional[float] = None,
-    tag: Optional[str] = None,
-    published_year: Optional[int] = None,
+# GET genres with their book counts, alphabetically
+@router.get("/genres", response_model=PaginatedValues)
+async def get_genres(
+    prefix: str = Query("", description="Only genres starting with this (case-insensitive)"),
     page: int = Query(1, ge=1),
-    page_size: int = Query(10, ge=1, le=100),
-    sort_by: Optional[str] = None,
-    sort_desc: bool = False
+    page_size: int = Query(100, ge=1, le=1000)
 ):
-    books = read_books()  # Load books using the read_books function
-    
-    # Apply filters
-    filtered_books = books
-    
-    # Filter by author
-    if author:
-        filtered_books = [book for book in filtered_books if author.lower() in book["author"].lower()]
-    
-    # Filter by genre
-    if genre:
-        filtered_books = [book for book in filtered_books if genre.lower() in book["genre"].lower()]
-    
-    # Filter by price
-    if price_lt:
-        filtered_books = [book for book in filtered_books if book["price"] < price_lt]
-    if price_lte:
-        filtered_books = [book for book in filtered_books if book["price"] <= price_lte]
-    if price_gt:
-        filtered_books = [book for book in filtered_books if book["price"] > price_gt]
-    
-    # Filter by tag
-    if tag:
-        filtered_books = [book for book in filtered_books if tag.lower() in [t.lower() for t in book["tags"]]]
-    
-    # Filter by published year
-    if published_year:
-        filtered_books = [book for book in filtered_books if book["published_year"] == published_year]
-
-    # Sorting logic
-    if sort_by:
-        if sort_by not in ["price", "rating", "published_year"]:
-            raise HTTPException(status_code=400, detail="Invalid sort field")
-        
-        filtered_books.sort(key=lambda x: x[sort_by], reverse=sort_desc)
-
-    # Pagination logic
-    total = len(filtered_books)
-    start_idx = (page - 1) * page_size
-    end_idx = min(start_idx + page_size, total)
-    
-    paginated_books = filtered_books[start_idx:end_idx]
+    total, genres = await read(catalog.genres, prefix, page, page_size)
+    return {"total": total, "page": page, "page_size": page_size, "values": genres}
 
-    return {
-        "total": total,
-        "page": page,
-        "page_size": page_size,
-        "books": paginated_books
-    }
\ No newline at end of file
+# GET authors with their book counts, alphabetically
+@router.get("/authors", response_model=PaginatedValues)
+async def get_authors(
+    prefix: str = Query("", description="Only authors starting with this (case-insensitive)"),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(100, ge=1, le=1000)
+):
+    total, authors = await read(catalog.authors, prefix, page, page_size)
+    return {"total": total, "page": page, "page_size": page_size, "values": authors}
+
+# GET completions for a search box prefix
+@router.get("/autocomplete", response_model=List[Completion])
+async def autocomplete(
+    q: str = Query(..., min_length=1, description="Prefix of a word in a title, author or genre"),
+    field: Optional[str] = Query(None, description="Only complete this field: title, author or genre"),
+    limit: int = Query(10, ge=1, le=50)
+):
+    if field and field not in COMPLETION_FIELDS:
+        raise HTTPException(status_code=400, detail="Invalid autocomplete field")
+    return await read(catalog.autocomplete, q, field, limit)
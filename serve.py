@@ -0,0 +1,136 @@
+"""Pre-forking server: load the catalog once, then fork workers that share it.
+
+``uvicorn --workers N`` starts N fresh interpreters that each load their own
+copy of the catalog. Here the parent process loads it and brings every
+index into memory, then forks the workers, so they start with the parent's
+pages and share them copy-on-write. ``gc.freeze()`` moves everything loaded
+so far out of the collector's reach, so collections in the workers do not
+write to (and unshare) those pages. Reference counting still writes to the
+objects a request touches; what a worker touches becomes private to it.
+
+The parent restarts workers that exit and logs the shared and private
+memory of every process on SIGUSR1, and every ``--memory-report`` seconds.
+Memory figures come from /proc and are only available on Linux.
+
+Usage: python serve.py [--host HOST] [--port PORT] [--workers N] [--memory-report SECONDS]
+"""
+import argparse
+import gc
+import logging
+import os
+import signal
+import time
+from typing import Dict, Iterable, Optional
+
+import uvicorn
+
+# Fields of /proc/<pid>/smaps_rollup the memory report uses
+MEMORY_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty")
+
+
+def memory_usage(pid: int) -> Optional[Dict[str, int]]:
+    """Memory of process ``pid`` in bytes by ``MEMORY_FIELDS``; None where /proc is unavailable."""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+    usage = {}
+    for line in lines:
+        name, _, value = line.partition(":")
+        if name in MEMORY_FIELDS:
+            usage[name] = int(value.split()[0]) * 1024
+    return usage
+
+
+def memory_report(workers: Iterable[int]) -> str:
+    """Table of the parent's and each worker's memory, in MB.
+
+    "shared" pages are also mapped by another process, "private" ones only
+    by this one; "pss" splits each shared page evenly between the processes
+    mapping it, so the pss total is what the server as a whole occupies and
+    each further worker adds about one worker's private memory.
+    """
+    rows = [f"{'process':>8} {'pid':>8} {'rss':>10} {'shared':>10} {'private':>10} {'pss':>10}   (MB)"]
+    total = 0
+    for role, pid in [("parent", os.getpid())] + [("worker", pid) for pid in sorted(workers)]:
+        usage = memory_usage(pid)
+        if usage is None:
+            rows.append(f"{role:>8} {pid:>8}   memory usage unavailable")
+            continue
+        shared = usage["Shared_Clean"] + usage["Shared_Dirty"]
+        private = usage["Private_Clean"] + usage["Private_Dirty"]
+        total += usage["Pss"]
+        rows.append(f"{role:>8} {pid:>8} {usage['Rss'] / 2**20:>10.1f} {shared / 2**20:>10.1f} "
+                    f"{private / 2**20:>10.1f} {usage['Pss'] / 2**20:>10.1f}")
+    rows.append(f"{'total':>8} {'':>8} {'':>10} {'':>10} {'':>10} {total / 2**20:>10.1f}")
+    return "\n".join(rows)
+
+
+def spawn(config: uvicorn.Config, sock, catalog) -> int:
+    """Fork a worker serving ``config.app`` on ``sock``; returns its pid."""
+    pid = os.fork()
+    if pid:
+        return pid
+    code = 0
+    try:
+        # Leave signals from the terminal to the parent, which forwards them once
+        os.setpgid(0, 0)
+        signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+        catalog.after_fork()
+        gc.enable()
+        uvicorn.Server(config).run(sockets=[sock])
+    except BaseException:
+        logging.exception("Worker failed.")
+        code = 1
+    finally:
+        os._exit(code)
+
+
+def serve(host: str, port: int, workers: int, report_interval: float):
+    # Collecting while the catalog loads would only walk the growing heap;
+    # the workers re-enable collection for what they allocate themselves
+    gc.disable()
+    import main
+    main.catalog.preload()
+    gc.freeze()
+
+    config = uvicorn.Config(main.app, host=host, port=port)
+    sock = config.bind_socket()
+    pids = {spawn(config, sock, main.catalog) for _ in range(workers)}
+
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.append(signum))
+    signal.signal(signal.SIGUSR1, lambda signum, frame: logging.info("Memory usage:\n" + memory_report(pids)))
+    next_report = time.monotonic() + report_interval
+    while not stopping:
+        time.sleep(0.5)
+        while pids:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if not pid:
+                break
+            pids.discard(pid)
+            if not stopping:
+                logging.warning(f"Worker {pid} exited with status {status}; starting another.")
+                pids.add(spawn(config, sock, main.catalog))
+        if report_interval and time.monotonic() >= next_report:
+            logging.info("Memory usage:\n" + memory_report(pids))
+            next_report += report_interval
+
+    for pid in pids:
+        os.kill(pid, signal.SIGTERM)
+    for pid in pids:
+        os.waitpid(pid, 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the API from workers forked after loading the catalog.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--memory-report", type=float, default=0, metavar="SECONDS",
+                        help="log every process's memory usage this often (0: only on SIGUSR1)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    serve(args.host, args.port, args.workers, args.memory_report)
@@ -0,0 +1,244 @@
+import base64
+import heapq
+import json
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+SORT_FIELDS = ("price", "rating", "published_year")
+
+COMPLETION_FIELDS = ("title", "author", "genre")
+
+# Facets counted per distinct value, and facets counted per range bucket.
+# Bucket edges are lower bounds: price 10-25 means 10 <= price < 25.
+FACET_FIELDS = ("genre", "author", "tag")
+FACET_BUCKETS = {"price": (10, 25, 50, 100), "published_year": (1950, 2000, 2010, 2020)}
+
+
+def bucket_labels(edges: Tuple[int, ...]) -> List[str]:
+    """Names of the buckets split at ``edges``: "<10", "10-25", ..., "100+"."""
+    return [f"<{edges[0]}"] + [f"{low}-{high}" for low, high in zip(edges, edges[1:])] + [f"{edges[-1]}+"]
+
+
+def top_counts(counts: Dict[str, int], size: int) -> Dict[str, int]:
+    """The ``size`` largest counts, largest first, ties alphabetically."""
+    return dict(heapq.nsmallest(size, counts.items(), key=lambda item: (-item[1], item[0])))
+
+
+@dataclass
+class BookQuery:
+    """Filters, ordering and page of a book listing or search."""
+    # Full-text query over title, author and tags; without sort_by the
+    # results are ordered by relevance
+    q: Optional[str] = None
+    # Tolerate typos in q and in the words of the title and author filters
+    fuzzy: bool = False
+    title: Optional[str] = None
+    author: Optional[str] = None
+    genre: Optional[str] = None
+    price_lt: Optional[float] = None
+    price_lte: Optional[float] = None
+    price_gt: Optional[float] = None
+    price_gte: Optional[float] = None
+    tag: Optional[str] = None
+    published_year: Optional[int] = None
+    year_from: Optional[int] = None
+    year_to: Optional[int] = None
+    sort_by: Optional[str] = None
+    sort_desc: bool = False
+    page: int = 1
+    page_size: int = 10
+    # Keyset pagination: the (sort value, id) key of the last book already
+    # seen, or () for the first page. Results are then ordered by
+    # (sort value, id), or by id alone without sort_by, and page is ignored.
+    after: Optional[Tuple[Any, ...]] = None
+    # Catalog version (see StorageBackend.version) a keyset walk is pinned
+    # to: its pages show the books as they were then, whatever changed
+    # since. Ignored for offset pages.
+    snapshot: Optional[int] = None
+
+
+class SnapshotExpired(LookupError):
+    """A ``BookQuery.snapshot`` version older than the backend still keeps."""
+
+
+class WouldBlock(Exception):
+    """Raised by ``StorageBackend.try_read()`` for a read that would have to wait."""
+
+
+def encode_cursor(query: BookQuery, last_book: dict) -> str:
+    """Opaque cursor resuming ``query`` after ``last_book``, at the same snapshot."""
+    value = last_book[query.sort_by] if query.sort_by else last_book["id"]
+    payload = {"s": query.sort_by, "d": query.sort_desc, "k": [value, last_book["id"]]}
+    if query.snapshot is not None:
+        payload["v"] = query.snapshot
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode()
+
+
+def decode_cursor(cursor: str, sort_by: Optional[str], sort_desc: bool) -> Tuple[Any, ...]:
+    """The ``BookQuery.after`` key of ``cursor``; raises ValueError if it is invalid
+    or was issued for a different ordering. An empty cursor starts a new walk."""
+    if not cursor:
+        return ()
+    payload = _cursor_payload(cursor)
+    try:
+        key = tuple(payload["k"])
+        issued_for = (payload["s"], payload["d"])
+    except (KeyError, TypeError):
+        raise ValueError("Malformed cursor")
+    if issued_for != (sort_by, sort_desc) or len(key) != 2:
+        raise ValueError("Cursor does not match the requested ordering")
+    # Sort fields are numeric; a walk without sort_by is keyed by id
+    value_types = (int, float) if sort_by else str
+    if not isinstance(key[0], value_types) or isinstance(key[0], bool) or not isinstance(key[1], str):
+        raise ValueError("Malformed cursor")
+    return key
+
+
+def decode_snapshot(cursor: str) -> Optional[int]:
+    """The ``BookQuery.snapshot`` version ``cursor`` pins its walk to, if any;
+    raises ValueError if it is invalid."""
+    if not cursor:
+        return None
+    version = _cursor_payload(cursor).get("v")
+    if version is not None and type(version) is not int:
+        raise ValueError("Malformed cursor")
+    return version
+
+
+def _cursor_payload(cursor: str) -> dict:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise ValueError("Malformed cursor")
+    if not isinstance(payload, dict):
+        raise ValueError("Malformed cursor")
+    return payload
+
+
+class StorageBackend(ABC):
+    """Catalog operations used by the routers.
+
+    Books and reviews are exchanged as plain dicts shaped like the ``Book``
+    and ``Review`` models. Methods that look up a missing record return
+    ``None`` (or ``False``) and leave the HTTP error to the caller.
+    """
+
+    @abstractmethod
+    def load(self):
+        """Open the underlying storage; called once at startup."""
+
+    def close(self):
+        """Release files and background work; the backend may be ``load()``ed again."""
+
+    def preload(self):
+        """Bring everything reads use into memory, so processes forked afterwards share it."""
+
+    def after_fork(self):
+        """Called in each worker process forked from the one that loaded the backend."""
+
+    @contextmanager
+    def batch(self):
+        """Persist the mutations the calling thread makes inside as one step, where the backend can.
+
+        Each mutation still succeeds or fails on its own; they are only
+        durable once the block exits.
+        """
+        yield
+
+    def try_read(self, method: Callable, *args):
+        """Call ``method``, one of the reading methods, only if it can answer
+        at once, without waiting for a lock or I/O, so it can run on the
+        event loop; raises WouldBlock otherwise. Reads are side-effect free,
+        so the caller retries elsewhere."""
+        raise WouldBlock
+
+    @property
+    def version(self) -> Optional[int]:
+        """Version of the catalog as a search would see it now, for ``BookQuery.snapshot``;
+        None if the backend cannot pin walks to a version."""
+        return None
+
+    @abstractmethod
+    def dump(self) -> Tuple[List[dict], List[dict]]:
+        """Return every book and review, e.g. to seed another backend."""
+
+    # Books
+
+    @abstractmethod
+    def search_books(self, query: BookQuery) -> Tuple[int, List[dict]]:
+        """Return the number of books matching ``query`` and the requested page.
+
+        Raises ``SnapshotExpired`` if ``query.snapshot`` is no longer kept.
+        """
+
+    @abstractmethod
+    def explain_search(self, query: BookQuery) -> Tuple[int, List[dict], dict]:
+        """Like ``search_books()``, also returning how the search was answered.
+
+        The plan is ``{"steps": [...], "ms": total}``, each step being
+        ``{"step", "access", "estimated_rows", "rows", "ms"}`` in execution
+        order.
+        """
+
+    @abstractmethod
+    def get_book(self, book_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    def add_book(self, book: dict) -> dict:
+        ...
+
+    @abstractmethod
+    def update_book(self, book_id: str, changes: dict) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    def delete_book(self, book_id: str) -> bool:
+        """Remove a book together with its reviews; False if it does not exist."""
+
+    @abstractmethod
+    def genres(self, prefix: str = "", page: int = 1, page_size: Optional[int] = None) -> Tuple[int, List[dict]]:
+        """Distinct genres starting with ``prefix`` (case-insensitively), and how many there are.
+
+        Genres are ordered case-insensitively and paged like reviews; each is
+        ``{"name", "books", "average_rating"}``, the rating averaged over its books.
+        """
+
+    @abstractmethod
+    def authors(self, prefix: str = "", page: int = 1, page_size: Optional[int] = None) -> Tuple[int, List[dict]]:
+        """Distinct authors, as ``genres()`` lists genres."""
+
+    @abstractmethod
+    def facet_counts(self, query: BookQuery, size: int = 10) -> Dict[str, Dict[str, int]]:
+        """Counts of the books matching ``query``'s filters, per facet.
+
+        Genre, author and tag facets hold their ``size`` most frequent
+        values; price and published_year facets hold every bucket of
+        ``FACET_BUCKETS``, empty ones included. Ordering and paging are
+        ignored.
+        """
+
+    @abstractmethod
+    def autocomplete(self, prefix: str, field: Optional[str] = None, limit: int = 10) -> List[dict]:
+        """Titles, authors and genres (or just ``field``) with a word starting with ``prefix``.
+
+        Each completion is ``{"value", "field", "books", "reviews"}``; the
+        most reviewed come first, then those shared by the most books, then
+        the earliest added.
+        """
+
+    # Reviews
+
+    @abstractmethod
+    def list_reviews(self, book_id: str, page: int = 1, page_size: Optional[int] = None) -> List[dict]:
+        ...
+
+    @abstractmethod
+    def add_review(self, review: dict) -> Optional[dict]:
+        """Store a review and update its book's rating; None if the book does not exist."""
+
+    @abstractmethod
+    def delete_review(self, review_id: str) -> Optional[dict]:
+        """Remove a review and update its book's rating; returns the removed review."""
@@ -0,0 +1,198 @@
+import bisect
+import itertools
+from collections import deque
+from typing import Dict, Iterable, Iterator, List, Set, Union
+
+# Values are split into a 16-bit container key and a 16-bit offset within it
+CHUNK_BITS = 16
+CHUNK_SIZE = 1 << CHUNK_BITS
+CHUNK_MASK = CHUNK_SIZE - 1
+# Containers holding more offsets than this are stored densely
+ARRAY_LIMIT = 4096
+
+Container = Union[Set[int], bytearray]
+
+
+class Bitmap:
+    """Compressed set of non-negative integers (book ordinals), roaring style.
+
+    Values are grouped into chunks of 65536 by their high bits. A sparse
+    chunk is a set of offsets; one holding more than ``ARRAY_LIMIT`` becomes
+    a dense array with one 0/1 byte per offset. Dense arrays trade the 8x
+    packing of real bit arrays for operations that stay in C: AND and OR go
+    through integer arithmetic and iteration is ``itertools.compress``. The
+    cardinality is kept up to date, so ``len()`` is constant time. Iteration
+    yields values in ascending order.
+
+    Bitmaps stored in an index are mutated in place by ``add()`` and
+    ``discard()``; query code combines them with ``&``, ``|`` and
+    ``union()``, which return new bitmaps and leave their operands alone.
+    """
+
+    __slots__ = ("_containers", "_size")
+
+    def __init__(self, values: Iterable[int] = ()):
+        self._containers: Dict[int, Container] = {}
+        values = set(values)
+        self._size = len(values)
+        if not values:
+            return
+        if max(values) < CHUNK_SIZE:
+            self._store(0, values)
+            return
+        values = sorted(values)
+        for key in range(values[0] >> CHUNK_BITS, (values[-1] >> CHUNK_BITS) + 1):
+            start = bisect.bisect_left(values, key << CHUNK_BITS)
+            stop = bisect.bisect_left(values, (key + 1) << CHUNK_BITS, start)
+            if start < stop:
+                self._store(key, set(map(CHUNK_MASK.__and__, values[start:stop])))
+
+    def _store(self, key: int, offsets: Set[int]):
+        self._containers[key] = _dense(offsets) if len(offsets) > ARRAY_LIMIT else offsets
+
+    def add(self, value: int):
+        key, offset = value >> CHUNK_BITS, value & CHUNK_MASK
+        container = self._containers.get(key)
+        if container is None:
+            self._containers[key] = {offset}
+        elif isinstance(container, set):
+            if offset in container:
+                return
+            container.add(offset)
+            if len(container) > ARRAY_LIMIT:
+                self._containers[key] = _dense(container)
+        elif container[offset]:
+            return
+        else:
+            container[offset] = 1
+        self._size += 1
+
+    def discard(self, value: int):
+        key, offset = value >> CHUNK_BITS, value & CHUNK_MASK
+        container = self._containers.get(key)
+        if container is None:
+            return
+        if isinstance(container, set):
+            if offset not in container:
+                return
+            container.discard(offset)
+            if not container:
+                del self._containers[key]
+        elif not container[offset]:
+            return
+        else:
+            container[offset] = 0
+            if 1 not in container:
+                del self._containers[key]
+        self._size -= 1
+
+    def __contains__(self, value: int) -> bool:
+        container = self._containers.get(value >> CHUNK_BITS)
+        if container is None:
+            return False
+        offset = value & CHUNK_MASK
+        if isinstance(container, set):
+            return offset in container
+        return container[offset] == 1
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __bool__(self) -> bool:
+        # Emptied containers are dropped, so any container holds a value
+        return bool(self._containers)
+
+    def __iter__(self) -> Iterator[int]:
+        for key in sorted(self._containers):
+            base = key << CHUNK_BITS
+            container = self._containers[key]
+            if isinstance(container, set):
+                yield from sorted(container) if not base else (base + offset for offset in sorted(container))
+            else:
+                yield from itertools.compress(range(base, base + CHUNK_SIZE), container)
+
+    def __and__(self, other: "Bitmap") -> "Bitmap":
+        small, large = sorted((self._containers, other._containers), key=len)
+        result = Bitmap()
+        for key, a in small.items():
+            b = large.get(key)
+            if b is None:
+                continue
+            if isinstance(a, set) and isinstance(b, set):
+                container = a & b if len(a) <= len(b) else b & a
+                size = len(container)
+            elif isinstance(a, set) or isinstance(b, set):
+                offsets, flags = (a, b) if isinstance(a, set) else (b, a)
+                container = set(itertools.compress(offsets, map(flags.__getitem__, offsets)))
+                size = len(container)
+            else:
+                bits = _to_int(a) & _to_int(b)
+                # Each 0/1 flag byte contributes at most one set bit
+                size = bits.bit_count()
+                container = _from_int(bits)
+            if size:
+                result._containers[key] = container
+                result._size += size
+        return result
+
+    def __or__(self, other: "Bitmap") -> "Bitmap":
+        return union([self, other])
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Bitmap) and list(self) == list(other)
+
+    def __repr__(self):
+        return f"Bitmap({list(self)!r})"
+
+
+def union(bitmaps: Iterable[Bitmap]) -> Bitmap:
+    """OR of ``bitmaps``, merging each chunk's containers in one step."""
+    sparse: Dict[int, List[Set[int]]] = {}
+    dense: Dict[int, List[bytearray]] = {}
+    for bitmap in bitmaps:
+        for key, container in bitmap._containers.items():
+            (sparse if isinstance(container, set) else dense).setdefault(key, []).append(container)
+    result = Bitmap()
+    for key in sparse.keys() | dense.keys():
+        offsets = set().union(*sparse.get(key, ()))
+        arrays = dense.get(key)
+        if arrays is None:
+            result._containers[key] = _dense(offsets) if len(offsets) > ARRAY_LIMIT else offsets
+            result._size += len(offsets)
+            continue
+        bits = _to_int(_dense(offsets)) if offsets else 0
+        for flags in arrays:
+            bits |= _to_int(flags)
+        result._containers[key] = _from_int(bits)
+        result._size += bits.bit_count()
+    return result
+
+
+def intersect(bitmaps: List[Bitmap]) -> Bitmap:
+    """AND of ``bitmaps``, starting from the smallest and stopping early once empty."""
+    bitmaps = sorted(bitmaps, key=len)
+    result = bitmaps[0]
+    for bitmap in bitmaps[1:]:
+        if not result:
+            break
+        result = result & bitmap
+    return result
+
+
+def _dense(offsets: Set[int]) -> bytearray:
+    flags = bytearray(CHUNK_SIZE)
+    _scatter(flags, offsets)
+    return flags
+
+
+def _scatter(flags: bytearray, offsets: Iterable[int]):
+    # Set flags[offset] = 1 for every offset without a Python-level loop
+    deque(map(flags.__setitem__, offsets, itertools.repeat(1)), maxlen=0)
+
+
+def _to_int(flags: bytearray) -> int:
+    return int.from_bytes(flags, "little")
+
+
+def _from_int(value: int) -> bytearray:
+    return bytearray(value.to_bytes(CHUNK_SIZE, "little"))
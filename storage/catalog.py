@@ -0,0 +1,35 @@
+import asyncio
+import functools
+from typing import Callable, Optional
+
+import config
+from storage.backend import StorageBackend, WouldBlock
+from storage.writer import CatalogWriter
+
+
+def create_catalog(backend: Optional[str] = None) -> StorageBackend:
+    """Build the storage backend named by ``backend`` or ``config.STORAGE_BACKEND``."""
+    backend = backend or config.STORAGE_BACKEND
+    if backend == "json":
+        from storage.json_store import JsonCatalogStore
+        return JsonCatalogStore()
+    if backend == "sqlite":
+        from storage.json_store import JsonCatalogStore
+        from storage.sqlite_store import SqliteCatalogStore
+        return SqliteCatalogStore(config.SQLITE_FILE, seed=JsonCatalogStore())
+    raise ValueError(f"Unknown storage backend {backend!r}, expected 'json' or 'sqlite'")
+
+
+# The catalog shared by all routers
+catalog = create_catalog()
+# Applies the catalog's mutations, one batch at a time
+writer = CatalogWriter(catalog)
+
+
+async def read(method: Callable, *args):
+    """Call ``method``, a reading method of the catalog, from the event loop:
+    in place when it can answer at once, otherwise in a worker thread."""
+    try:
+        return catalog.try_read(method, *args)
+    except WouldBlock:
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(method, *args))
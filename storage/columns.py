@@ -0,0 +1,115 @@
+from typing import Callable, Dict, List, Optional
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; without it the JSON store relies on its indexes alone
+    np = None
+
+from storage.records import BookRecord
+
+# Numeric columns and their dtypes; categorical columns hold dictionary codes
+NUMERIC_COLUMNS = {"price": "float64", "rating": "float64", "published_year": "int16"}
+CATEGORICAL_COLUMNS = ("genre", "author")
+
+INITIAL_CAPACITY = 1024
+
+
+def available() -> bool:
+    return np is not None
+
+
+class ColumnMirror:
+    """NumPy copy of the books' filterable and sortable fields, one row per ordinal.
+
+    Numeric fields are typed arrays; genre and author are int32 codes into
+    a dictionary of their normalized values, so a substring filter becomes
+    a membership test over the codes of the values that contain it. Rows of
+    deleted books stay behind, cleared in the ``live`` mask, as their
+    ordinals are never reused. Arrays grow by doubling.
+
+    ``matching()`` evaluates filters as vectorized boolean masks and
+    ``page()`` selects a sorted page with ``argpartition`` instead of
+    sorting every match.
+    """
+
+    def __init__(self):
+        if np is None:
+            raise ImportError("The column mirror requires NumPy")
+        self._size = 0
+        self._live = np.zeros(INITIAL_CAPACITY, dtype=bool)
+        self._numeric = {name: np.zeros(INITIAL_CAPACITY, dtype=dtype) for name, dtype in NUMERIC_COLUMNS.items()}
+        self._codes = {name: np.zeros(INITIAL_CAPACITY, dtype="int32") for name in CATEGORICAL_COLUMNS}
+        # Normalized value -> code, per categorical column
+        self._dictionaries: Dict[str, Dict[str, int]] = {name: {} for name in CATEGORICAL_COLUMNS}
+
+    def set(self, ordinal: int, book: BookRecord, keys: Dict[str, str]):
+        """Store ``book`` at ``ordinal``; ``keys`` are its normalized categorical values."""
+        if ordinal >= len(self._live):
+            self._grow(max(ordinal + 1, 2 * len(self._live)))
+        self._size = max(self._size, ordinal + 1)
+        self._live[ordinal] = True
+        for name, column in self._numeric.items():
+            column[ordinal] = getattr(book, name)
+        for name, column in self._codes.items():
+            dictionary = self._dictionaries[name]
+            column[ordinal] = dictionary.setdefault(keys[name], len(dictionary))
+
+    def set_value(self, ordinal: int, name: str, value):
+        """Change one numeric field of the book at ``ordinal``."""
+        self._numeric[name][ordinal] = value
+
+    def delete(self, ordinal: int):
+        self._live[ordinal] = False
+
+    def _grow(self, capacity: int):
+        def grown(column):
+            larger = np.zeros(capacity, dtype=column.dtype)
+            larger[:len(column)] = column
+            return larger
+        self._live = grown(self._live)
+        self._numeric = {name: grown(column) for name, column in self._numeric.items()}
+        self._codes = {name: grown(column) for name, column in self._codes.items()}
+
+    def matching(self, categories: Dict[str, List[str]], ranges: Dict[str, dict]) -> "np.ndarray":
+        """Ordinals, ascending, of the live rows whose categorical column holds
+        one of the given normalized values and whose numeric column is within
+        the given bounds (``gt``, ``gte``, ``lt``, ``lte``), for every column named."""
+        mask = self._live[:self._size].copy()
+        for name, keys in categories.items():
+            dictionary = self._dictionaries[name]
+            codes = [dictionary[key] for key in keys if key in dictionary]
+            mask &= np.isin(self._codes[name][:self._size], codes)
+        for name, bounds in ranges.items():
+            column = self._numeric[name][:self._size]
+            for bound, value in bounds.items():
+                if bound == "gt":
+                    mask &= column > value
+                elif bound == "gte":
+                    mask &= column >= value
+                elif bound == "lt":
+                    mask &= column < value
+                else:
+                    mask &= column <= value
+        return np.flatnonzero(mask)
+
+    def page(self, rows: "np.ndarray", field: Optional[str], descending: bool, start: int, stop: int,
+             book_id: Callable[[int], str]) -> List[int]:
+        """Ordinals of ``rows[start:stop]`` once ordered by ``(field, book id)``,
+        or left in ordinal order without a field.
+
+        Only the first ``stop`` rows are partitioned out, plus any tied with
+        the last of them, and just those are sorted with their ids.
+        """
+        if field is None:
+            return rows[start:stop].tolist()
+        if start >= len(rows):
+            return []
+        keys = self._numeric[field][rows]
+        if descending:
+            keys = -keys.astype("float64")
+        if stop < len(rows):
+            boundary = keys[np.argpartition(keys, stop - 1)[stop - 1]]
+            rows = rows[keys <= boundary]
+        values = self._numeric[field][rows].tolist()
+        ordered = sorted(zip(values, map(book_id, rows.tolist()), rows.tolist()), reverse=descending)
+        return [ordinal for _, _, ordinal in ordered[start:stop]]
@@ -0,0 +1,118 @@
+import math
+import re
+from typing import Dict, List
+
+from storage.indexes import MAX_EXPANSIONS, BKTree, levenshtein, max_edits
+
+TOKEN_RE = re.compile(r"\w+")
+
+STOPWORDS = {"a", "an", "and", "at", "by", "for", "in", "of", "on", "or", "the", "to", "with"}
+
+# Suffixes stripped by stem(), longest first, with their replacements
+SUFFIXES = (("ies", "y"), ("ing", ""), ("es", ""), ("ed", ""), ("ly", ""), ("s", ""))
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+
+def stem(token: str) -> str:
+    """Strip one common English suffix, keeping at least three characters."""
+    for suffix, replacement in SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            return token[:-len(suffix)] + replacement
+    return token
+
+
+def words(text: str) -> List[str]:
+    return TOKEN_RE.findall(text.casefold())
+
+
+def tokenize(text: str) -> List[str]:
+    return [stem(token) for token in words(text) if token not in STOPWORDS]
+
+
+class FullTextIndex:
+    """Inverted index of weighted book fields scored with BM25.
+
+    Each book, identified by its ordinal, is one document whose term
+    frequencies sum the field weights of every occurrence, so a title match
+    outranks the same word in a tag.
+    Fuzzy searches expand each query term to nearby dictionary terms, whose
+    scores are discounted by their edit distance.
+    """
+
+    def __init__(self, weights: Dict[str, float]):
+        self.weights = weights
+        self._postings: Dict[str, Dict[int, float]] = {}
+        self._doc_terms: Dict[int, Dict[str, float]] = {}
+        self._doc_lengths: Dict[int, float] = {}
+        self._total_length = 0.0
+        self._terms = BKTree()
+
+    def add(self, ordinal: int, fields: Dict[str, str]):
+        terms: Dict[str, float] = {}
+        for field, weight in self.weights.items():
+            for term in tokenize(fields[field]):
+                terms[term] = terms.get(term, 0.0) + weight
+        length = sum(terms.values())
+        self._doc_terms[ordinal] = terms
+        self._doc_lengths[ordinal] = length
+        self._total_length += length
+        for term, frequency in terms.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                self._terms.add(term)
+            postings[ordinal] = frequency
+
+    def remove(self, ordinal: int):
+        terms = self._doc_terms.pop(ordinal, None)
+        if terms is None:
+            return
+        self._total_length -= self._doc_lengths.pop(ordinal)
+        for term in terms:
+            postings = self._postings[term]
+            del postings[ordinal]
+            if not postings:
+                del self._postings[term]
+                self._terms.remove(term)
+
+    def search(self, text: str, fuzzy: bool = False) -> Dict[int, float]:
+        """BM25 score of every book matching at least one term of ``text``."""
+        scores: Dict[int, float] = {}
+        doc_count = len(self._doc_lengths)
+        if not doc_count:
+            return scores
+        average_length = self._total_length / doc_count or 1.0
+        lengths = self._doc_lengths
+        for token in set(tokenize(text)):
+            if fuzzy:
+                expansions = self._terms.search(token, max_edits(token), MAX_EXPANSIONS)
+            else:
+                expansions = [(0, token)]
+            for distance, term in expansions:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5)) / (1 + distance)
+                for ordinal, frequency in postings.items():
+                    norm = K1 * (1 - B + B * lengths[ordinal] / average_length)
+                    scores[ordinal] = scores.get(ordinal, 0.0) + idf * frequency * (K1 + 1) / (frequency + norm)
+        return scores
+
+    def matches(self, fields: Dict[str, str], text: str, fuzzy: bool = False) -> bool:
+        """Whether a book with ``fields``, indexed or not, matches a term of ``text``.
+
+        This is the test behind ``search()``'s matches, applied to one book;
+        fuzzy terms match every term within ``max_edits()``, without the
+        ``MAX_EXPANSIONS`` limit of dictionary lookups.
+        """
+        terms = {term for field in self.weights for term in tokenize(fields[field])}
+        for token in set(tokenize(text)):
+            if token in terms:
+                return True
+            limit = max_edits(token)
+            if fuzzy and any(levenshtein(token, term, limit) <= limit for term in terms):
+                return True
+        return False
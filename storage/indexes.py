@@ -0,0 +1,490 @@
+import bisect
+import re
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from storage.bitmap import Bitmap, union
+
+
+def normalize(value: str) -> str:
+    """Case-insensitive form of a string used for index keys and queries."""
+    return value.casefold()
+
+
+def trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+# Most dictionary terms a fuzzy lookup expands to, nearest first
+MAX_EXPANSIONS = 16
+
+# A BK-tree is rebuilt from its live terms once dead nodes outnumber this
+# fraction of them (and this minimum), so churn does not grow it forever
+BKTREE_DEAD_FRACTION = 0.5
+BKTREE_DEAD_MINIMUM = 64
+
+
+def max_edits(term: str) -> int:
+    """Edit distance tolerated for a query term: none for very short terms, more for long ones."""
+    if len(term) <= 2:
+        return 0
+    return 1 if len(term) <= 5 else 2
+
+
+def levenshtein(a: str, b: str, limit: Optional[int] = None) -> int:
+    """Edit distance between ``a`` and ``b``.
+
+    With ``limit``, gives up as soon as the distance must exceed it and
+    returns ``limit + 1``.
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    if limit is not None and len(a) - len(b) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if limit is not None and min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class BKTree:
+    """Terms arranged by edit distance, for typo-tolerant lookups.
+
+    Each child hangs off its parent at their distance, so the triangle
+    inequality rules out whole subtrees during a search. Removed terms are
+    only marked dead; they are revived if added again, and the tree is
+    rebuilt without them once they pass ``BKTREE_DEAD_FRACTION`` of the
+    live terms.
+    """
+
+    def __init__(self):
+        self._root: Optional[Tuple[str, Dict[int, tuple]]] = None
+        self._live: Set[str] = set()
+        self._nodes = 0
+
+    def add(self, term: str):
+        self._live.add(term)
+        if self._root is None:
+            self._root = (term, {})
+            self._nodes = 1
+            return
+        node = self._root
+        while True:
+            distance = levenshtein(term, node[0])
+            if distance == 0:
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = (term, {})
+                self._nodes += 1
+                return
+            node = child
+
+    def remove(self, term: str):
+        self._live.discard(term)
+        dead = self._nodes - len(self._live)
+        if dead > max(BKTREE_DEAD_MINIMUM, BKTREE_DEAD_FRACTION * len(self._live)):
+            self._rebuild()
+
+    def _rebuild(self):
+        # Live terms are re-added parents first, keeping the tree's shape
+        terms, level = [], [self._root] if self._root is not None else []
+        while level:
+            terms += [node_term for node_term, _ in level if node_term in self._live]
+            level = [child for _, children in level for child in children.values()]
+        self._root, self._live, self._nodes = None, set(), 0
+        for term in terms:
+            self.add(term)
+
+    def search(self, term: str, max_distance: int, limit: Optional[int] = None) -> List[Tuple[int, str]]:
+        """Live terms within ``max_distance`` of ``term`` as ``(distance, term)``, nearest first."""
+        matches = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node_term, children = stack.pop()
+            distance = levenshtein(term, node_term)
+            if distance <= max_distance and node_term in self._live:
+                matches.append((distance, node_term))
+            for edge, child in children.items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        matches.sort()
+        return matches[:limit]
+
+    def __len__(self):
+        return len(self._live)
+
+
+class TrigramIndex:
+    """Maps each trigram to the strings containing it, for substring search.
+
+    ``candidates()`` intersects the posting sets of a fragment's trigrams;
+    the result is a superset of the strings containing the fragment, so
+    callers verify each candidate.
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Set[str]] = {}
+
+    def add(self, text: str):
+        for gram in trigrams(text):
+            self._postings.setdefault(gram, set()).add(text)
+
+    def remove(self, text: str):
+        for gram in trigrams(text):
+            postings = self._postings.get(gram)
+            if postings is not None:
+                postings.discard(text)
+                if not postings:
+                    del self._postings[gram]
+
+    def candidates(self, fragment: str) -> Optional[Set[str]]:
+        """Strings sharing every trigram of ``fragment``; None if it is too short to tell."""
+        grams = trigrams(fragment)
+        if not grams:
+            return None
+        postings = []
+        for gram in grams:
+            matches = self._postings.get(gram)
+            if not matches:
+                return set()
+            postings.append(matches)
+        postings.sort(key=len)
+        return postings[0].intersection(*postings[1:])
+
+
+class InvertedIndex:
+    """Maps the normalized values of a field to the books carrying them.
+
+    Books are identified by their dense ordinal and each value's postings
+    are a ``Bitmap``, so combining filters is bitmap arithmetic. Values are
+    normalized once when a book is added, so queries only normalize their
+    own argument. With ``substring=True`` the distinct values are also
+    trigram-indexed so ``containing()`` avoids scanning them; with
+    ``fuzzy=True`` they are kept in a BK-tree for ``similar()``.
+    """
+
+    def __init__(self, substring: bool = False, fuzzy: bool = False):
+        self._postings: Dict[str, Bitmap] = {}
+        # First spelling seen of each normalized value, for display
+        self._labels: Dict[str, str] = {}
+        self._trigrams = TrigramIndex() if substring else None
+        self._terms = BKTree() if fuzzy else None
+
+    def add(self, ordinal: int, values: Iterable[str]):
+        for value in values:
+            key = normalize(value)
+            postings = self._postings.get(key)
+            if postings is None:
+                postings = self._postings[key] = Bitmap()
+                self._labels[key] = value
+                if self._trigrams is not None:
+                    self._trigrams.add(key)
+                if self._terms is not None:
+                    self._terms.add(key)
+            postings.add(ordinal)
+
+    def remove(self, ordinal: int, values: Iterable[str]):
+        for value in values:
+            key = normalize(value)
+            postings = self._postings.get(key)
+            if postings is not None:
+                postings.discard(ordinal)
+                if not postings:
+                    del self._postings[key]
+                    del self._labels[key]
+                    if self._trigrams is not None:
+                        self._trigrams.remove(key)
+                    if self._terms is not None:
+                        self._terms.remove(key)
+
+    def get(self, value: str) -> Bitmap:
+        """Books whose value equals ``value`` (case-insensitively); not to be modified."""
+        return self._postings.get(normalize(value)) or Bitmap()
+
+    def containing(self, fragment: str) -> Bitmap:
+        """Books whose value contains ``fragment`` (case-insensitively); not to be modified."""
+        return self.union_of(self.keys_containing(fragment))
+
+    def keys_containing(self, fragment: str) -> List[str]:
+        """Normalized values containing ``fragment`` (case-insensitively).
+
+        Only distinct values are checked: those sharing the fragment's
+        trigrams when available, otherwise all of them.
+        """
+        fragment = normalize(fragment)
+        keys = self._trigrams.candidates(fragment) if self._trigrams is not None else None
+        if keys is None:
+            keys = self._postings.keys()
+        return [key for key in keys if fragment in key]
+
+    def union_of(self, keys: List[str]) -> Bitmap:
+        """Books carrying any of the normalized values ``keys``; not to be modified."""
+        if len(keys) == 1:
+            return self._postings[keys[0]]
+        return union(self._postings[key] for key in keys)
+
+    def count_of(self, keys: List[str]) -> int:
+        """Postings of the normalized values ``keys``: a book counts once per key it carries."""
+        return sum(len(self._postings[key]) for key in keys)
+
+    def label(self, value: str) -> str:
+        """How an indexed ``value`` is displayed: the first spelling of it added."""
+        return self._labels[normalize(value)]
+
+    def counts(self, books: Optional[Bitmap] = None) -> Dict[str, int]:
+        """Number of books (of ``books``, if given) per value, keyed by label; zero counts are left out."""
+        labels = self._labels
+        if books is None:
+            return {labels[key]: len(postings) for key, postings in self._postings.items()}
+        counts = {}
+        for key, postings in self._postings.items():
+            count = len(books & postings)
+            if count:
+                counts[labels[key]] = count
+        return counts
+
+    def similar(self, value: str) -> Bitmap:
+        """Books whose value is within ``max_edits()`` of ``value``.
+
+        At most ``MAX_EXPANSIONS`` of the nearest values are used.
+        """
+        key = normalize(value)
+        return union(self._postings[term] for _, term in self._terms.search(key, max_edits(key), MAX_EXPANSIONS))
+
+    def __len__(self):
+        return len(self._postings)
+
+
+class SortedIndex:
+    """Book ids ordered by a field, for range predicates and sorted listings.
+
+    Entries are ``(value, book_id)`` pairs kept sorted in a plain list, so
+    equal values are ordered by id and every entry has a unique position a
+    cursor can point at. A range lookup is two bisections plus a slice of
+    the matching ids.
+    """
+
+    def __init__(self):
+        self._keys: List[Tuple[Any, str]] = []
+        self._ids: List[str] = []
+
+    def add(self, book_id: str, value):
+        position = bisect.bisect_left(self._keys, (value, book_id))
+        self._keys.insert(position, (value, book_id))
+        self._ids.insert(position, book_id)
+
+    def remove(self, book_id: str, value):
+        position = bisect.bisect_left(self._keys, (value, book_id))
+        if position < len(self._keys) and self._keys[position] == (value, book_id):
+            del self._keys[position]
+            del self._ids[position]
+
+    def span(self, gt=None, gte=None, lt=None, lte=None) -> Tuple[int, int]:
+        """Positions ``[start, stop)`` of the entries satisfying every given bound."""
+        start, stop = 0, len(self._keys)
+        if gt is not None:
+            start = max(start, bisect.bisect_right(self._keys, gt, key=_value))
+        if gte is not None:
+            start = max(start, bisect.bisect_left(self._keys, gte, key=_value))
+        if lt is not None:
+            stop = min(stop, bisect.bisect_left(self._keys, lt, key=_value))
+        if lte is not None:
+            stop = min(stop, bisect.bisect_right(self._keys, lte, key=_value))
+        return start, max(start, stop)
+
+    def between(self, **bounds) -> List[str]:
+        """Ids of books within the bounds accepted by ``span()``, in value order."""
+        start, stop = self.span(**bounds)
+        return self._ids[start:stop]
+
+    def bucket_counts(self, edges) -> List[int]:
+        """Number of entries below ``edges[0]``, between each pair of edges, and from the last edge up."""
+        positions = [0] + [bisect.bisect_left(self._keys, edge, key=_value) for edge in edges] + [len(self._keys)]
+        return [stop - start for start, stop in zip(positions, positions[1:])]
+
+    def ordered_ids(self, descending: bool = False, after: Optional[Tuple[Any, str]] = None) -> Iterator[str]:
+        """Ids in ``(value, id)`` order, optionally resuming past the ``after`` key."""
+        ids = self._ids
+        if not descending:
+            start = 0 if after is None else bisect.bisect_right(self._keys, tuple(after))
+            return (ids[i] for i in range(start, len(ids)))
+        stop = len(ids) if after is None else bisect.bisect_left(self._keys, tuple(after))
+        return (ids[i] for i in range(stop - 1, -1, -1))
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class ValueDirectory:
+    """Distinct values of a field with the number of books carrying each.
+
+    Values are reference counted: one appears with its first book and goes
+    with its last. Each also keeps the rating sum of its books, so its
+    average rating is at hand. Values are kept in case-insensitive order,
+    making the values with a given prefix a contiguous range that two
+    bisections find, and any page of it a slice.
+    """
+
+    def __init__(self):
+        # (normalized value, value), sorted
+        self._keys: List[Tuple[str, str]] = []
+        # Value -> [books, rating sum in hundredths, exact under repeated updates]
+        self._stats: Dict[str, List[int]] = {}
+
+    def add(self, value: str, rating: float):
+        stats = self._stats.get(value)
+        if stats is None:
+            stats = self._stats[value] = [0, 0]
+            bisect.insort(self._keys, (normalize(value), value))
+        stats[0] += 1
+        stats[1] += round(rating * 100)
+
+    def rerate(self, value: str, previous: float, rating: float):
+        """Change the rating of one book with ``value`` from ``previous`` to ``rating``."""
+        self._stats[value][1] += round(rating * 100) - round(previous * 100)
+
+    def remove(self, value: str, rating: float):
+        stats = self._stats[value]
+        stats[0] -= 1
+        stats[1] -= round(rating * 100)
+        if not stats[0]:
+            del self._stats[value]
+            del self._keys[bisect.bisect_left(self._keys, (normalize(value), value))]
+
+    def page(self, prefix: str = "", offset: int = 0,
+             limit: Optional[int] = None) -> Tuple[int, List[Tuple[str, int, float]]]:
+        """Number of values starting with ``prefix`` (case-insensitively), and
+        up to ``limit`` of them from ``offset`` on as ``(value, books, average rating)``."""
+        prefix = normalize(prefix)
+        start = bisect.bisect_left(self._keys, (prefix,))
+        stop = bisect.bisect_left(self._keys, (prefix + "\U0010ffff",), start)
+        first = start + offset
+        last = stop if limit is None else min(stop, first + limit)
+        stats = self._stats
+        return stop - start, [(value, stats[value][0], round(stats[value][1] / stats[value][0] / 100, 2))
+                              for _, value in self._keys[first:last]]
+
+    def __len__(self):
+        return len(self._stats)
+
+
+# Prefix queries whose completions are remembered until the next change
+COMPLETION_CACHE_SIZE = 1024
+
+
+def word_suffixes(text: str) -> Set[str]:
+    """``text`` and its suffixes starting at each word, the keys a completion is found under."""
+    return {text} | {text[match.start():] for match in re.finditer(r"\w+", text)}
+
+
+class CompletionIndex:
+    """Sorted array of completion keys for prefix autocomplete.
+
+    Every distinct value is stored under its normalized form and under the
+    suffix starting at each of its words, so "sil" completes "The Silent
+    River". Each value carries how many books have it and their review
+    count, its popularity, and the values are also kept in rank order:
+    most popular first, then most books, then earliest indexed.
+
+    A narrow prefix is answered by bisecting the keys and ranking the few
+    matches; a broad one by walking the rank order until enough values
+    match, whichever touches fewer entries. Results are cached per prefix
+    until the index changes, so repeated keystrokes are dictionary hits.
+    """
+
+    def __init__(self):
+        self._keys: List[Tuple[str, str]] = []
+        # Normalized value -> [display value, books, popularity, sequence]
+        self._values: Dict[str, list] = {}
+        # Normalized value -> its word suffixes, each preceded by a NUL
+        self._starts: Dict[str, str] = {}
+        # (-popularity, -books, sequence, normalized value), best first
+        self._ranked: List[Tuple[int, int, int, str]] = []
+        self._sequence = 0
+        self._cache: Dict[Tuple[str, int], List[Tuple[str, int, int]]] = {}
+
+    def add(self, value: str, popularity: int = 0):
+        key = normalize(value)
+        if key not in self._values:
+            self._values[key] = [value, 0, 0, self._sequence]
+            self._sequence += 1
+            suffixes = word_suffixes(key)
+            self._starts[key] = "".join("\0" + suffix for suffix in suffixes)
+            for suffix in suffixes:
+                bisect.insort(self._keys, (suffix, key))
+            bisect.insort(self._ranked, self._rank(key))
+        self._update(key, 1, popularity)
+
+    def remove(self, value: str, popularity: int = 0):
+        key = normalize(value)
+        if key not in self._values:
+            return
+        self._update(key, -1, -popularity)
+        if self._values[key][1] <= 0:
+            self._discard(self._ranked, self._rank(key))
+            for suffix in word_suffixes(key):
+                self._discard(self._keys, (suffix, key))
+            del self._values[key]
+            del self._starts[key]
+
+    def adjust(self, value: str, popularity: int):
+        """Add ``popularity`` (possibly negative) to an indexed value."""
+        key = normalize(value)
+        if key in self._values:
+            self._update(key, 0, popularity)
+
+    def _rank(self, key: str) -> Tuple[int, int, int, str]:
+        _, books, popularity, sequence = self._values[key]
+        return -popularity, -books, sequence, key
+
+    def _update(self, key: str, books: int, popularity: int):
+        self._discard(self._ranked, self._rank(key))
+        entry = self._values[key]
+        entry[1] += books
+        entry[2] += popularity
+        bisect.insort(self._ranked, self._rank(key))
+        self._cache.clear()
+
+    @staticmethod
+    def _discard(entries: list, entry: tuple):
+        position = bisect.bisect_left(entries, entry)
+        if position < len(entries) and entries[position] == entry:
+            del entries[position]
+
+    def complete(self, prefix: str, limit: int) -> List[Tuple[str, int, int]]:
+        """Top ``limit`` values with a word starting with ``prefix``, as ``(value, books, popularity)``."""
+        prefix = normalize(prefix)
+        completions = self._cache.get((prefix, limit))
+        if completions is None:
+            start = bisect.bisect_left(self._keys, (prefix,))
+            stop = bisect.bisect_left(self._keys, (prefix + "\U0010ffff",))
+            matching = stop - start
+            if matching * matching <= limit * len(self._ranked):
+                # Few matches: rank them directly
+                best = sorted({self._rank(key) for _, key in self._keys[start:stop]})[:limit]
+            else:
+                # Many matches: walking the rank order finds enough of them early
+                best = []
+                marked, starts = "\0" + prefix, self._starts
+                for rank in self._ranked:
+                    if marked in starts[rank[3]]:
+                        best.append(rank)
+                        if len(best) == limit:
+                            break
+            completions = [tuple(self._values[rank[3]][:3]) for rank in best]
+            if len(self._cache) >= COMPLETION_CACHE_SIZE:
+                self._cache.clear()
+            self._cache[(prefix, limit)] = completions
+        return completions
+
+    def __len__(self):
+        return len(self._values)
+
+
+def _value(key: Tuple[Any, str]):
+    return key[0]
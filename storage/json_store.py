@@ -0,0 +1,1059 @@
+import bisect
+import functools
+import heapq
+import itertools
+import json
+import logging
+import operator
+import os
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import config
+from storage import columns
+from storage.backend import (COMPLETION_FIELDS, FACET_BUCKETS, BookQuery, SnapshotExpired, StorageBackend,
+                             WouldBlock, bucket_labels, top_counts)
+from storage.bitmap import Bitmap, intersect
+from storage.fulltext import FullTextIndex, words
+from storage.indexes import (CompletionIndex, InvertedIndex, SortedIndex, ValueDirectory, levenshtein, max_edits,
+                             normalize)
+from storage.planner import Predicate, QueryPlan, execute, within
+from storage.records import BookRecord
+from storage.snapshot import Snapshot, open_snapshot, write_snapshot
+from storage.wal import MutationLog
+
+BOOKS_FILE = os.path.join(config.DATA_DIR, "books.json")
+REVIEWS_FILE = os.path.join(config.DATA_DIR, "reviews.json")
+
+# Number of logged mutations after which the log is folded into the snapshot
+COMPACT_THRESHOLD = 1000
+
+# Filtered results smaller than 1/SORT_HITS_RATIO of the catalog are sorted
+# directly; larger ones are paged by walking a presorted ordering
+SORT_HITS_RATIO = 8
+
+# A vectorized pass over the column mirror costs about as much as handling
+# 1/COLUMN_SCAN_RATIO of the catalog in Python; range queries whose most
+# selective filter matches more books than that are answered by the mirror
+COLUMN_SCAN_RATIO = 64
+COLUMN_MIRROR_MODES = ("auto", "on", "off")
+
+# Most replaced book versions kept for pinned walks, however recent
+VERSION_HISTORY_LIMIT = 100_000
+
+# Catalog state kept in the binary snapshot, by section. A section is
+# unpickled on first use of any of its attributes; attributes referring to
+# the same objects must share a section.
+SNAPSHOT_SECTIONS = {
+    "books": ("_books", "_ordinals", "_book_ids"),
+    "reviews": ("_reviews", "_reviews_by_book", "_rating_sums"),
+    "by_author": ("_by_author",),
+    "by_genre": ("_by_genre",),
+    "by_title": ("_by_title",),
+    "by_tag": ("_by_tag",),
+    "title_words": ("_title_words",),
+    "author_words": ("_author_words",),
+    "sorted": ("_by_price", "_by_year", "_by_rating", "_sorted"),
+    "by_id": ("_by_id",),
+    "values": ("_genres", "_authors"),
+    "completions": ("_completions",),
+    "fulltext": ("_fulltext",),
+    "columns": ("_columns",),
+}
+SNAPSHOT_ATTRIBUTES = {attribute: section for section, attributes in SNAPSHOT_SECTIONS.items()
+                       for attribute in attributes}
+
+
+def _contains_test(field: str, fragment: str) -> Callable[[BookRecord], bool]:
+    fragment = normalize(fragment)
+    return lambda book: fragment in normalize(getattr(book, field))
+
+
+def _range_test(field: str, bounds: dict) -> Callable[[BookRecord], bool]:
+    return lambda book: within(getattr(book, field), **bounds)
+
+
+def _fuzzy_test(field: str, fragment: str) -> Callable[[BookRecord], bool]:
+    # Like the index: the fragment itself, or every word of it within a few typos of a word
+    contains = _contains_test(field, fragment)
+    fragment_words = [(word, max_edits(word)) for word in words(fragment)]
+
+    def test(book: BookRecord) -> bool:
+        if contains(book):
+            return True
+        book_words = words(getattr(book, field))
+        return bool(fragment_words) and all(any(levenshtein(word, candidate, limit) <= limit
+                                                for candidate in book_words)
+                                            for word, limit in fragment_words)
+    return test
+
+
+def _book_test(query: BookQuery, fulltext: FullTextIndex) -> Callable[[BookRecord], bool]:
+    """Whether a book, indexed or not, matches every filter of ``query`` as the indexes would find it."""
+    tests = []
+    if query.q:
+        tests.append(lambda book: fulltext.matches(_text_fields(book), query.q, query.fuzzy))
+    for name in ("title", "author", "genre"):
+        fragment = getattr(query, name)
+        if fragment:
+            fuzzy = query.fuzzy and name != "genre"
+            tests.append(_fuzzy_test(name, fragment) if fuzzy else _contains_test(name, fragment))
+    if query.tag:
+        tag = normalize(query.tag)
+        tests.append(lambda book: any(normalize(book_tag) == tag for book_tag in book.tags))
+    for name, bounds in _range_bounds(query).items():
+        tests.append(_range_test(name, bounds))
+    return lambda book: all(test(book) for test in tests)
+
+
+def _text_fields(book: BookRecord) -> Dict[str, str]:
+    """The fields of ``book`` the full-text index scores."""
+    return {"title": book.title, "author": book.author, "tags": " ".join(book.tags)}
+
+
+def _range_bounds(query: BookQuery) -> Dict[str, dict]:
+    """The price and published_year bounds ``query`` sets, as ``SortedIndex.span()`` arguments."""
+    year_from = max((y for y in (query.published_year, query.year_from) if y is not None), default=None)
+    year_to = min((y for y in (query.published_year, query.year_to) if y is not None), default=None)
+    ranges = {"price": {"gt": query.price_gt, "gte": query.price_gte, "lt": query.price_lt, "lte": query.price_lte},
+              "published_year": {"gte": year_from, "lte": year_to}}
+    ranges = {name: {bound: value for bound, value in bounds.items() if value is not None}
+              for name, bounds in ranges.items()}
+    return {name: bounds for name, bounds in ranges.items() if bounds}
+
+
+class JsonCatalogStore(StorageBackend):
+    """Storage backend holding the books and reviews data files in memory.
+
+    The JSON files are a snapshot: they are parsed once by ``load()`` and the
+    mutation log is replayed on top of them. After that every read is served
+    from memory and every mutation is appended to the log. Once the log grows
+    past ``COMPACT_THRESHOLD`` records a background thread folds it into a
+    fresh snapshot. Mutating methods return once their log records are
+    durable under the configured durability mode.
+
+    Building the indexes costs far more than parsing the files, so the
+    loaded state is also kept in a binary snapshot (``snapshot_file``, next
+    to the books file by default) written after a load from the JSON files
+    and by ``close()``. While the JSON files are unchanged, ``load()`` maps
+    it instead and each index is unpickled on its first use; see
+    ``storage.snapshot``. The JSON files stay the canonical snapshot.
+
+    Every logged mutation is a new catalog ``version``. Book records are
+    immutable, so a change swaps in a new record, and the one it replaced
+    is kept for ``config.VERSION_RETENTION_S`` seconds. A keyset walk
+    pinned to a version (``BookQuery.snapshot``) is answered from the
+    current indexes with the books changed since swapped back to their
+    records at that version. Versions number the shared mutation log, so
+    any process sharing it can continue a walk another one started. They
+    pin what a walk sees, not what it waits for: readers and writers share
+    one set of indexes, updated in place, so reads still take the store's
+    lock, as below.
+
+    Locks are taken in one order: the shared log, then the store. Writers
+    wait for other processes' writes on the log alone and hold the store
+    only while applying a mutation in memory, so a read waits at most for
+    that. ``try_read()`` does not wait even then, nor catch up with other
+    processes or unpickle an index, which leaves those to a worker thread.
+    """
+
+    def __init__(self, books_file: str = BOOKS_FILE, reviews_file: str = REVIEWS_FILE,
+                 log: Optional[MutationLog] = None, column_mirror: Optional[str] = None,
+                 snapshot_file: Optional[str] = None):
+        column_mirror = column_mirror or config.COLUMN_MIRROR
+        if column_mirror not in COLUMN_MIRROR_MODES:
+            raise ValueError(f"Unknown column mirror mode {column_mirror!r}, expected one of {COLUMN_MIRROR_MODES}")
+        self.books_file = books_file
+        self.reviews_file = reviews_file
+        self.snapshot_file = snapshot_file or os.path.join(os.path.dirname(books_file), "catalog.snapshot")
+        self.log = log or MutationLog()
+        self.column_mirror = column_mirror == "on" or (column_mirror == "auto" and columns.available())
+        self._lock = threading.RLock()
+        self._compact_lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
+        # Thread applying other processes' writes, started by the first read
+        self._follower: Optional[threading.Thread] = None
+        # Per thread, whether it is inside try_read()
+        self._local = threading.local()
+        self._compacting = False
+        # Thread inside batch(), and the last log record it has to wait on
+        self._batch_thread: Optional[int] = None
+        self._batch_seq = 0
+        self._reset()
+
+    def _reset(self):
+        # Primary-key indexes; dicts keep insertion order, which is the listing order
+        self._books: Dict[str, BookRecord] = {}
+        self._reviews: Dict[str, dict] = {}
+        # Review ids per book (dicts as insertion-ordered sets) and the running
+        # rating sum and count each book's average is derived from
+        self._reviews_by_book: Dict[str, Dict[str, None]] = {}
+        self._rating_sums: Dict[str, int] = {}
+        # Dense ordinal of each book, in insertion order, and the book id at
+        # each ordinal (None once deleted). Index postings are bitmaps of
+        # ordinals, so ascending ordinals are the listing order.
+        self._ordinals: Dict[str, int] = {}
+        self._book_ids: List[Optional[str]] = []
+        # Secondary indexes over normalized field values
+        self._by_author = InvertedIndex(substring=True)
+        self._by_genre = InvertedIndex(substring=True)
+        self._by_title = InvertedIndex(substring=True)
+        self._by_tag = InvertedIndex()
+        # Individual title and author words, for fuzzy matching
+        self._title_words = InvertedIndex(fuzzy=True)
+        self._author_words = InvertedIndex(fuzzy=True)
+        self._by_price = SortedIndex()
+        self._by_year = SortedIndex()
+        self._by_rating = SortedIndex()
+        self._sorted = {"price": self._by_price, "published_year": self._by_year, "rating": self._by_rating}
+        # Id order, which keyset pagination uses when no sort field is given
+        self._by_id = SortedIndex()
+        # Distinct genres and authors with their book counts and rating sums
+        self._genres = ValueDirectory()
+        self._authors = ValueDirectory()
+        # Unfiltered facet counts by facet size, until the next book change
+        self._facets_cache: Dict[int, Dict[str, Dict[str, int]]] = {}
+        # Prefix completions per field, ranked by review count
+        self._completions = {field: CompletionIndex() for field in COMPLETION_FIELDS}
+        # Relevance-ranked search for q=, weighting title matches highest
+        self._fulltext = FullTextIndex({"title": 2.0, "author": 1.0, "tags": 1.0})
+        # Typed arrays of the numeric, genre and author fields, by ordinal
+        self._columns = columns.ColumnMirror() if self.column_mirror else None
+        # Catalog version: the log version of the last mutation applied. Per
+        # book changed since, the versions it was replaced at with the record
+        # it had until then, oldest first; every such change in version order
+        # with when it happened; and the oldest version still reconstructible.
+        self._version = 0
+        self._history: Dict[str, List[Tuple[int, Optional[BookRecord]]]] = {}
+        self._changes: deque = deque()
+        self._oldest_version = 0
+        # Binary snapshot the state above is still being unpickled from, and
+        # whether the snapshot file holds the state as it is now
+        self._snapshot: Optional[Snapshot] = None
+        self._snapshot_current = False
+
+    def __getattr__(self, name):
+        # Only reached for attributes not set: state load() left in the binary snapshot
+        section = SNAPSHOT_ATTRIBUTES.get(name)
+        snapshot = self.__dict__.get("_snapshot")
+        if section is None or snapshot is None:
+            raise AttributeError(f"{type(self).__name__!r} object has no attribute {name!r}")
+        if self._nonblocking():
+            raise WouldBlock
+        with self._snapshot_lock:
+            if name not in self.__dict__:
+                self.__dict__.update(snapshot.load(section))
+        return self.__dict__[name]
+
+    # Loading and persistence
+
+    def load(self):
+        with self._compact_lock:
+            self.log.close()
+            # Other processes sharing the log wait, so no record is missed between replay and open
+            with self.log.locked(), self._lock:
+                fingerprint = self._load_files()
+            # Written once they no longer wait
+            if fingerprint is not None:
+                with self._lock:
+                    self._write_binary_snapshot(fingerprint)
+
+    def _load_files(self) -> Optional[dict]:
+        """Load the catalog under ``log.locked()``; returns the fingerprint to
+        write a binary snapshot with if it had to be rebuilt from the data files."""
+        self._reset()
+        # Taken before the files are read: a compaction replacing them after
+        # that leaves a snapshot written with it stale rather than wrong
+        fingerprint = self._fingerprint()
+        snapshot = open_snapshot(self.snapshot_file, fingerprint)
+        if snapshot is not None:
+            for attribute in SNAPSHOT_ATTRIBUTES:
+                del self.__dict__[attribute]
+            self._snapshot = snapshot
+            self._snapshot_current = True
+        else:
+            for book in self._read_file(self.books_file):
+                self._put_book(BookRecord.from_dict(book))
+            for review in self._read_file(self.reviews_file):
+                self._put_review(review)
+
+        # A log being compacted, or left over from an interrupted compaction, precedes the live one
+        pending = self.log.compacting_path
+        for path in (pending, self.log.path):
+            replayed = 0
+            for record in self.log.replay(path):
+                self._apply(record)
+                replayed += 1
+
+        self.log.open(replayed)
+        if self.log.abandoned_rotation():
+            self._write_snapshot(*self._dump())
+            os.remove(pending)
+            self.log.truncate()
+            snapshot, fingerprint = None, self._fingerprint()
+        # Walks pinned before the load cannot be reconstructed
+        self._version = self._oldest_version = self.log.version
+        self._history.clear()
+        self._changes.clear()
+        if snapshot is not None and not replayed:
+            logging.info(f"Mapped binary snapshot {self.snapshot_file}.")
+        else:
+            logging.info(f"Loaded {len(self._books)} books and {len(self._reviews)} reviews.")
+        return fingerprint if snapshot is None else None
+
+    def close(self):
+        with self._compact_lock:
+            # Caught up under the log, the catalog holds everything the data
+            # files do, even if another process compacted into them meanwhile
+            with self.log.locked(), self._lock:
+                self._catch_up()
+                fingerprint = self._fingerprint()
+            with self._lock:
+                self._follower = None
+                self.log.close()
+                # Replaying the log again over the saved state is harmless
+                if not self._snapshot_current:
+                    self._write_binary_snapshot(fingerprint)
+
+    def preload(self):
+        with self._lock:
+            for attribute in SNAPSHOT_ATTRIBUTES:
+                getattr(self, attribute)
+
+    def after_fork(self):
+        # A thread of the parent may have held these; it does not exist here
+        self._lock = threading.RLock()
+        self._compact_lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
+        self._follower = None
+        self._batch_thread = None
+        self.log.after_fork()
+
+    # Other processes' writes
+
+    def _follow(self):
+        """Apply the records other processes have appended to the log since
+        the last call. Reads call it first, so they see every write that
+        completed before they started; a background thread keeps up between."""
+        if self._follower is None:
+            self._start_follower()
+        if self.log.changed():
+            if self._nonblocking():
+                raise WouldBlock
+            self._catch_up()
+
+    def _catch_up(self):
+        with self._lock:
+            records = self.log.tail()
+            if records is not None:
+                for record in records:
+                    self._apply(record)
+                return
+        logging.warning("Missed a rotation of the shared mutation log; reloading the catalog.")
+        with self.log.locked(), self._lock:
+            fingerprint = self._load_files()
+        if fingerprint is not None:
+            with self._lock:
+                self._write_binary_snapshot(fingerprint)
+
+    def _start_follower(self):
+        self._follower = threading.Thread(target=self._run_follower, name="catalog-follower", daemon=True)
+        self._follower.start()
+
+    def _run_follower(self):
+        # Until close() or a fork replaces it
+        while self._follower is threading.current_thread():
+            time.sleep(config.FOLLOW_INTERVAL_MS / 1000)
+            try:
+                self._follow()
+            except Exception:
+                logging.exception("Failed to apply the mutation log of other processes.")
+
+    @contextmanager
+    def _writing(self):
+        """Hold the log and the store for a mutation, caught up with every other writer's."""
+        with self.log.locked(), self._lock:
+            self._follow()
+            yield
+
+    @contextmanager
+    def _reading(self):
+        """Hold the store for a read, caught up with every write that completed
+        before; inside ``try_read()``, raises WouldBlock rather than wait."""
+        self._follow()
+        if not self._lock.acquire(blocking=not self._nonblocking()):
+            raise WouldBlock
+        try:
+            yield
+        finally:
+            self._lock.release()
+
+    def _nonblocking(self) -> bool:
+        return getattr(self._local, "nonblocking", False)
+
+    def try_read(self, method: Callable, *args):
+        self._local.nonblocking = True
+        try:
+            return method(*args)
+        finally:
+            self._local.nonblocking = False
+
+    @property
+    def version(self) -> Optional[int]:
+        self._follow()
+        return self._version
+
+    @contextmanager
+    def batch(self):
+        """Hold the log across the mutations made inside, and wait for them to
+        be durable once, on exit. The store is only held while each mutation
+        is applied, so reads go on in between."""
+        if self._batch_thread == threading.get_ident():
+            yield
+            return
+        with self.log.locked():
+            self._batch_thread, self._batch_seq = threading.get_ident(), 0
+            try:
+                yield
+            finally:
+                seq, self._batch_thread = self._batch_seq, None
+        self.log.wait(seq)
+
+    def _wait(self, seq: int):
+        """Wait for log record ``seq`` to be durable, or leave it to the enclosing batch."""
+        if self._batch_thread == threading.get_ident():
+            self._batch_seq = seq
+        else:
+            self.log.wait(seq)
+
+    def _fingerprint(self) -> dict:
+        """What a binary snapshot must have been written from to be loaded:
+        the data files as they are now, and the same column mirror setting."""
+        fingerprint = {"column_mirror": self.column_mirror}
+        for name, path in (("books_file", self.books_file), ("reviews_file", self.reviews_file)):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                fingerprint[name] = None
+                continue
+            fingerprint[name] = [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+        return fingerprint
+
+    def _snapshot_sections(self) -> dict:
+        return {section: {attribute: getattr(self, attribute) for attribute in attributes}
+                for section, attributes in SNAPSHOT_SECTIONS.items()}
+
+    def _write_binary_snapshot(self, fingerprint: dict):
+        """Write the catalog as a binary snapshot of the data files ``fingerprint`` describes."""
+        try:
+            write_snapshot(self.snapshot_file, fingerprint, self._snapshot_sections())
+        except OSError as e:
+            # Only startup time depends on it
+            logging.error(f"Could not write binary snapshot {self.snapshot_file}: {e}")
+            return
+        self._snapshot_current = True
+
+    def _read_file(self, path):
+        if not os.path.exists(path):
+            logging.error(f"Data file {path} not found.")
+            return []
+        with open(path, "r") as f:
+            try:
+                return json.load(f)
+            except json.JSONDecodeError:
+                # Serving (and later compacting) an empty catalog would lose data
+                logging.error(f"Data file {path} is malformed.")
+                raise
+
+    def _write_file(self, path, data):
+        # Write a sibling file and rename it over the original so a crash
+        # leaves either the old or the new snapshot, never a truncated one
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        dir_fd = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    def _write_snapshot(self, books, reviews):
+        self._write_file(self.books_file, books)
+        self._write_file(self.reviews_file, reviews)
+
+    def dump(self) -> Tuple[List[dict], List[dict]]:
+        """Return every book and review, e.g. to seed another backend."""
+        self._follow()
+        return self._dump()
+
+    def _dump(self) -> Tuple[List[dict], List[dict]]:
+        # Records are replaced rather than mutated: copy the references under
+        # the lock and convert them without holding up writers or readers
+        with self._lock:
+            books, reviews = list(self._books.values()), list(self._reviews.values())
+        return [book.to_dict() for book in books], reviews
+
+    def compact(self):
+        """Fold the mutation log into a fresh snapshot of the data files, and a
+        binary snapshot of the catalog fingerprinted to them."""
+        with self._compact_lock:
+            try:
+                # Most of the log reaches the disk before the store is held up for the rotation
+                self.log.flush()
+                with self._writing():
+                    # Another process sharing the log may be compacting it already
+                    if self.log.records == 0 or os.path.exists(self.log.compacting_path):
+                        return
+                    self.log.rotate()
+                    pid = self._fork_snapshot_writer()
+                    if pid is None:
+                        books, reviews = self._dump()
+                # Waited for without holding up the store or the log
+                if pid is None:
+                    self._write_snapshot(books, reviews)
+                else:
+                    _, status = os.waitpid(pid, 0)
+                    if os.waitstatus_to_exitcode(status) != 0:
+                        # The rotated log stays, to be folded in by the next load
+                        raise OSError(f"Compaction child {pid} failed to write the catalog snapshots")
+                self.log.remove_rotated()
+                logging.info("Compacted the mutation log into the catalog snapshots.")
+            finally:
+                self._compacting = False
+
+    def _fork_snapshot_writer(self) -> Optional[int]:
+        """Fork a child that writes the catalog as it is now to the data files,
+        then to a binary snapshot fingerprinted to them; returns its pid, or
+        None if the process cannot fork. The child sees the catalog as of the
+        fork however the parent changes it meanwhile, and loads the sections
+        still left in the mapped snapshot itself."""
+        if not hasattr(os, "fork"):
+            return None
+        try:
+            pid = os.fork()
+        except OSError as e:
+            logging.warning(f"Could not fork to compact the catalog, writing the data files only: {e}")
+            return None
+        if pid:
+            return pid
+        status = 1
+        try:
+            # Only this thread was forked; the others may have held this lock
+            self._snapshot_lock = threading.Lock()
+            self._write_snapshot([book.to_dict() for book in self._books.values()], list(self._reviews.values()))
+            write_snapshot(self.snapshot_file, self._fingerprint(), self._snapshot_sections())
+            status = 0
+        finally:
+            os._exit(status)
+
+    def _commit(self, op: str, kind: str, record_id: str, data: Optional[dict] = None) -> int:
+        """Log and apply a mutation; returns the log sequence number to ``wait()`` on."""
+        # Caught up with the log and holding it, so this is the version append() publishes
+        record = {"op": op, "kind": kind, "id": record_id, "v": self.log.version + 1}
+        if data is not None:
+            record["data"] = data
+        # Validated before it is logged, and applied only once it is, so a
+        # failed append leaves the catalog and its version as they were
+        book = self._build(record)
+        seq = self.log.append(record)
+        self._apply(record, book)
+        # The log counts every process's records; whichever crosses the threshold compacts
+        if self.log.records >= COMPACT_THRESHOLD and not self._compacting:
+            self._compacting = True
+            threading.Thread(target=self.compact, name="catalog-compaction", daemon=True).start()
+        return seq
+
+    def _build(self, record: dict) -> Optional[BookRecord]:
+        """The book record a create or update of a book results in, validated
+        as it is built; None for any other mutation."""
+        if record["kind"] != "book" or record["op"] not in ("create", "update"):
+            return None
+        if record["op"] == "create":
+            return BookRecord.from_dict(record["data"])
+        book = self._books.get(record["id"])
+        return None if book is None else book.replace(record["data"])
+
+    def _apply(self, record: dict, built: Optional[BookRecord] = None):
+        """Apply a logged mutation; ``built`` is its ``_build()`` result, if already made."""
+        self._snapshot_current = False
+        op, record_id, data = record["op"], record["id"], record.get("data")
+        # Records logged before versions were recorded only occur while loading
+        version = record.get("v", self._version)
+        if record["kind"] == "book":
+            book = self._books.get(record_id)
+            # New records are built, and so validated, before any index is touched
+            if op in ("create", "update"):
+                built = built or self._build(record)
+                if built is not None and book is not None and data.keys() == {"rating"}:
+                    # Review changes only move the rating
+                    self._put_rating(book, built)
+                elif built is not None:
+                    self._put_book(built)
+            elif op == "delete" and book is not None:
+                self._remove_book(book)
+                for review_id in list(self._reviews_by_book.get(record_id, ())):
+                    self._remove_review(self._reviews[review_id])
+            if self._books.get(record_id) is not book:
+                self._keep_version(record_id, book, version)
+        else:
+            review = self._reviews.get(record_id)
+            if op == "create":
+                if review is not None:
+                    self._remove_review(review)
+                self._put_review(data)
+            elif op == "delete" and review is not None:
+                self._remove_review(review)
+        self._version = version
+
+    def _keep_version(self, book_id: str, previous: Optional[BookRecord], version: int):
+        """Remember that ``previous`` was the book until ``version``."""
+        now = time.monotonic()
+        self._history.setdefault(book_id, []).append((version, previous))
+        self._changes.append((now, version, book_id))
+        expired = now - config.VERSION_RETENTION_S
+        while self._changes and (self._changes[0][0] < expired or len(self._changes) > VERSION_HISTORY_LIMIT):
+            _, version, expired_id = self._changes.popleft()
+            history = self._history[expired_id]
+            del history[0]
+            if not history:
+                del self._history[expired_id]
+            self._oldest_version = version
+
+    def _book_at(self, book_id: str, version: int) -> Optional[BookRecord]:
+        """The record of ``book_id`` at ``version``; None if it did not exist then."""
+        for changed, previous in self._history.get(book_id, ()):
+            if changed > version:
+                return previous
+        return self._books.get(book_id)
+
+    def _changed_since(self, version: int) -> Dict[str, Optional[BookRecord]]:
+        """Books changed after ``version``, with their records at ``version``."""
+        changed = {}
+        for _, changed_version, book_id in reversed(self._changes):
+            if changed_version <= version:
+                break
+            changed[book_id] = None
+        return {book_id: self._book_at(book_id, version) for book_id in changed}
+
+    def _put_review(self, review: dict):
+        book_id = review["book_id"]
+        self._reviews[review["id"]] = review
+        self._reviews_by_book.setdefault(book_id, {})[review["id"]] = None
+        self._rating_sums[book_id] = self._rating_sums.get(book_id, 0) + review["rating"]
+        self._adjust_popularity(book_id, 1)
+
+    def _remove_review(self, review: dict):
+        book_id = review["book_id"]
+        del self._reviews[review["id"]]
+        book_reviews = self._reviews_by_book[book_id]
+        del book_reviews[review["id"]]
+        if book_reviews:
+            self._rating_sums[book_id] -= review["rating"]
+        else:
+            del self._reviews_by_book[book_id]
+            del self._rating_sums[book_id]
+        self._adjust_popularity(book_id, -1)
+
+    def _adjust_popularity(self, book_id: str, reviews: int):
+        book = self._books.get(book_id)
+        if book is not None:
+            for field, index in self._completions.items():
+                index.adjust(getattr(book, field), reviews)
+
+    def _put_book(self, book: BookRecord):
+        """Insert or replace a book, keeping every index in step.
+
+        ``book`` was validated when built, so indexing it cannot fail halfway.
+        """
+        book_id = book.id
+        previous = self._books.get(book_id)
+        if previous is None:
+            ordinal = self._ordinals[book_id] = len(self._book_ids)
+            self._book_ids.append(book_id)
+        else:
+            ordinal = self._ordinals[book_id]
+            self._unindex_book(previous)
+        self._books[book_id] = book
+        self._facets_cache.clear()
+        self._by_author.add(ordinal, [book.author])
+        self._by_genre.add(ordinal, [book.genre])
+        self._by_title.add(ordinal, [book.title])
+        self._title_words.add(ordinal, words(book.title))
+        self._author_words.add(ordinal, words(book.author))
+        self._by_tag.add(ordinal, book.tags)
+        self._by_price.add(book_id, book.price)
+        self._by_year.add(book_id, book.published_year)
+        self._by_rating.add(book_id, book.rating)
+        self._by_id.add(book_id, book_id)
+        self._genres.add(book.genre, book.rating)
+        self._authors.add(book.author, book.rating)
+        self._fulltext.add(ordinal, _text_fields(book))
+        if self._columns is not None:
+            self._columns.set(ordinal, book, {"genre": normalize(book.genre), "author": normalize(book.author)})
+        popularity = len(self._reviews_by_book.get(book_id, ()))
+        for field, index in self._completions.items():
+            index.add(getattr(book, field), popularity)
+
+    def _put_rating(self, previous: BookRecord, book: BookRecord):
+        """Replace ``previous`` with ``book``, which differs only in its rating,
+        touching just the indexes that hold ratings."""
+        self._books[book.id] = book
+        self._by_rating.remove(book.id, previous.rating)
+        self._by_rating.add(book.id, book.rating)
+        self._genres.rerate(book.genre, previous.rating, book.rating)
+        self._authors.rerate(book.author, previous.rating, book.rating)
+        if self._columns is not None:
+            self._columns.set_value(self._ordinals[book.id], "rating", book.rating)
+
+    def _remove_book(self, book: BookRecord):
+        self._unindex_book(book)
+        del self._books[book.id]
+        ordinal = self._ordinals.pop(book.id)
+        self._book_ids[ordinal] = None
+        if self._columns is not None:
+            self._columns.delete(ordinal)
+
+    def _unindex_book(self, book: BookRecord):
+        book_id = book.id
+        ordinal = self._ordinals[book_id]
+        self._facets_cache.clear()
+        self._by_author.remove(ordinal, [book.author])
+        self._by_genre.remove(ordinal, [book.genre])
+        self._by_title.remove(ordinal, [book.title])
+        self._title_words.remove(ordinal, words(book.title))
+        self._author_words.remove(ordinal, words(book.author))
+        self._by_tag.remove(ordinal, book.tags)
+        self._by_price.remove(book_id, book.price)
+        self._by_year.remove(book_id, book.published_year)
+        self._by_rating.remove(book_id, book.rating)
+        self._by_id.remove(book_id, book_id)
+        self._genres.remove(book.genre, book.rating)
+        self._authors.remove(book.author, book.rating)
+        self._fulltext.remove(ordinal)
+        popularity = len(self._reviews_by_book.get(book_id, ()))
+        for field, index in self._completions.items():
+            index.remove(getattr(book, field), popularity)
+
+    # Books
+
+    def _index_candidates(self, query: BookQuery, scores: Optional[Dict[int, float]],
+                          plan: QueryPlan) -> Optional[Bitmap]:
+        """Ordinals of the books matching every filter of ``query``.
+
+        ``scores`` are the full-text matches for ``query.q``, if any. Returns
+        None when the query has no filters.
+        """
+        books, book_ids = self._books, self._book_ids
+        return execute(self._predicates(query, scores), lambda ordinal: books[book_ids[ordinal]], plan)
+
+    def _predicates(self, query: BookQuery, scores: Optional[Dict[int, float]]) -> List[Predicate]:
+        """The filters of ``query``, with match estimates from the indexes' statistics."""
+        predicates = []
+        if scores is not None:
+            predicates.append(Predicate("q", len(scores), functools.partial(Bitmap, scores), cost=len(scores)))
+        for name, index, word_index in (("title", self._by_title, self._title_words),
+                                        ("author", self._by_author, self._author_words),
+                                        ("genre", self._by_genre, None)):
+            fragment = getattr(query, name)
+            if not fragment:
+                continue
+            if query.fuzzy and word_index is not None:
+                # Typo matches are only known once looked up, so look them up now
+                matches = index.containing(fragment) | self._fuzzy_matches(word_index, fragment)
+                predicates.append(Predicate(name, len(matches), lambda matches=matches: matches))
+                continue
+            keys = index.keys_containing(fragment)
+            count = index.count_of(keys)
+            predicates.append(Predicate(name, count, functools.partial(index.union_of, keys),
+                                        cost=count if len(keys) > 1 else 0,
+                                        test=_contains_test(name, fragment)))
+        if query.tag:
+            postings = self._by_tag.get(query.tag)
+            predicates.append(Predicate("tag", len(postings), lambda: postings))
+        for name, bounds in _range_bounds(query).items():
+            index = self._sorted[name]
+            start, stop = index.span(**bounds)
+            predicates.append(Predicate(name, stop - start, functools.partial(self._range_bitmap, index, bounds),
+                                        cost=stop - start, test=_range_test(name, bounds)))
+        return predicates
+
+    def _range_bitmap(self, index: SortedIndex, bounds: dict) -> Bitmap:
+        return Bitmap(map(self._ordinals.__getitem__, index.between(**bounds)))
+
+    @staticmethod
+    def _fuzzy_matches(index: InvertedIndex, text: str) -> Bitmap:
+        """Books having, for every word of ``text``, a word within a few typos of it."""
+        postings = [index.similar(word) for word in words(text)]
+        return intersect(postings) if postings else Bitmap()
+
+    def search_books(self, query: BookQuery) -> Tuple[int, List[dict]]:
+        return self._search(query, QueryPlan())
+
+    def explain_search(self, query: BookQuery) -> Tuple[int, List[dict], dict]:
+        plan = QueryPlan()
+        total, books = self._search(query, plan)
+        return total, books, plan.to_dict()
+
+    def _search(self, query: BookQuery, plan: QueryPlan) -> Tuple[int, List[dict]]:
+        with self._reading():
+            # Every filter is answered by an inverted, sorted or full-text index,
+            # or checked on the rows the more selective ones leave; broad range
+            # queries are answered by the column mirror instead
+            scores = None
+            if query.q:
+                with plan.step("q", "score") as step:
+                    scores = self._fulltext.search(query.q, fuzzy=query.fuzzy)
+                    step["rows"] = len(scores)
+            start_idx = 0 if query.after is not None else (query.page - 1) * query.page_size
+            stop_idx = start_idx + query.page_size
+            predicates = self._predicates(query, scores)
+            if self._answers_from_columns(query, predicates):
+                return self._search_columns(query, start_idx, stop_idx, plan)
+            books, book_ids = self._books, self._book_ids
+            candidates = execute(predicates, lambda ordinal: books[book_ids[ordinal]], plan)
+            if query.snapshot is not None and query.after is not None:
+                return self._search_pinned(query, candidates, plan)
+            total = len(self._books) if candidates is None else len(candidates)
+            if scores is not None and not query.sort_by and query.after is None:
+                # Relevance order; ties keep listing order
+                access = "rank by relevance"
+                ordering = (self._book_ids[ordinal] for ordinal in
+                            heapq.nlargest(stop_idx, candidates, key=lambda ordinal: (scores[ordinal], -ordinal)))
+            else:
+                access, ordering = self._ordered_ids(candidates, query)
+            with plan.step("page", access) as step:
+                page = [self._books[book_id].to_dict() for book_id in itertools.islice(ordering, start_idx, stop_idx)]
+                step["rows"] = len(page)
+            return total, page
+
+    def _search_pinned(self, query: BookQuery, candidates: Optional[Bitmap],
+                       plan: QueryPlan) -> Tuple[int, List[dict]]:
+        """Keyset page of ``query`` over the catalog at version ``query.snapshot``.
+
+        ``candidates`` are the current matches. Books changed since the
+        version are dropped from them; their records at the version that
+        match are sorted and merged back in.
+        """
+        if query.snapshot < self._oldest_version:
+            raise SnapshotExpired(f"Catalog version {query.snapshot} is no longer kept; start a new walk")
+        with plan.step("snapshot", f"changes since version {query.snapshot}") as step:
+            changed = self._changed_since(query.snapshot)
+            test = _book_test(query, self._fulltext)
+            then = [book for book in changed.values() if book is not None and test(book)]
+            step["rows"] = len(changed)
+        ordinals = self._ordinals
+        current = len(self._books) if candidates is None else len(candidates)
+        current -= sum(1 for book_id in changed
+                       if book_id in ordinals and (candidates is None or ordinals[book_id] in candidates))
+        total = current + len(then)
+
+        field = query.sort_by or "id"
+        key = lambda book: (getattr(book, field), book.id)
+        if query.after:
+            after = tuple(query.after)
+            then = [book for book in then if (key(book) < after if query.sort_desc else key(book) > after)]
+        then.sort(key=key, reverse=query.sort_desc)
+        access, ordering = self._ordered_ids(candidates, query)
+        books = self._books
+        unchanged = (books[book_id] for book_id in ordering if book_id not in changed)
+        with plan.step("page", f"{access}, merge changes") as step:
+            merged = heapq.merge(unchanged, then, key=key, reverse=query.sort_desc)
+            page = [book.to_dict() for book in itertools.islice(merged, query.page_size)]
+            step["rows"] = len(page)
+        return total, page
+
+    def _answers_from_columns(self, query: BookQuery, predicates: List[Predicate]) -> bool:
+        """Whether the column mirror should answer ``query``: it filters on a
+        range and only on mirrored fields, and no index narrows it much."""
+        if self._columns is None or query.after is not None or not _range_bounds(query):
+            return False
+        if query.q or query.title or query.tag or (query.fuzzy and query.author):
+            return False
+        return min(predicate.estimate for predicate in predicates) * COLUMN_SCAN_RATIO > len(self._books)
+
+    def _search_columns(self, query: BookQuery, start_idx: int, stop_idx: int,
+                        plan: QueryPlan) -> Tuple[int, List[dict]]:
+        categories = {name: index.keys_containing(getattr(query, name))
+                      for name, index in (("genre", self._by_genre), ("author", self._by_author))
+                      if getattr(query, name)}
+        with plan.step("+".join([*categories, *_range_bounds(query)]), "column mask") as step:
+            rows = self._columns.matching(categories, _range_bounds(query))
+            step["rows"] = len(rows)
+        access = f"argpartition by {query.sort_by}" if query.sort_by else "insertion order"
+        with plan.step("page", access) as step:
+            book_ids = self._book_ids
+            ordinals = self._columns.page(rows, query.sort_by, query.sort_desc, start_idx, stop_idx,
+                                          book_ids.__getitem__)
+            page = [self._books[book_ids[ordinal]].to_dict() for ordinal in ordinals]
+            step["rows"] = len(page)
+        return len(rows), page
+
+    def _ordered_ids(self, candidates: Optional[Bitmap], query: BookQuery) -> Tuple[str, Iterable[str]]:
+        """Ids of ``candidates`` (or every book) in the order requested by ``query``,
+        and how that order is obtained.
+
+        Sorted listings and keyset pages follow a sorted index; plain listings
+        follow insertion order, which is the candidates' own ordinal order.
+        """
+        if not query.sort_by and query.after is None:
+            return "insertion order", (iter(self._books) if candidates is None
+                                       else map(self._book_ids.__getitem__, candidates))
+        field = query.sort_by or "id"
+        index = self._sorted[query.sort_by] if query.sort_by else self._by_id
+        ordering = index.ordered_ids(query.sort_desc, after=query.after or None)
+        if candidates is None:
+            return f"walk {field} index", ordering
+        if len(candidates) * SORT_HITS_RATIO >= len(self._books):
+            # Walk the presorted ordering, stopping once the page is full
+            ordinals = self._ordinals
+            return f"walk {field} index", (book_id for book_id in ordering if ordinals[book_id] in candidates)
+
+        # Few hits: sorting them is cheaper than walking past the misses
+        books = self._books
+        book_ids = [self._book_ids[ordinal] for ordinal in candidates]
+        hits = sorted(((getattr(books[book_id], field), book_id) for book_id in book_ids), reverse=query.sort_desc)
+        if query.after:
+            after = tuple(query.after)
+            hits = [key for key in hits if (key < after if query.sort_desc else key > after)]
+        return f"sort by {field}", (book_id for _, book_id in hits)
+
+    def get_book(self, book_id: str) -> Optional[dict]:
+        self._follow()
+        book = self._books.get(book_id)
+        return None if book is None else book.to_dict()
+
+    def add_book(self, book: dict) -> dict:
+        with self._writing():
+            seq = self._commit("create", "book", book["id"], book)
+        self._wait(seq)
+        return book
+
+    def update_book(self, book_id: str, changes: dict) -> Optional[dict]:
+        with self._writing():
+            if book_id not in self._books:
+                return None
+            seq = self._commit("update", "book", book_id, changes)
+            book = self.get_book(book_id)
+        self._wait(seq)
+        return book
+
+    def delete_book(self, book_id: str) -> bool:
+        """Remove a book together with its reviews; False if it does not exist."""
+        with self._writing():
+            if book_id not in self._books:
+                return False
+            seq = self._commit("delete", "book", book_id)
+        self._wait(seq)
+        return True
+
+    def genres(self, prefix: str = "", page: int = 1, page_size: Optional[int] = None) -> Tuple[int, List[dict]]:
+        return self._distinct_values(self._genres, prefix, page, page_size)
+
+    def authors(self, prefix: str = "", page: int = 1, page_size: Optional[int] = None) -> Tuple[int, List[dict]]:
+        return self._distinct_values(self._authors, prefix, page, page_size)
+
+    def _distinct_values(self, directory: ValueDirectory, prefix: str, page: int,
+                         page_size: Optional[int]) -> Tuple[int, List[dict]]:
+        offset = 0 if page_size is None else (page - 1) * page_size
+        with self._reading():
+            total, values = directory.page(prefix, offset, page_size)
+        return total, [{"name": name, "books": books, "average_rating": rating} for name, books, rating in values]
+
+    def facet_counts(self, query: BookQuery, size: int = 10) -> Dict[str, Dict[str, int]]:
+        with self._reading():
+            scores = self._fulltext.search(query.q, fuzzy=query.fuzzy) if query.q else None
+            candidates = self._index_candidates(query, scores, QueryPlan())
+            if candidates is None and size in self._facets_cache:
+                return self._facets_cache[size]
+            matches = len(self._books) if candidates is None else len(candidates)
+            # Matching books, resolved once for every facet that scans them
+            docs = None
+            facets = {}
+            for name, index in (("genre", self._by_genre), ("author", self._by_author), ("tag", self._by_tag)):
+                # Intersect each value's postings with the matches, unless
+                # there are fewer matches than values to intersect
+                if candidates is None or len(index) <= matches:
+                    counts = index.counts(candidates)
+                else:
+                    docs = docs if docs is not None else self._matching_books(candidates)
+                    counts = self._scan_counts(index, name, docs)
+                facets[name] = top_counts(counts, size)
+            for name, edges in FACET_BUCKETS.items():
+                if candidates is None:
+                    counts = self._sorted[name].bucket_counts(edges)
+                else:
+                    docs = docs if docs is not None else self._matching_books(candidates)
+                    values = sorted(map(operator.attrgetter(name), docs))
+                    positions = [0] + [bisect.bisect_left(values, edge) for edge in edges] + [len(values)]
+                    counts = [stop - start for start, stop in zip(positions, positions[1:])]
+                facets[name] = dict(zip(bucket_labels(edges), counts))
+            if candidates is None:
+                # Unfiltered counts only change with the books themselves
+                self._facets_cache[size] = facets
+        return facets
+
+    def _matching_books(self, candidates: Bitmap) -> List[BookRecord]:
+        return list(map(self._books.__getitem__, map(self._book_ids.__getitem__, candidates)))
+
+    @staticmethod
+    def _scan_counts(index: InvertedIndex, name: str, docs: List[BookRecord]) -> Dict[str, int]:
+        if name == "tag":
+            keys = itertools.chain.from_iterable({normalize(tag) for tag in book.tags} for book in docs)
+        else:
+            keys = map(normalize, map(operator.attrgetter(name), docs))
+        return {index.label(key): count for key, count in Counter(keys).items()}
+
+    def autocomplete(self, prefix: str, field: Optional[str] = None, limit: int = 10) -> List[dict]:
+        with self._reading():
+            completions = [{"value": value, "field": name, "books": books, "reviews": reviews}
+                           for name in ([field] if field else COMPLETION_FIELDS)
+                           for value, books, reviews in self._completions[name].complete(prefix, limit)]
+        # Stable, so ties keep each field's own order
+        completions.sort(key=lambda c: (-c["reviews"], -c["books"]))
+        return completions[:limit]
+
+    # Reviews
+
+    def list_reviews(self, book_id: str, page: int = 1, page_size: Optional[int] = None) -> List[dict]:
+        with self._reading():
+            review_ids = self._reviews_by_book.get(book_id, {})
+            if page_size is not None:
+                start_idx = (page - 1) * page_size
+                review_ids = itertools.islice(review_ids, start_idx, start_idx + page_size)
+            return [self._reviews[review_id] for review_id in review_ids]
+
+    def add_review(self, review: dict) -> Optional[dict]:
+        with self._writing():
+            if review["book_id"] not in self._books:
+                return None
+            self._commit("create", "review", review["id"], review)
+            seq = self._recalculate_book_rating(review["book_id"])
+        self._wait(seq)
+        return review
+
+    def delete_review(self, review_id: str) -> Optional[dict]:
+        with self._writing():
+            review = self._reviews.get(review_id)
+            if review is None:
+                return None
+            self._commit("delete", "review", review_id)
+            seq = self._recalculate_book_rating(review["book_id"])
+        self._wait(seq)
+        return review
+
+    def _recalculate_book_rating(self, book_id: str) -> int:
+        # O(1) from the running aggregates kept by _put_review/_remove_review
+        review_count = len(self._reviews_by_book.get(book_id, ()))
+        if review_count:
+            avg_rating = self._rating_sums[book_id] / review_count
+        else:
+            avg_rating = 0.0
+
+        return self._commit("update", "book", book_id, {"rating": round(avg_rating, 2)})
+
@@ -0,0 +1,103 @@
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+from storage.bitmap import Bitmap
+from storage.records import BookRecord
+
+# Checking one candidate book against a predicate costs about as much as
+# adding this many index entries to a bitmap
+ROW_CHECK_COST = 10
+
+
+@dataclass
+class Predicate:
+    """One filter of a query, as the planner sees it."""
+    name: str
+    # Number of matching books, estimated from index statistics
+    estimate: int
+    # Ordinals of the matching books, looked up in the index
+    fetch: Callable[[], Bitmap]
+    # Index entries fetch() has to materialize; 0 for a stored posting list
+    cost: int = 0
+    # Whether a book matches, so the predicate can be checked on the rows
+    # of the other predicates instead; None if only the index can answer it
+    test: Optional[Callable[[BookRecord], bool]] = None
+
+
+class QueryPlan:
+    """The steps a search went through, with their row counts and timings.
+
+    Each step is ``{"step", "access", "estimated_rows", "rows", "ms"}``;
+    ``to_dict()`` adds the total time since the plan was created.
+    """
+
+    def __init__(self):
+        self.steps: List[dict] = []
+        self._start = time.perf_counter()
+
+    def step(self, name: str, access: str, estimated_rows: Optional[int] = None) -> "_Step":
+        """Context manager timing its block as a step; the block may set the step's ``rows``."""
+        return _Step(self.steps, {"step": name, "access": access, "estimated_rows": estimated_rows, "rows": None})
+
+    def to_dict(self) -> dict:
+        return {"steps": self.steps, "ms": (time.perf_counter() - self._start) * 1000}
+
+
+class _Step:
+    # A class rather than @contextmanager: plans are recorded on every search
+    __slots__ = ("_steps", "_step", "_start")
+
+    def __init__(self, steps: List[dict], step: dict):
+        self._steps = steps
+        self._step = step
+
+    def __enter__(self) -> dict:
+        self._start = time.perf_counter()
+        return self._step
+
+    def __exit__(self, *exc_info):
+        self._step["ms"] = (time.perf_counter() - self._start) * 1000
+        self._steps.append(self._step)
+
+
+def within(value, gt=None, gte=None, lt=None, lte=None) -> bool:
+    """Whether ``value`` satisfies every given bound, as ``SortedIndex.span()`` applies them."""
+    return ((gt is None or value > gt) and (gte is None or value >= gte)
+            and (lt is None or value < lt) and (lte is None or value <= lte))
+
+
+def execute(predicates: List[Predicate], book_at: Callable[[int], BookRecord],
+            plan: QueryPlan) -> Optional[Bitmap]:
+    """Ordinals of the books matching every predicate; None if there are none.
+
+    The predicate with the fewest estimated matches drives the query. The
+    others, most selective first, are intersected from their indexes unless
+    checking the remaining candidates directly is cheaper than materializing
+    their index entries; those become residual filters, checked in a single
+    pass over the final candidates. ``book_at`` maps an ordinal to its book.
+    """
+    if not predicates:
+        return None
+    driver, *others = sorted(predicates, key=lambda predicate: predicate.estimate)
+    with plan.step(driver.name, "drive", driver.estimate) as step:
+        candidates = driver.fetch()
+        step["rows"] = len(candidates)
+    residual = []
+    for predicate in others:
+        if not candidates:
+            break
+        if predicate.test is not None and len(candidates) * ROW_CHECK_COST < predicate.cost:
+            residual.append(predicate)
+            continue
+        with plan.step(predicate.name, "index", predicate.estimate) as step:
+            candidates = candidates & predicate.fetch()
+            step["rows"] = len(candidates)
+    if residual and candidates:
+        tests = [predicate.test for predicate in residual]
+        name = "+".join(predicate.name for predicate in residual)
+        with plan.step(name, "residual", min(predicate.estimate for predicate in residual)) as step:
+            candidates = Bitmap([ordinal for ordinal in candidates
+                                 if all(test(book_at(ordinal)) for test in tests)])
+            step["rows"] = len(candidates)
+    return candidates
@@ -0,0 +1,69 @@
+import sys
+from typing import List, Tuple
+
+BOOK_FIELDS = ("id", "title", "author", "genre", "price", "tags", "published_year", "isbn", "rating")
+
+# Types of the scalar fields; numbers may be ints or floats, but not booleans
+FIELD_TYPES = {"id": str, "title": str, "author": str, "genre": str, "price": (int, float),
+               "published_year": int, "isbn": str, "rating": (int, float)}
+
+
+class BookRecord:
+    """Compact in-memory form of a book, as held by the JSON store.
+
+    A ``__slots__`` object stores its fields inline instead of in a per-book
+    dict, and tags are a tuple instead of a list. Genres, authors and tags
+    repeat across many books, so they are interned: every book shares one
+    copy of each distinct string. Records are immutable by convention;
+    ``replace()`` returns an updated copy. Field types are checked when a
+    record is built, raising ValueError, so an invalid book never reaches
+    the indexes. The store hands out plain dicts
+    from ``to_dict()``, shaped like the ``Book`` model.
+    """
+
+    __slots__ = BOOK_FIELDS
+
+    id: str
+    title: str
+    author: str
+    genre: str
+    price: float
+    tags: Tuple[str, ...]
+    published_year: int
+    isbn: str
+    rating: float
+
+    def __init__(self, id: str, title: str, author: str, genre: str, price: float, tags: List[str],
+                 published_year: int, isbn: str, rating: float):
+        values = {"id": id, "title": title, "author": author, "genre": genre, "price": price,
+                  "published_year": published_year, "isbn": isbn, "rating": rating}
+        for name, value in values.items():
+            if not isinstance(value, FIELD_TYPES[name]) or isinstance(value, bool):
+                raise ValueError(f"Book field {name!r} has invalid value {value!r}")
+        if not isinstance(tags, (list, tuple)) or not all(isinstance(tag, str) for tag in tags):
+            raise ValueError(f"Book field 'tags' has invalid value {tags!r}")
+        self.id = id
+        self.title = title
+        self.author = sys.intern(author)
+        self.genre = sys.intern(genre)
+        self.price = price
+        self.tags = tuple(sys.intern(tag) for tag in tags)
+        self.published_year = published_year
+        self.isbn = isbn
+        self.rating = rating
+
+    @classmethod
+    def from_dict(cls, book: dict) -> "BookRecord":
+        return cls(book["id"], book["title"], book["author"], book["genre"], book["price"], book["tags"],
+                   book["published_year"], book["isbn"], book["rating"])
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "title": self.title, "author": self.author, "genre": self.genre,
+                "price": self.price, "tags": list(self.tags), "published_year": self.published_year,
+                "isbn": self.isbn, "rating": self.rating}
+
+    def replace(self, changes: dict) -> "BookRecord":
+        """A copy of this record with ``changes`` (field -> value) applied."""
+        book = self.to_dict()
+        book.update(changes)
+        return BookRecord.from_dict(book)
@@ -0,0 +1,113 @@
+import gc
+import json
+import logging
+import mmap
+import os
+import pickle
+import struct
+from typing import Any, Dict, Optional
+
+# Bump whenever the layout below or a class stored in a snapshot changes;
+# snapshots written by another version are ignored and rebuilt
+SNAPSHOT_VERSION = 2
+
+MAGIC = b"ALZSNAP\n"
+# Magic, version, then offset and length of the JSON directory
+HEADER = struct.Struct("<8sIQQ")
+# Sections and buffers start on this boundary so NumPy arrays are aligned
+ALIGNMENT = 64
+
+
+class Snapshot:
+    """A memory-mapped binary snapshot of the catalog and its indexes.
+
+    The file is a header, then named sections, each a pickle (protocol 5)
+    whose large buffers are stored out of band right after it, then a JSON
+    directory of the sections and the ``fingerprint`` they were written
+    with. ``load()`` unpickles one section; its out-of-band buffers are not
+    copied but read in place from the mapping, so NumPy arrays are backed by
+    the page cache that every worker mapping the file shares. The mapping is
+    copy-on-write: pages are only copied into the process once written.
+
+    Snapshots are written by the store from its own state and read back
+    with ``pickle``, like any data file of the store they must be trusted.
+    """
+
+    def __init__(self, path: str, mapping: mmap.mmap, directory: Dict[str, Any]):
+        self.path = path
+        self.fingerprint = directory["fingerprint"]
+        self._mapping = mapping
+        self._sections = directory["sections"]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._sections
+
+    def load(self, name: str):
+        offset, length, buffers = self._sections[name]
+        view = memoryview(self._mapping)
+        # Otherwise the collector keeps rescanning the objects being unpickled
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            return pickle.loads(view[offset:offset + length],
+                                buffers=[view[start:start + size] for start, size in buffers])
+        finally:
+            if collecting:
+                gc.enable()
+
+
+def open_snapshot(path: str, fingerprint: Dict[str, Any]) -> Optional[Snapshot]:
+    """Map the snapshot at ``path``; None if it is missing, was written by
+    another ``SNAPSHOT_VERSION`` or with a different ``fingerprint``."""
+    try:
+        with open(path, "rb") as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    except (FileNotFoundError, ValueError):
+        # ValueError: an empty file cannot be mapped
+        return None
+    header = mapping[:HEADER.size]
+    if len(header) < HEADER.size or HEADER.unpack(header)[:2] != (MAGIC, SNAPSHOT_VERSION):
+        logging.info(f"Ignoring binary snapshot {path}: not written by snapshot version {SNAPSHOT_VERSION}.")
+        mapping.close()
+        return None
+    _, _, directory_offset, directory_length = HEADER.unpack(header)
+    directory = json.loads(mapping[directory_offset:directory_offset + directory_length])
+    if directory["fingerprint"] != fingerprint:
+        logging.info(f"Ignoring binary snapshot {path}: its data files have changed since.")
+        mapping.close()
+        return None
+    return Snapshot(path, mapping, directory)
+
+
+def write_snapshot(path: str, fingerprint: Dict[str, Any], sections: Dict[str, Any]):
+    """Write ``sections`` (name -> picklable object) as a snapshot of the data
+    described by ``fingerprint``, replacing ``path`` atomically."""
+    # A per-process name, as several workers may write the same snapshot
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    directory = {"fingerprint": fingerprint, "sections": {}}
+    with open(tmp_path, "wb") as f:
+        f.write(bytes(HEADER.size))
+        for name, value in sections.items():
+            buffers = []
+            data = pickle.dumps(value, protocol=5, buffer_callback=buffers.append)
+            offset = _write_aligned(f, data)
+            placed = []
+            for buffer in buffers:
+                raw = buffer.raw()
+                placed.append((_write_aligned(f, raw), raw.nbytes))
+            directory["sections"][name] = (offset, len(data), placed)
+        encoded = json.dumps(directory).encode()
+        directory_offset = _write_aligned(f, encoded)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, SNAPSHOT_VERSION, directory_offset, len(encoded)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _write_aligned(f, data) -> int:
+    padding = -f.tell() % ALIGNMENT
+    f.write(bytes(padding))
+    offset = f.tell()
+    f.write(data)
+    return offset
@@ -0,0 +1,453 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import config
+from storage.backend import (COMPLETION_FIELDS, FACET_BUCKETS, SORT_FIELDS, BookQuery, StorageBackend,
+                             bucket_labels)
+from storage.fulltext import STOPWORDS, words
+from storage.indexes import MAX_EXPANSIONS, levenshtein, max_edits
+from storage.planner import QueryPlan
+
+# WAL-mode synchronous level matching each durability mode
+SYNCHRONOUS = {"fsync": "FULL", "group": "NORMAL", "periodic": "OFF"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    author TEXT NOT NULL,
+    genre TEXT NOT NULL,
+    price REAL NOT NULL,
+    tags TEXT NOT NULL,
+    published_year INTEGER NOT NULL,
+    isbn TEXT NOT NULL,
+    rating REAL NOT NULL DEFAULT 0.0
+);
+CREATE INDEX IF NOT EXISTS idx_books_author ON books (author);
+CREATE INDEX IF NOT EXISTS idx_books_genre ON books (genre);
+CREATE INDEX IF NOT EXISTS idx_books_price ON books (price, id);
+CREATE INDEX IF NOT EXISTS idx_books_published_year ON books (published_year, id);
+CREATE INDEX IF NOT EXISTS idx_books_rating ON books (rating, id);
+
+CREATE TABLE IF NOT EXISTS book_tags (
+    book_id TEXT NOT NULL,
+    tag TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_book_tags_tag ON book_tags (tag, book_id);
+CREATE INDEX IF NOT EXISTS idx_book_tags_book_id ON book_tags (book_id);
+
+CREATE TABLE IF NOT EXISTS reviews (
+    id TEXT PRIMARY KEY,
+    book_id TEXT NOT NULL,
+    reviewer TEXT NOT NULL,
+    rating INTEGER NOT NULL,
+    comment TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_reviews_book_id ON reviews (book_id);
+"""
+
+# Full-text index over the books table, kept in step by triggers
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5 (
+    title, author, tags, content='books', content_rowid='rowid', tokenize='porter unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN
+    INSERT INTO books_fts (rowid, title, author, tags) VALUES (new.rowid, new.title, new.author, new.tags);
+END;
+CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN
+    INSERT INTO books_fts (books_fts, rowid, title, author, tags)
+    VALUES ('delete', old.rowid, old.title, old.author, old.tags);
+END;
+CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE ON books BEGIN
+    INSERT INTO books_fts (books_fts, rowid, title, author, tags)
+    VALUES ('delete', old.rowid, old.title, old.author, old.tags);
+    INSERT INTO books_fts (rowid, title, author, tags) VALUES (new.rowid, new.title, new.author, new.tags);
+END;
+CREATE VIRTUAL TABLE IF NOT EXISTS books_fts_vocab USING fts5vocab (books_fts, 'col');
+"""
+
+# Dictionary terms near a query word, nearest first, for fuzzy searches
+FUZZY_TERMS = ("SELECT DISTINCT term, edit_distance(term, ?, ?) AS distance FROM books_fts_vocab "
+               "WHERE distance <= ? ORDER BY distance, term LIMIT ?")
+FUZZY_COLUMN_TERMS = ("SELECT DISTINCT term, edit_distance(term, ?, ?) AS distance FROM books_fts_vocab "
+                      "WHERE col = ? AND distance <= ? ORDER BY distance, term LIMIT ?")
+
+# Matches of a full-text query with their BM25 rank (lower is better),
+# weighting title matches as the JSON store does
+FTS_SOURCE = ("books JOIN (SELECT rowid AS fts_rowid, bm25(books_fts, 2.0, 1.0, 1.0) AS rank "
+              "FROM books_fts WHERE books_fts MATCH ?) AS fts ON fts.fts_rowid = books.rowid")
+
+BOOK_COLUMNS = "title, author, genre, price, tags, published_year, isbn, id, rating"
+REVIEW_COLUMNS = "id, book_id, reviewer, rating, comment"
+
+
+def match_any(terms: List[str]) -> str:
+    """FTS5 query matching any of ``terms``, each quoted as a literal."""
+    return " OR ".join(f'"{term}"' for term in terms)
+
+
+def like_prefix(prefix: str) -> str:
+    """LIKE pattern (with ESCAPE '\\') matching lowercased text starting with ``prefix``."""
+    return prefix.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+class SqliteCatalogStore(StorageBackend):
+    """Storage backend answering every query from a SQLite database.
+
+    Filters, sorting and pagination run as SQL so only the requested page is
+    turned into Python objects. Each thread gets its own connection (WAL mode
+    lets readers proceed alongside the single writer) and statements are
+    constant SQL strings so the connection's statement cache keeps them
+    prepared. Plain listings follow insertion order (the table's rowid);
+    sorted listings and keyset pages are ordered by (sort field, id). Full-text
+    queries join an FTS5 index and rank by BM25 when no sort field is given.
+
+    A newly created database is filled from ``seed`` (typically the JSON
+    store) so switching backends keeps the existing catalog.
+    """
+
+    def __init__(self, path: str, seed: Optional[StorageBackend] = None, durability: Optional[str] = None):
+        self.path = path
+        self.seed = seed
+        self.synchronous = SYNCHRONOUS[durability or config.DURABILITY]
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=256)
+            conn.row_factory = sqlite3.Row
+            conn.create_function("edit_distance", 3, levenshtein, deterministic=True)
+            conn.execute(f"PRAGMA synchronous={self.synchronous}")
+            self._local.conn = conn
+        return conn
+
+    def load(self):
+        is_new = not os.path.exists(self.path)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        has_fts = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'books_fts'").fetchone() is not None
+        conn.executescript(FTS_SCHEMA)
+        if is_new and self.seed is not None:
+            self._import_seed()
+        elif not has_fts:
+            # Databases created before full-text search need their index built once
+            with self._write_lock, conn:
+                conn.execute("INSERT INTO books_fts (books_fts) VALUES ('rebuild')")
+        total = conn.execute("SELECT COUNT(*) FROM books").fetchone()[0]
+        logging.info(f"Opened SQLite catalog {self.path} with {total} books.")
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def after_fork(self):
+        # The parent's connections and locks must not be used from here
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+
+    def _import_seed(self):
+        self.seed.load()
+        books, reviews = self.seed.dump()
+        self.seed.close()
+        with self._write_lock, self._conn() as conn:
+            for book in books:
+                self._insert_book(conn, book)
+            conn.executemany(f"INSERT INTO reviews ({REVIEW_COLUMNS}) VALUES (?, ?, ?, ?, ?)",
+                             [tuple(review[c] for c in ("id", "book_id", "reviewer", "rating", "comment"))
+                              for review in reviews])
+        logging.info(f"Imported {len(books)} books and {len(reviews)} reviews into {self.path}.")
+
+    def dump(self) -> Tuple[List[dict], List[dict]]:
+        conn = self._conn()
+        books = [self._book_from_row(row) for row in conn.execute(f"SELECT {BOOK_COLUMNS} FROM books ORDER BY rowid")]
+        reviews = [dict(row) for row in conn.execute(f"SELECT {REVIEW_COLUMNS} FROM reviews ORDER BY rowid")]
+        return books, reviews
+
+    @staticmethod
+    def _book_from_row(row) -> dict:
+        book = dict(row)
+        book["tags"] = json.loads(book["tags"])
+        return book
+
+    @staticmethod
+    def _insert_book(conn, book: dict):
+        conn.execute(f"INSERT INTO books ({BOOK_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                     (book["title"], book["author"], book["genre"], book["price"], json.dumps(book["tags"]),
+                      book["published_year"], book["isbn"], book["id"], book.get("rating", 0.0)))
+        conn.executemany("INSERT INTO book_tags (book_id, tag) VALUES (?, ?)",
+                         [(book["id"], tag) for tag in {t.lower() for t in book["tags"]}])
+
+    # Books
+
+    def _filters(self, conn, query: BookQuery) -> Optional[Tuple[str, List[str], list]]:
+        """Table expression, WHERE clauses and parameters selecting the books matching ``query``.
+
+        None if nothing can match.
+        """
+        source, clauses, params = "books", [], []
+        if query.q:
+            terms = [term for term in words(query.q) if term not in STOPWORDS]
+            if query.fuzzy:
+                terms = [term for word in terms for term in self._fuzzy_terms(conn, word)]
+            if not terms:
+                return None
+            # Any quoted term may match; FTS5 applies the porter stemmer to each
+            source = FTS_SOURCE
+            params.append(match_any(terms))
+        for column in ("title", "author"):
+            text = getattr(query, column)
+            if not text:
+                continue
+            match = self._fuzzy_match(conn, column, text) if query.fuzzy else None
+            if match is None:
+                clauses.append(f"instr(lower({column}), ?) > 0")
+                params.append(text.lower())
+            else:
+                clauses.append(f"(instr(lower({column}), ?) > 0 OR "
+                               "books.rowid IN (SELECT rowid FROM books_fts WHERE books_fts MATCH ?))")
+                params.extend([text.lower(), match])
+        if query.genre:
+            clauses.append("instr(lower(genre), ?) > 0")
+            params.append(query.genre.lower())
+        if query.price_lt is not None:
+            clauses.append("price < ?")
+            params.append(query.price_lt)
+        if query.price_lte is not None:
+            clauses.append("price <= ?")
+            params.append(query.price_lte)
+        if query.price_gt is not None:
+            clauses.append("price > ?")
+            params.append(query.price_gt)
+        if query.price_gte is not None:
+            clauses.append("price >= ?")
+            params.append(query.price_gte)
+        if query.tag:
+            clauses.append("id IN (SELECT book_id FROM book_tags WHERE tag = ?)")
+            params.append(query.tag.lower())
+        if query.published_year is not None:
+            clauses.append("published_year = ?")
+            params.append(query.published_year)
+        if query.year_from is not None:
+            clauses.append("published_year >= ?")
+            params.append(query.year_from)
+        if query.year_to is not None:
+            clauses.append("published_year <= ?")
+            params.append(query.year_to)
+        return source, clauses, params
+
+    def search_books(self, query: BookQuery) -> Tuple[int, List[dict]]:
+        return self._search(query, QueryPlan())
+
+    def explain_search(self, query: BookQuery) -> Tuple[int, List[dict], dict]:
+        plan = QueryPlan()
+        total, books = self._search(query, plan, explain=True)
+        return total, books, plan.to_dict()
+
+    def _search(self, query: BookQuery, plan: QueryPlan, explain: bool = False) -> Tuple[int, List[dict]]:
+        """Run ``query``, timing its steps into ``plan``; with ``explain`` each
+        step's access is SQLite's own plan for it."""
+        conn = self._conn()
+        with plan.step("filters", "prepare"):
+            filters = self._filters(conn, query)
+        if filters is None:
+            return 0, []
+        source, clauses, params = filters
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        sql = f"SELECT COUNT(*) FROM {source}{where}"
+        with plan.step("count", self._query_plan(conn, sql, params) if explain else "sqlite") as step:
+            total = step["rows"] = conn.execute(sql, params).fetchone()[0]
+
+        direction = "DESC" if query.sort_desc else "ASC"
+        offset = (query.page - 1) * query.page_size
+        if query.sort_by:
+            if query.sort_by not in SORT_FIELDS:
+                raise ValueError(f"Cannot sort by {query.sort_by!r}")
+            order = f"{query.sort_by} {direction}, id {direction}"
+        elif query.after is not None:
+            order = f"id {direction}"
+        elif query.q:
+            order = "fts.rank, books.rowid"
+        else:
+            order = "books.rowid"
+        if query.after is not None:
+            # Seek past the last key already returned instead of skipping rows
+            offset = 0
+            if query.after:
+                comparison = "<" if query.sort_desc else ">"
+                if query.sort_by:
+                    clauses.append(f"({query.sort_by}, id) {comparison} (?, ?)")
+                    params.extend(query.after)
+                else:
+                    clauses.append(f"id {comparison} ?")
+                    params.append(query.after[1])
+                where = f" WHERE {' AND '.join(clauses)}"
+
+        sql = f"SELECT {BOOK_COLUMNS} FROM {source}{where} ORDER BY {order} LIMIT ? OFFSET ?"
+        params = params + [query.page_size, offset]
+        with plan.step("page", self._query_plan(conn, sql, params) if explain else "sqlite") as step:
+            books = [self._book_from_row(row) for row in conn.execute(sql, params)]
+            step["rows"] = len(books)
+        return total, books
+
+    @staticmethod
+    def _query_plan(conn, sql: str, params: list) -> str:
+        """SQLite's plan for ``sql``: its EXPLAIN QUERY PLAN details, joined by "; "."""
+        return "; ".join(row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params))
+
+    def facet_counts(self, query: BookQuery, size: int = 10) -> Dict[str, Dict[str, int]]:
+        conn = self._conn()
+        filters = self._filters(conn, query)
+        if filters is None:
+            source, clauses, params = "books", ["0"], []
+        else:
+            source, clauses, params = filters
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        facets = {}
+        for name in ("genre", "author"):
+            rows = conn.execute(f"SELECT MIN({name}), COUNT(*) AS count FROM {source}{where} "
+                                f"GROUP BY lower({name}) ORDER BY count DESC, MIN({name}) LIMIT ?", params + [size])
+            facets[name] = {value: count for value, count in rows}
+        rows = conn.execute(f"SELECT tag, COUNT(*) AS count FROM book_tags WHERE book_id IN "
+                            f"(SELECT id FROM {source}{where}) GROUP BY tag ORDER BY count DESC, tag LIMIT ?",
+                            params + [size])
+        facets["tag"] = {value: count for value, count in rows}
+        for name, edges in FACET_BUCKETS.items():
+            bounds = [f"{name} < {edges[0]}"]
+            bounds += [f"{name} >= {low} AND {name} < {high}" for low, high in zip(edges, edges[1:])]
+            bounds.append(f"{name} >= {edges[-1]}")
+            row = conn.execute(f"SELECT {', '.join(f'SUM({bound})' for bound in bounds)} FROM {source}{where}",
+                               params).fetchone()
+            facets[name] = dict(zip(bucket_labels(edges), (count or 0 for count in row)))
+        return facets
+
+    @staticmethod
+    def _fuzzy_terms(conn, word: str, column: Optional[str] = None) -> List[str]:
+        """Indexed terms within ``max_edits()`` of ``word``, at most ``MAX_EXPANSIONS``."""
+        distance = max_edits(word)
+        if column is None:
+            rows = conn.execute(FUZZY_TERMS, (word, distance, distance, MAX_EXPANSIONS))
+        else:
+            rows = conn.execute(FUZZY_COLUMN_TERMS, (word, distance, column, distance, MAX_EXPANSIONS))
+        return [row[0] for row in rows]
+
+    def _fuzzy_match(self, conn, column: str, text: str) -> Optional[str]:
+        """FTS5 query matching every word of ``text`` in ``column`` up to a few typos.
+
+        None if some word has no close term, so nothing can match.
+        """
+        groups = []
+        for word in words(text):
+            terms = self._fuzzy_terms(conn, word, column)
+            if not terms:
+                return None
+            groups.append(f"{column} : ({match_any(terms)})")
+        return " AND ".join(groups) or None
+
+    def get_book(self, book_id: str) -> Optional[dict]:
+        row = self._conn().execute(f"SELECT {BOOK_COLUMNS} FROM books WHERE id = ?", (book_id,)).fetchone()
+        return None if row is None else self._book_from_row(row)
+
+    def add_book(self, book: dict) -> dict:
+        with self._write_lock, self._conn() as conn:
+            self._insert_book(conn, book)
+        return book
+
+    def update_book(self, book_id: str, changes: dict) -> Optional[dict]:
+        with self._write_lock, self._conn() as conn:
+            book = self.get_book(book_id)
+            if book is None:
+                return None
+            book.update(changes)
+            conn.execute("UPDATE books SET title = ?, author = ?, genre = ?, price = ?, tags = ?, "
+                         "published_year = ?, isbn = ?, rating = ? WHERE id = ?",
+                         (book["title"], book["author"], book["genre"], book["price"], json.dumps(book["tags"]),
+                          book["published_year"], book["isbn"], book["rating"], book_id))
+            if "tags" in changes:
+                conn.execute("DELETE FROM book_tags WHERE book_id = ?", (book_id,))
+                conn.executemany("INSERT INTO book_tags (book_id, tag) VALUES (?, ?)",
+                                 [(book_id, tag) for tag in {t.lower() for t in book["tags"]}])
+        return book
+
+    def delete_book(self, book_id: str) -> bool:
+        with self._write_lock, self._conn() as conn:
+            if conn.execute("DELETE FROM books WHERE id = ?", (book_id,)).rowcount == 0:
+                return False
+            conn.execute("DELETE FROM book_tags WHERE book_id = ?", (book_id,))
+            conn.execute("DELETE FROM reviews WHERE book_id = ?", (book_id,))
+        return True
+
+    def genres(self, prefix: str = "", page: int = 1, page_size: Optional[int] = None) -> Tuple[int, List[dict]]:
+        return self._distinct_values("genre", prefix, page, page_size)
+
+    def authors(self, prefix: str = "", page: int = 1, page_size: Optional[int] = None) -> Tuple[int, List[dict]]:
+        return self._distinct_values("author", prefix, page, page_size)
+
+    def _distinct_values(self, column: str, prefix: str, page: int,
+                         page_size: Optional[int]) -> Tuple[int, List[dict]]:
+        limit = -1 if page_size is None else page_size
+        offset = 0 if page_size is None else (page - 1) * page_size
+        where, pattern = f"WHERE lower({column}) LIKE ? ESCAPE '\\'", like_prefix(prefix)
+        conn = self._conn()
+        total = conn.execute(f"SELECT COUNT(DISTINCT {column}) FROM books {where}", (pattern,)).fetchone()[0]
+        rows = conn.execute(f"SELECT {column} AS name, COUNT(*) AS books, ROUND(AVG(rating), 2) AS average_rating "
+                            f"FROM books {where} GROUP BY {column} ORDER BY lower({column}), {column} LIMIT ? OFFSET ?",
+                            (pattern, limit, offset))
+        return total, [dict(row) for row in rows]
+
+    def autocomplete(self, prefix: str, field: Optional[str] = None, limit: int = 10) -> List[dict]:
+        # Values starting with the prefix or with a space-separated word that does
+        pattern = like_prefix(prefix)
+        conn = self._conn()
+        completions = []
+        for name in ([field] if field else COMPLETION_FIELDS):
+            rows = conn.execute(
+                f"SELECT MIN({name}) AS value, COUNT(*) AS books, "
+                f"SUM((SELECT COUNT(*) FROM reviews WHERE reviews.book_id = books.id)) AS reviews FROM books "
+                f"WHERE lower({name}) LIKE ? ESCAPE '\\' OR lower({name}) LIKE ? ESCAPE '\\' "
+                f"GROUP BY lower({name}) ORDER BY reviews DESC, books DESC, MIN(rowid) LIMIT ?",
+                (pattern, "% " + pattern, limit))
+            completions += [{"value": row["value"], "field": name, "books": row["books"], "reviews": row["reviews"]}
+                            for row in rows]
+        completions.sort(key=lambda c: (-c["reviews"], -c["books"]))
+        return completions[:limit]
+
+    # Reviews
+
+    def list_reviews(self, book_id: str, page: int = 1, page_size: Optional[int] = None) -> List[dict]:
+        limit = -1 if page_size is None else page_size
+        offset = 0 if page_size is None else (page - 1) * page_size
+        rows = self._conn().execute(f"SELECT {REVIEW_COLUMNS} FROM reviews WHERE book_id = ? "
+                                    "ORDER BY rowid LIMIT ? OFFSET ?", (book_id, limit, offset))
+        return [dict(row) for row in rows]
+
+    def add_review(self, review: dict) -> Optional[dict]:
+        with self._write_lock, self._conn() as conn:
+            if conn.execute("SELECT 1 FROM books WHERE id = ?", (review["book_id"],)).fetchone() is None:
+                return None
+            conn.execute(f"INSERT INTO reviews ({REVIEW_COLUMNS}) VALUES (?, ?, ?, ?, ?)",
+                         (review["id"], review["book_id"], review["reviewer"], review["rating"], review["comment"]))
+            self._recalculate_book_rating(conn, review["book_id"])
+        return review
+
+    def delete_review(self, review_id: str) -> Optional[dict]:
+        with self._write_lock, self._conn() as conn:
+            row = conn.execute(f"SELECT {REVIEW_COLUMNS} FROM reviews WHERE id = ?", (review_id,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("DELETE FROM reviews WHERE id = ?", (review_id,))
+            self._recalculate_book_rating(conn, row["book_id"])
+        return dict(row)
+
+    @staticmethod
+    def _recalculate_book_rating(conn, book_id: str):
+        avg_rating = conn.execute("SELECT AVG(rating) FROM reviews WHERE book_id = ?", (book_id,)).fetchone()[0]
+        conn.execute("UPDATE books SET rating = ? WHERE id = ?", (round(avg_rating or 0.0, 2), book_id))
@@ -0,0 +1,370 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single process owns the log
+    fcntl = None
+
+import config
+
+LOG_FILE = os.path.join(config.DATA_DIR, "mutations.log")
+
+DURABILITY_MODES = ("fsync", "group", "periodic")
+
+# Shared state of a log, in its ``.version`` file: the number of appends and
+# rotations so far (the version) and of rotations (the generation)
+SHARED_STATE = struct.Struct("<QQ")
+
+
+class MutationLog:
+    """Append-only log of book and review mutations, one JSON record per line.
+
+    Each record is ``{"op": "create" | "update" | "delete", "kind": "book" |
+    "review", "id": ..., "data": ...}``. Records carry absolute values so
+    replaying a log over a snapshot that already contains it is harmless.
+
+    ``append()`` writes a record and returns its sequence number; ``wait()``
+    blocks until that record is on disk according to the durability mode
+    (see ``config.DURABILITY``). Callers should wait after releasing their
+    own locks so concurrent writers can share one fsync, and may append
+    several records before waiting on the last.
+
+    Several processes may share a log, each applying it to its own copy of
+    the catalog. Appends and rotations happen under ``locked()``, an
+    exclusive lock on the log across processes, and bump a version counter
+    in a small memory-mapped file next to the log, so ``changed()`` is a
+    memory read and ``tail()`` returns the records other processes appended
+    since. A writer that applies ``tail()`` before its own record under
+    the same lock sees the log in the same order as everyone else.
+
+    ``tail()``, ``append()`` and ``flush()`` only hold a short lock on the
+    files of this process, never ``locked()``, so callers may tail the log
+    while another thread waits for another process's lock.
+    """
+
+    def __init__(self, path: str = LOG_FILE, durability: Optional[str] = None):
+        durability = durability or config.DURABILITY
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode {durability!r}, expected one of {DURABILITY_MODES}")
+        self.path = path
+        self.durability = durability
+        self.records = 0
+        self._file = None
+        self._appended = 0
+        self._durable = 0
+        self._cond = threading.Condition()
+        self._io_lock = threading.RLock()
+        self._flusher = None
+        # Held by the thread inside locked(), which may wait for other processes
+        self._writer_lock = threading.RLock()
+        # The version file, mapped, and how deep locked() is nested
+        self._shared_fd = None
+        self._shared = None
+        self._lock_depth = 0
+        # Descriptor of the log file tail() reads (with pread, so processes
+        # forked with it do not share an offset), how far it has read, its
+        # generation and the shared state it has caught up with
+        self._reader = None
+        self._offset = 0
+        self._generation = 0
+        self._seen = (0, 0)
+        # The log rotate() moved aside, kept open and locked until removed
+        self._rotated_fd = None
+
+    @property
+    def compacting_path(self) -> str:
+        return self.path + ".compacting"
+
+    @property
+    def version(self) -> int:
+        """Appends and rotations by every process up to what this process has caught up with.
+
+        Under ``locked()`` and caught up, the next record appended is
+        ``version + 1``.
+        """
+        return self._seen[0]
+
+    def open(self, records: int = 0):
+        """Open the log for appending; ``records`` is how many it already holds.
+
+        Records appended by other processes after this call are returned by
+        ``tail()``; hold ``locked()`` across reading the log and opening it so
+        none are missed in between.
+        """
+        with self.locked(), self._io_lock:
+            self._close_files()
+            self.records = records
+            self._open_files()
+            # Terminate a torn final record so the next append starts on a fresh line
+            if self._offset > 0 and os.pread(self._reader, 1, self._offset - 1) != b"\n":
+                self._file.write(b"\n")
+                self._file.flush()
+                self._offset += 1
+            self._seen = self._shared_state()
+            self._generation = self._seen[1]
+        if self.durability != "fsync" and self._flusher is None:
+            self._flusher = threading.Thread(target=self._run_flusher, name="mutation-log-flusher", daemon=True)
+            self._flusher.start()
+
+    def close(self):
+        with self._io_lock:
+            self._close_files()
+            if self._shared is not None:
+                self._shared.close()
+                os.close(self._shared_fd)
+                self._shared = self._shared_fd = None
+
+    def _open_files(self):
+        self._file = open(self.path, "ab")
+        self._reader = os.open(self.path, os.O_RDONLY)
+        self._offset = os.fstat(self._reader).st_size
+
+    def _close_files(self):
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._file = None
+        if self._reader is not None:
+            os.close(self._reader)
+            self._reader = None
+
+    def after_fork(self):
+        """Restart background flushing in a process forked from the one that opened the log."""
+        self._cond = threading.Condition()
+        self._io_lock = threading.RLock()
+        self._writer_lock = threading.RLock()
+        self._durable = self._appended
+        self._flusher = None
+        self._lock_depth = 0
+        if self._shared is not None:
+            # A lock belongs to the open file, which the parent shares: open our own
+            self._shared.close()
+            os.close(self._shared_fd)
+            self._open_shared()
+        if self._file is not None:
+            if self.durability != "fsync":
+                self._flusher = threading.Thread(target=self._run_flusher, name="mutation-log-flusher", daemon=True)
+                self._flusher.start()
+
+    @contextmanager
+    def locked(self):
+        """Hold the log exclusively, against other threads and processes.
+
+        Reentrant. While it is held no one else appends or rotates, so the
+        records ``tail()`` returns are all there are.
+        """
+        with self._writer_lock:
+            if self._shared is None:
+                self._open_shared()
+            self._lock_depth += 1
+            try:
+                if self._lock_depth == 1 and fcntl is not None:
+                    fcntl.flock(self._shared_fd, fcntl.LOCK_EX)
+                yield
+            finally:
+                self._lock_depth -= 1
+                if not self._lock_depth and fcntl is not None:
+                    fcntl.flock(self._shared_fd, fcntl.LOCK_UN)
+
+    def _open_shared(self):
+        self._shared_fd = os.open(self.path + ".version", os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(self._shared_fd).st_size < SHARED_STATE.size:
+            os.ftruncate(self._shared_fd, SHARED_STATE.size)
+        self._shared = mmap.mmap(self._shared_fd, SHARED_STATE.size)
+
+    def _shared_state(self):
+        return SHARED_STATE.unpack_from(self._shared)
+
+    def _publish(self, rotated: bool = False):
+        # Only called under locked()
+        version, generation = self._shared_state()
+        if rotated:
+            generation += 1
+            self._generation = generation
+        SHARED_STATE.pack_into(self._shared, 0, version + 1, generation)
+        self._seen = (version + 1, generation)
+
+    def append(self, record: dict) -> int:
+        """Write ``record``; callers hold ``locked()`` and have applied ``tail()`` first."""
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode()
+        with self.locked(), self._io_lock:
+            if self.changed():
+                raise RuntimeError("Records appended by other processes must be applied before appending")
+            self._file.write(line)
+            # Flushed to the OS so other processes can tail it; fsynced per the durability mode
+            self._file.flush()
+            self._offset += len(line)
+            self._publish()
+            with self._cond:
+                self._appended += 1
+                self.records += 1
+                seq = self._appended
+                self._cond.notify_all()
+        return seq
+
+    def changed(self) -> bool:
+        """Whether the log was appended to or rotated since this process last caught up."""
+        shared = self._shared
+        return shared is not None and self._reader is not None and SHARED_STATE.unpack_from(shared) != self._seen
+
+    def tail(self) -> Optional[List[dict]]:
+        """Records appended by other processes since the last call, in log order.
+
+        None if the log was rotated more than once since, so records in
+        between are gone from it and the catalog has to be reloaded.
+        """
+        with self._io_lock:
+            if not self.changed():
+                return []
+            self._seen = self._shared_state()
+            records = self._read_new()
+            while self._generation < self._seen[1]:
+                # Rotated: the old file is complete; go on with the new one,
+                # unless it is not the next generation but a later one
+                self._close_files()
+                self._open_files()
+                self._offset = 0
+                self._generation += 1
+                self.records = 0
+                if self._shared_state()[1] != self._generation:
+                    self._seen = self._shared_state()
+                    self._generation = self._seen[1]
+                    return None
+                records += self._read_new()
+            self.records += len(records)
+            return records
+
+    def _read_new(self) -> List[dict]:
+        data = os.pread(self._reader, max(0, os.fstat(self._reader).st_size - self._offset), self._offset)
+        # A record still being written is left for the next call
+        complete = data.rfind(b"\n") + 1
+        self._offset += complete
+        records = []
+        for line in data[:complete].splitlines():
+            if line.strip():
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logging.warning(f"Skipping malformed record in {self.path}.")
+        return records
+
+    def wait(self, seq: int):
+        """Block until record ``seq`` is durable; periodic mode never blocks."""
+        if self.durability == "periodic":
+            return
+        if self.durability == "fsync":
+            # Fsynced by the first caller waiting on them, covering every record before
+            if self._durable < seq:
+                self.flush()
+            return
+        with self._cond:
+            while self._durable < seq:
+                self._cond.wait()
+
+    def flush(self):
+        """Fsync every record written so far."""
+        with self._io_lock:
+            with self._cond:
+                seq = self._appended
+            # Appends are written through, so fsyncing a duplicate descriptor
+            # outside the lock covers them without holding up new ones
+            fd = os.dup(self._file.fileno()) if seq > self._durable and self._file is not None else None
+        if fd is not None:
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        with self._cond:
+            self._durable = max(self._durable, seq)
+            self._cond.notify_all()
+
+    def _run_flusher(self):
+        while True:
+            if self.durability == "group":
+                with self._cond:
+                    while self._durable >= self._appended:
+                        self._cond.wait()
+                # Let writers arriving within the window join this flush
+                time.sleep(config.GROUP_COMMIT_WINDOW_MS / 1000)
+            else:
+                time.sleep(config.FLUSH_INTERVAL_MS / 1000)
+            try:
+                self.flush()
+            except Exception:
+                logging.exception("Failed to flush the mutation log.")
+
+    def replay(self, path: Optional[str] = None) -> Iterator[dict]:
+        path = path or self.path
+        if not os.path.exists(path):
+            return
+        with open(path, "r") as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash mid-append can leave a torn final record
+                    logging.warning(f"Skipping malformed record at {path}:{line_no}.")
+
+    def rotate(self) -> str:
+        """Move the current log aside and start an empty one; returns the old path.
+
+        Callers hold ``locked()`` and have applied ``tail()`` first. The old
+        log stays locked until ``remove_rotated()``, which tells other
+        processes a compaction is in progress rather than interrupted.
+        """
+        with self.locked(), self._io_lock:
+            self._close_files()
+            os.replace(self.path, self.compacting_path)
+            self._rotated_fd = os.open(self.compacting_path, os.O_RDONLY)
+            if fcntl is not None:
+                fcntl.flock(self._rotated_fd, fcntl.LOCK_EX)
+            self._start_generation()
+        return self.compacting_path
+
+    def remove_rotated(self):
+        """Delete the log ``rotate()`` moved aside, once a snapshot holds its records."""
+        with self.locked():
+            os.remove(self.compacting_path)
+            os.close(self._rotated_fd)
+            self._rotated_fd = None
+
+    def abandoned_rotation(self) -> bool:
+        """Whether a rotated log exists that no process is compacting, left
+        by an interrupted compaction; call under ``locked()``."""
+        try:
+            fd = os.open(self.compacting_path, os.O_RDONLY)
+        except FileNotFoundError:
+            return False
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+        finally:
+            os.close(fd)
+
+    def truncate(self):
+        """Start an empty log, e.g. once a snapshot holds every record of it."""
+        with self.locked(), self._io_lock:
+            self._close_files()
+            tmp_path = self.path + ".tmp"
+            open(tmp_path, "w").close()
+            # Replaced rather than emptied in place, so other processes see a rotation
+            os.replace(tmp_path, self.path)
+            self._start_generation()
+
+    def _start_generation(self):
+        self._open_files()
+        self.records = 0
+        self._publish(rotated=True)
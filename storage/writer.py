@@ -0,0 +1,83 @@
+import asyncio
+import logging
+from typing import Any, Callable, List, Optional, Tuple
+
+from storage.backend import StorageBackend
+
+# Most mutations applied together as one batch
+WRITE_BATCH_LIMIT = 64
+
+
+class CatalogWriter:
+    """The single task every catalog mutation goes through, in arrival order.
+
+    Handlers ``await submit(method, *args)`` with a mutating method of the
+    catalog instead of calling it. One task per event loop takes the
+    mutations off a queue: those that queued up while the previous batch
+    was applied (up to ``WRITE_BATCH_LIMIT``) are applied together inside
+    ``catalog.batch()``, so the catalog is locked and persisted once per
+    batch rather than once per mutation. Batches run in a worker thread, as
+    waiting for the disk must not hold up the reads the event loop serves.
+
+    The task starts with the first ``submit()`` in a loop, so each worker
+    process (and each loop a test client runs requests in) has its own.
+    """
+
+    def __init__(self, catalog: StorageBackend, batch_limit: int = WRITE_BATCH_LIMIT):
+        self.catalog = catalog
+        self.batch_limit = batch_limit
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def submit(self, method: Callable, *args) -> Any:
+        """Apply ``method(*args)`` in turn; returns its result once durable, or raises its error."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._queue = loop, asyncio.Queue()
+            self._task = loop.create_task(self._run())
+        future = loop.create_future()
+        self._queue.put_nowait((method, args, future))
+        return await future
+
+    async def stop(self):
+        """Apply the mutations already queued, then end the task."""
+        if self._task is None or self._loop is not asyncio.get_running_loop():
+            return
+        self._queue.put_nowait(None)
+        await self._task
+        self._loop = self._queue = self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_limit and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            mutations = [mutation for mutation in batch if mutation is not None]
+            if mutations:
+                try:
+                    outcomes = await loop.run_in_executor(None, self._apply, mutations)
+                except Exception as e:
+                    # Persisting the batch failed: none of it can be reported as done
+                    logging.exception("Failed to persist a batch of catalog mutations.")
+                    outcomes = [(None, e)] * len(mutations)
+                for (_, _, future), (result, error) in zip(mutations, outcomes):
+                    if future.cancelled():
+                        continue
+                    if error is not None:
+                        future.set_exception(error)
+                    else:
+                        future.set_result(result)
+            if len(mutations) < len(batch):
+                return
+
+    def _apply(self, mutations: List[tuple]) -> List[Tuple[Any, Optional[Exception]]]:
+        outcomes = []
+        with self.catalog.batch():
+            for method, args, _ in mutations:
+                try:
+                    outcomes.append((method(*args), None))
+                except Exception as e:
+                    outcomes.append((None, e))
+        return outcomes
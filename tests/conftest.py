@@ -0,0 +1,15 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+
+# The app keeps its data files, mutation log and binary snapshot in a
+# scratch directory during the tests, never in the real data/
+DATA_DIR = tempfile.mkdtemp(prefix="alonzo-test-data-")
+os.environ["ALONZO_DATA_DIR"] = DATA_DIR
+
+@pytest.fixture(scope="session", autouse=True)
+def scratch_data_dir():
+    yield DATA_DIR
+    shutil.rmtree(DATA_DIR, ignore_errors=True)
@@ -1,3 +1,4 @@
+import base64
 import sys
 import os
 import json
@@ -8,7 +9,9 @@ from uuid import uuid4
 # Add parent directory to path to import app
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+import config
 from main import app
+from storage.catalog import catalog
 
 client = TestClient(app)
 
@@ -25,31 +28,20 @@ test_book = {
 
 @pytest.fixture
 def setup_test_data():
-    """Setup and teardown for test data"""
-    # Create test data directory if it doesn't exist
-    os.makedirs("data", exist_ok=True)
-    
-    # Backup existing data files if they exist
-    for file in ["books.json", "reviews.json"]:
-        if os.path.exists(f"data/{file}"):
-            if os.path.exists(f"data/{file}.bak"):
-                os.remove(f"data/{file}.bak")
-            os.rename(f"data/{file}", f"data/{file}.bak")
+    """Setup of test data: an empty catalog"""
+    # The suite's scratch data directory (see conftest.py): start from empty
+    # data files, without the log or binary snapshot of an earlier test
+    for file in os.listdir(config.DATA_DIR):
+        os.remove(os.path.join(config.DATA_DIR, file))
     
     # Create empty data files
-    with open("data/books.json", "w") as f:
+    with open(catalog.books_file, "w") as f:
         json.dump([], f)
-    with open("data/reviews.json", "w") as f:
+    with open(catalog.reviews_file, "w") as f:
         json.dump([], f)
+    catalog.load()
     
     yield
-    
-    # Restore backup files
-    for file in ["books.json", "reviews.json"]:
-        if os.path.exists(f"data/{file}"):
-            os.remove(f"data/{file}")
-        if os.path.exists(f"data/{file}.bak"):
-            os.rename(f"data/{file}.bak", f"data/{file}")
 
 def test_create_book(setup_test_data):
     response = client.post("/books", json=test_book)
@@ -84,6 +76,11 @@ def test_update_book(setup_test_data):
     assert data["title"] == "Updated Title"
     assert data["price"] == 29.99
     assert data["author"] == test_book["author"]  # Unchanged fields remain
+    
+    # Fields can be left out but not nulled
+    for field in ["title", "price", "tags"]:
+        assert client.put(f"/books/{book_id}", json={field: None}).status_code == 422
+    assert client.get(f"/books/{book_id}").json()["title"] == "Updated Title"
 
 def test_delete_book(setup_test_data):
     # First create a book
@@ -126,7 +123,7 @@ def test_search_books(setup_test_data):
     books = [
         {**test_book, "title": "Python Programming", "author": "John Smith", "price": 29.99, "genre": "Programming"},
         {**test_book, "title": "Web Development", "author": "Jane Doe", "price": 39.99, "genre": "Programming"},
-        {**test_book, "title": "Fantasy Novel", "author": "Sarah Johnson", "price": 19.99, "genre": "Fiction"}
+        {**test_book, "title": "Fantasy Novel", "author": "Sarah Jones", "price": 19.99, "genre": "Fiction"}
     ]
     
     for book in books:
@@ -150,4 +147,157 @@ def test_search_books(setup_test_data):
     assert response.status_code == 200
     data = response.json()
     assert data["total"] == 1
-    assert data["books"][0]["price"] == 29.99
\ No newline at end of file
+    assert data["books"][0]["price"] == 29.99
+
+def test_search_books_ranges(setup_test_data):
+    for year, price in [(1999, 10.0), (2005, 20.0), (2015, 30.0)]:
+        client.post("/books", json={**test_book, "published_year": year, "price": price})
+    
+    response = client.get("/books/search?price_gte=20")
+    assert response.status_code == 200
+    assert [b["price"] for b in response.json()["books"]] == [20.0, 30.0]
+    
+    response = client.get("/books/search?year_from=2000&year_to=2010")
+    assert response.status_code == 200
+    assert [b["published_year"] for b in response.json()["books"]] == [2005]
+
+def test_search_books_full_text(setup_test_data):
+    for title, tags in [("Learning Rust", ["python"]), ("Python Tricks", ["programming"]), ("Poems", ["poetry"])]:
+        client.post("/books", json={**test_book, "title": title, "tags": tags})
+    
+    response = client.get("/books/search?q=python")
+    assert response.status_code == 200
+    assert response.json()["total"] == 2
+    assert [b["title"] for b in response.json()["books"]] == ["Python Tricks", "Learning Rust"]
+    
+    # Relevance order has no cursor key
+    assert client.get("/books/search", params={"q": "python", "cursor": ""}).status_code == 400
+
+def test_search_books_fuzzy(setup_test_data):
+    client.post("/books", json={**test_book, "author": "Fyodor Dostoevsky"})
+    
+    assert client.get("/books/search?author=dostoyevsky").json()["total"] == 0
+    response = client.get("/books/search?author=dostoyevsky&fuzzy=true")
+    assert response.status_code == 200
+    assert [b["author"] for b in response.json()["books"]] == ["Fyodor Dostoevsky"]
+
+def test_search_books_facets(setup_test_data):
+    for genre, price in [("Fiction", 5.0), ("Fiction", 30.0), ("Poetry", 30.0)]:
+        client.post("/books", json={**test_book, "genre": genre, "price": price})
+    
+    assert client.get("/books/search").json()["facets"] is None
+    response = client.get("/books/search?facets=true&price_gte=10")
+    assert response.status_code == 200
+    facets = response.json()["facets"]
+    assert facets["genre"] == {"Fiction": 1, "Poetry": 1}
+    assert facets["price"] == {"<10": 0, "10-25": 0, "25-50": 2, "50-100": 0, "100+": 0}
+
+def test_search_books_explain(setup_test_data):
+    client.post("/books", json={**test_book, "genre": "Poetry"})
+    
+    assert client.get("/books/search?genre=poetry").json()["plan"] is None
+    response = client.get("/books/search?genre=poetry&explain=true")
+    assert response.status_code == 200
+    plan = response.json()["plan"]
+    assert response.json()["total"] == 1
+    assert plan["steps"][-1]["step"] == "page" and plan["ms"] >= 0
+
+def test_list_genres_and_authors(setup_test_data):
+    for author in ["Ann Lee", "Bob Stone", "Ann Lee"]:
+        client.post("/books", json={**test_book, "author": author})
+    
+    response = client.get("/authors?prefix=ann")
+    assert response.status_code == 200
+    assert response.json()["total"] == 1
+    assert response.json()["values"] == [{"name": "Ann Lee", "books": 2, "average_rating": 0.0}]
+    assert client.get("/genres?page_size=0").status_code == 422
+
+def test_autocomplete(setup_test_data):
+    client.post("/books", json={**test_book, "title": "Refactoring"})
+    client.post("/books", json={**test_book, "title": "Reflections"})
+    
+    response = client.get("/autocomplete?q=ref&field=title")
+    assert response.status_code == 200
+    assert [c["value"] for c in response.json()] == ["Refactoring", "Reflections"]
+    assert client.get("/autocomplete?q=ref&field=isbn").status_code == 400
+
+def test_catalog_served_from_memory(setup_test_data):
+    create_response = client.post("/books", json=test_book)
+    book_id = create_response.json()["id"]
+    
+    # Reads no longer touch the data file
+    os.remove(catalog.books_file)
+    response = client.get(f"/books/{book_id}")
+    assert response.status_code == 200
+    assert [g["name"] for g in client.get("/genres").json()["values"]] == [test_book["genre"]]
+
+def test_mutation_log_replay_and_compaction(setup_test_data):
+    book_ids = [client.post("/books", json=test_book).json()["id"] for _ in range(3)]
+    client.put(f"/books/{book_ids[0]}", json={"title": "Updated Title"})
+    client.delete(f"/books/{book_ids[1]}")
+    
+    # Writes are appended to the log instead of rewriting the snapshot
+    with open(catalog.books_file) as f:
+        assert json.load(f) == []
+    with open(catalog.log.path) as f:
+        assert [json.loads(line)["op"] for line in f] == ["create", "create", "create", "update", "delete"]
+    
+    # A restart replays the log on top of the snapshot
+    catalog.load()
+    response = client.get("/books")
+    assert [b["id"] for b in response.json()["books"]] == [book_ids[0], book_ids[2]]
+    assert response.json()["books"][0]["title"] == "Updated Title"
+    
+    # Compaction folds the log into a fresh snapshot
+    catalog.compact()
+    with open(catalog.books_file) as f:
+        assert [b["id"] for b in json.load(f)] == [book_ids[0], book_ids[2]]
+    assert os.path.getsize(catalog.log.path) == 0
+    catalog.load()
+    assert client.get("/books").json()["total"] == 2
+
+def test_cursor_pagination(setup_test_data):
+    for price in [30.0, 10.0, 20.0, 10.0, 40.0]:
+        client.post("/books", json={**test_book, "price": price})
+    
+    prices, cursor = [], ""
+    while cursor is not None:
+        response = client.get("/books", params={"sort_by": "price", "page_size": 2, "cursor": cursor})
+        assert response.status_code == 200
+        data = response.json()
+        assert data["total"] == 5
+        prices += [b["price"] for b in data["books"]]
+        cursor = data["next_cursor"]
+    assert prices == [10.0, 10.0, 20.0, 30.0, 40.0]
+    
+    # Offset pages carry no cursor, and a cursor only resumes the ordering it came from
+    assert client.get("/books?sort_by=price").json()["next_cursor"] is None
+    cursor = client.get("/books/search", params={"sort_by": "price", "page_size": 1, "cursor": ""}).json()["next_cursor"]
+    assert client.get("/books/search", params={"sort_by": "rating", "cursor": cursor}).status_code == 400
+    assert client.get("/books/search", params={"cursor": "not-a-cursor"}).status_code == 400
+    # Keys of the wrong types are rejected too
+    for payload in [{"s": "price", "d": False, "k": ["x", "y"]}, {"s": "price", "d": False, "k": [None, "y"]},
+                    {"s": None, "d": False, "k": [1, 2]}]:
+        bad = base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+        for path in ["/books", "/books/search"]:
+            params = {"sort_by": payload["s"], "cursor": bad}
+            assert client.get(path, params={k: v for k, v in params.items() if v}).json()["detail"] == "Malformed cursor"
+
+def test_snapshot_pagination(setup_test_data):
+    book_ids = [client.post("/books", json={**test_book, "price": price}).json()["id"]
+                for price in [10.0, 20.0, 30.0, 40.0]]
+    
+    response = client.get("/books", params={"sort_by": "price", "page_size": 2, "cursor": "", "snapshot": True})
+    assert [b["price"] for b in response.json()["books"]] == [10.0, 20.0]
+    # Changes made during the walk do not show in its later pages
+    client.put(f"/books/{book_ids[2]}", json={"price": 5.0, "title": "Repriced"})
+    client.delete(f"/books/{book_ids[3]}")
+    client.post("/books", json={**test_book, "price": 35.0})
+    response = client.get("/books", params={"sort_by": "price", "cursor": response.json()["next_cursor"]})
+    data = response.json()
+    assert data["total"] == 4
+    assert [(b["price"], b["title"]) for b in data["books"]] == [(30.0, test_book["title"]), (40.0, test_book["title"])]
+    assert [b["price"] for b in client.get("/books", params={"sort_by": "price"}).json()["books"]] == [5.0, 10.0, 20.0, 35.0]
+    
+    # Only cursor walks can be pinned
+    assert client.get("/books", params={"snapshot": True}).status_code == 400
@@ -8,7 +8,9 @@ from uuid import uuid4
 # Add parent directory to path to import app
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+import config
 from main import app
+from storage.catalog import catalog
 
 client = TestClient(app)
 
@@ -32,35 +34,24 @@ test_review = {
 
 @pytest.fixture
 def setup_test_data():
-    """Setup and teardown for test data"""
-    # Create test data directory if it doesn't exist
-    os.makedirs("data", exist_ok=True)
-    
-    # Backup existing data files if they exist
-    for file in ["books.json", "reviews.json"]:
-        if os.path.exists(f"data/{file}"):
-            if os.path.exists(f"data/{file}.bak"):
-                os.remove(f"data/{file}.bak")
-            os.rename(f"data/{file}", f"data/{file}.bak")
+    """Setup of test data: an empty catalog"""
+    # The suite's scratch data directory (see conftest.py): start from empty
+    # data files, without the log or binary snapshot of an earlier test
+    for file in os.listdir(config.DATA_DIR):
+        os.remove(os.path.join(config.DATA_DIR, file))
     
     # Create empty data files
-    with open("data/books.json", "w") as f:
+    with open(catalog.books_file, "w") as f:
         json.dump([], f)
-    with open("data/reviews.json", "w") as f:
+    with open(catalog.reviews_file, "w") as f:
         json.dump([], f)
+    catalog.load()
     
     # Create a test book
     response = client.post("/books", json=test_book)
     book_id = response.json()["id"]
     
     yield book_id
-    
-    # Restore backup files
-    for file in ["books.json", "reviews.json"]:
-        if os.path.exists(f"data/{file}"):
-            os.remove(f"data/{file}")
-        if os.path.exists(f"data/{file}.bak"):
-            os.rename(f"data/{file}.bak", f"data/{file}")
 
 def test_add_review(setup_test_data):
     book_id = setup_test_data
@@ -76,6 +67,9 @@ def test_add_review(setup_test_data):
     book_response = client.get(f"/books/{book_id}")
     book_data = book_response.json()
     assert book_data["rating"] == 4.0
+    
+    # Reviews of a missing book are rejected
+    assert client.post("/books/missing/reviews", json=test_review).status_code == 404
 
 def test_get_reviews(setup_test_data):
     book_id = setup_test_data
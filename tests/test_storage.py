@@ -0,0 +1,760 @@
+import sys
+import os
+import asyncio
+import json
+import bisect
+import random
+import threading
+import pytest
+
+# Add parent directory to path to import storage
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import config
+from storage.backend import (FACET_BUCKETS, BookQuery, SnapshotExpired, WouldBlock, bucket_labels, decode_cursor,
+                             decode_snapshot, encode_cursor)
+from storage.bitmap import Bitmap, intersect
+from storage.indexes import BKTREE_DEAD_FRACTION, BKTREE_DEAD_MINIMUM, BKTree, levenshtein
+from storage.json_store import JsonCatalogStore
+from storage.sqlite_store import SqliteCatalogStore
+from storage.wal import MutationLog
+from storage.writer import CatalogWriter
+
+def make_store(tmp_path, durability="group", column_mirror="off"):
+    books_file = tmp_path / "books.json"
+    reviews_file = tmp_path / "reviews.json"
+    books_file.write_text("[]")
+    reviews_file.write_text("[]")
+    store = JsonCatalogStore(str(books_file), str(reviews_file),
+                             log=MutationLog(str(tmp_path / "mutations.log"), durability=durability),
+                             column_mirror=column_mirror)
+    store.load()
+    return store
+
+def make_book(i, **fields):
+    book = {"title": f"Book {i}", "author": "Author", "genre": "Genre", "price": 10.0, "tags": [],
+            "published_year": 2000, "isbn": "0", "id": str(i), "rating": 0.0}
+    book.update(fields)
+    return book
+
+@pytest.fixture(params=["json", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "json":
+        return make_store(tmp_path)
+    store = SqliteCatalogStore(str(tmp_path / "catalog.db"))
+    store.load()
+    return store
+
+def test_backend_book_crud(store):
+    store.add_book(make_book(1, tags=["Sample"]))
+    assert store.get_book("1")["tags"] == ["Sample"]
+    
+    updated = store.update_book("1", {"title": "Updated", "price": 12.5})
+    assert updated["title"] == "Updated"
+    assert store.get_book("1")["price"] == 12.5
+    assert store.update_book("missing", {"title": "x"}) is None
+    
+    assert store.delete_book("1")
+    assert store.get_book("1") is None
+    assert not store.delete_book("1")
+
+def test_invalid_update_leaves_store_intact(tmp_path):
+    store = make_store(tmp_path)
+    store.add_book(make_book(1, title="Dune"))
+    for changes in [{"title": None}, {"price": None}, {"price": "cheap"}, {"tags": [None]}]:
+        with pytest.raises(ValueError):
+            store.update_book("1", changes)
+    assert store.get_book("1") == make_book(1, title="Dune")
+    assert [b["id"] for b in store.search_books(BookQuery(title="dune"))[1]] == ["1"]
+    assert store.delete_book("1")
+
+def test_failed_append_leaves_store_unchanged(tmp_path, monkeypatch):
+    store = make_store(tmp_path)
+    store.add_book(make_book(1, title="Dune"))
+    version = store.version
+    
+    def fail(record):
+        raise OSError("No space left on device")
+    with monkeypatch.context() as patch:
+        patch.setattr(store.log, "append", fail)
+        with pytest.raises(OSError):
+            store.update_book("1", {"title": "Emma"})
+        with pytest.raises(OSError):
+            store.add_book(make_book(2))
+    assert store.get_book("1") == make_book(1, title="Dune") and store.get_book("2") is None
+    assert store.version == version
+    
+    # The next mutation gets the next version
+    store.update_book("1", {"title": "Emma"})
+    assert store.version == version + 1
+
+def test_backend_search(store):
+    store.add_book(make_book(1, author="John Smith", genre="Programming", price=29.99, tags=["Python"]))
+    store.add_book(make_book(2, author="Jane Doe", genre="Programming", price=39.99, published_year=2010))
+    store.add_book(make_book(3, author="Sarah Jones", genre="Fiction", price=19.99))
+    
+    def ids(**filters):
+        total, books = store.search_books(BookQuery(**filters))
+        assert total == len(books)
+        return [b["id"] for b in books]
+    
+    assert ids() == ["1", "2", "3"]
+    assert ids(author="john") == ["1"]
+    assert ids(title="BOOK") == ["1", "2", "3"]
+    assert ids(title="ok 2") == ["2"]
+    assert ids(genre="PROG") == ["1", "2"]
+    assert ids(price_gt=25, price_lt=35) == ["1"]
+    assert ids(price_lte=29.99) == ["1", "3"]
+    assert ids(tag="python") == ["1"]
+    assert ids(published_year=2010) == ["2"]
+    assert ids(price_gte=29.99) == ["1", "2"]
+    assert ids(price_gt=29.99) == ["2"]
+    assert ids(price_gte=19.99, price_lt=29.99) == ["3"]
+    assert ids(price_gt=50) == []
+    assert ids(year_from=2000) == ["1", "2", "3"]
+    assert ids(year_from=2001, year_to=2010) == ["2"]
+    assert ids(year_to=2009) == ["1", "3"]
+    assert ids(published_year=2000, year_from=2005) == []
+    assert ids(genre="programming", price_lte=30, year_to=2005) == ["1"]
+    assert ids(sort_by="price") == ["3", "1", "2"]
+    assert ids(sort_by="price", sort_desc=True) == ["2", "1", "3"]
+    
+    total, books = store.search_books(BookQuery(page=2, page_size=2))
+    assert total == 3
+    assert [b["id"] for b in books] == ["3"]
+    assert [g["name"] for g in store.genres()[1]] == ["Fiction", "Programming"]
+    assert [a["name"] for a in store.authors()[1]] == ["Jane Doe", "John Smith", "Sarah Jones"]
+
+def test_backend_search_follows_updates(store):
+    store.add_book(make_book(1, author="John Smith", tags=["Python", "python"]))
+    store.add_book(make_book(2, author="Jane Doe", tags=["Python"]))
+    store.update_book("1", {"author": "Ada Lovelace", "tags": ["Math"]})
+    
+    def ids(**filters):
+        return [b["id"] for b in store.search_books(BookQuery(**filters))[1]]
+    
+    assert ids(author="smith") == []
+    assert ids(author="LOVE") == ["1"]
+    assert ids(tag="python") == ["2"]
+    assert ids(tag="math", author="ada") == ["1"]
+    
+    store.delete_book("2")
+    assert ids(tag="python") == []
+    assert ids(author="doe") == []
+
+def test_backend_full_text_search(store):
+    store.add_book(make_book(1, title="Cooking with Herbs", tags=["garden"]))
+    store.add_book(make_book(2, title="A Garden Year", tags=["cooking"], price=20.0))
+    store.add_book(make_book(3, title="Gardening Basics", tags=["plants"], price=30.0))
+    store.add_book(make_book(4, title="Unrelated", tags=[]))
+    
+    def ids(**filters):
+        return [b["id"] for b in store.search_books(BookQuery(**filters))[1]]
+    
+    # Title matches outrank tag matches, and stemming folds "gardening" into "garden"
+    assert ids(q="cooked")[0] == "1"
+    assert ids(q="gardens")[2] == "1"
+    assert set(ids(q="gardens")) == {"1", "2", "3"}
+    assert ids(q="the") == []
+    
+    # Combines with filters and explicit sorting
+    assert set(ids(q="garden", price_gte=20)) == {"2", "3"}
+    assert ids(q="garden cooking", sort_by="price", sort_desc=True) == ["3", "2", "1"]
+    assert store.search_books(BookQuery(q="garden", page_size=1))[0] == 3
+    
+    store.update_book("4", {"title": "Herb Garden"})
+    assert "4" in ids(q="herbs")
+
+def test_backend_fuzzy_search(store):
+    store.add_book(make_book(1, title="The Silent River", author="Jonathan Strange"))
+    store.add_book(make_book(2, title="Silver Linings", author="Mary Shelley"))
+    store.add_book(make_book(3, title="Deep Work", author="Cal Newport"))
+    
+    def ids(**filters):
+        return sorted(b["id"] for b in store.search_books(BookQuery(**filters))[1])
+    
+    assert ids(author="shelly") == []
+    assert ids(author="shelly", fuzzy=True) == ["2"]
+    assert ids(author="mary shelly", fuzzy=True) == ["2"]
+    assert ids(author="jonathon strnge", fuzzy=True) == ["1"]
+    assert ids(title="silent rivr", fuzzy=True) == ["1"]
+    # Exact substring matches still count, and very short words need an exact hit
+    assert ids(author="newp", fuzzy=True) == ["3"]
+    assert ids(title="dep", fuzzy=True) == ["3"]
+    assert ids(title="wk", fuzzy=True) == []
+    
+    assert ids(q="riverr") == []
+    assert ids(q="riverr", fuzzy=True) == ["1"]
+    assert ids(q="newprt work", fuzzy=True, price_gte=5) == ["3"]
+    
+    store.update_book("2", {"author": "Percy Shelley"})
+    assert ids(author="mary shelly", fuzzy=True) == []
+    assert ids(author="percy shelly", fuzzy=True) == ["2"]
+
+def test_backend_autocomplete(store):
+    store.add_book(make_book(1, title="The Silent River", author="Sam Silva", genre="Fiction"))
+    store.add_book(make_book(2, title="Silver Linings", author="Sam Silva", genre="Fiction"))
+    store.add_book(make_book(3, title="Deep Work", author="Cal Newport", genre="Self-Help"))
+    
+    def values(prefix, field=None, limit=10):
+        return [(c["field"], c["value"]) for c in store.autocomplete(prefix, field, limit)]
+    
+    # Shared values come first, and later words of a value complete too
+    assert values("sil") == [("author", "Sam Silva"), ("title", "The Silent River"), ("title", "Silver Linings")]
+    assert values("riv", field="title") == [("title", "The Silent River")]
+    assert values("SIL", field="title", limit=1) == [("title", "The Silent River")]
+    assert values("xyz") == []
+    
+    # Reviews make a value more popular
+    store.add_review({"id": "r1", "book_id": "2", "reviewer": "R", "rating": 5, "comment": "c"})
+    assert values("sil", field="title") == [("title", "Silver Linings"), ("title", "The Silent River")]
+    assert store.autocomplete("sam")[0] == {"value": "Sam Silva", "field": "author", "books": 2, "reviews": 1}
+    
+    store.delete_book("2")
+    store.update_book("1", {"title": "Quiet Waters"})
+    assert values("sil") == [("author", "Sam Silva")]
+    assert values("qui") == [("title", "Quiet Waters")]
+
+def test_backend_genres_and_authors(store):
+    store.add_book(make_book(1, author="ann lee", genre="Poetry"))
+    store.add_book(make_book(2, author="Ann Lee", genre="Fiction"))
+    store.add_book(make_book(3, author="Bob Stone", genre="Fiction"))
+    store.add_review({"id": "r1", "book_id": "2", "reviewer": "R", "rating": 4, "comment": "c"})
+    
+    assert store.genres() == (2, [{"name": "Fiction", "books": 2, "average_rating": 2.0},
+                                  {"name": "Poetry", "books": 1, "average_rating": 0.0}])
+    assert store.authors("AN") == (2, [{"name": "Ann Lee", "books": 1, "average_rating": 4.0},
+                                       {"name": "ann lee", "books": 1, "average_rating": 0.0}])
+    assert store.authors(page=2, page_size=2) == (3, [{"name": "Bob Stone", "books": 1, "average_rating": 0.0}])
+    
+    # A value goes with the last book carrying it
+    store.update_book("1", {"genre": "Fiction"})
+    store.delete_book("2")
+    assert store.genres() == (1, [{"name": "Fiction", "books": 2, "average_rating": 0.0}])
+    assert store.authors("ann") == (1, [{"name": "ann lee", "books": 1, "average_rating": 0.0}])
+
+def test_backend_reviews_update_rating(store):
+    store.add_book(make_book(1))
+    for i, rating in enumerate([3, 4, 5]):
+        store.add_review({"id": f"r{i}", "book_id": "1", "reviewer": "R", "rating": rating, "comment": "c"})
+    assert store.get_book("1")["rating"] == 4.0
+    assert [r["id"] for r in store.list_reviews("1", page=2, page_size=2)] == ["r2"]
+    
+    assert store.delete_review("r2")["id"] == "r2"
+    assert store.get_book("1")["rating"] == 3.5
+    assert store.delete_review("r2") is None
+    
+    store.delete_book("1")
+    assert store.list_reviews("1") == []
+    # Checked when the review is stored, so a deletion applied first wins
+    assert store.add_review({"id": "r3", "book_id": "1", "reviewer": "R", "rating": 5, "comment": "c"}) is None
+    assert store.list_reviews("1") == [] and store.get_book("1") is None
+
+def test_review_updates_only_rating_indexes(tmp_path, monkeypatch):
+    store = make_store(tmp_path, column_mirror="auto")
+    store.add_book(make_book(1, genre="Drama", author="Ann Lee", rating=2.0))
+    store.add_book(make_book(2, genre="Drama", author="Bob Stone", rating=3.0))
+    
+    def untouched(*args):
+        raise AssertionError("a rating change re-indexed the text of a book")
+    for index in (store._fulltext, store._title_words, store._author_words, store._by_title, store._by_tag):
+        monkeypatch.setattr(index, "add", untouched)
+        monkeypatch.setattr(index, "remove", untouched)
+    store.add_review({"id": "r1", "book_id": "1", "reviewer": "R", "rating": 5, "comment": "c"})
+    
+    assert store.get_book("1")["rating"] == 5.0
+    assert [b["id"] for b in store.search_books(BookQuery(sort_by="rating", sort_desc=True))[1]] == ["1", "2"]
+    assert [b["id"] for b in store.search_books(BookQuery(genre="drama", sort_by="rating"))[1]] == ["2", "1"]
+    # Broad range queries are answered by the column mirror, where there is one
+    assert [b["id"] for b in store.search_books(BookQuery(price_gte=0, sort_by="rating"))[1]] == ["2", "1"]
+    assert store.genres()[1] == [{"name": "Drama", "books": 2, "average_rating": 4.0}]
+    assert store.search_books(BookQuery(author="ann"))[1][0]["rating"] == 5.0
+
+def test_review_aggregates_survive_reload(tmp_path):
+    store = make_store(tmp_path)
+    store.add_book(make_book(1))
+    store.add_book(make_book(2))
+    for i, rating in enumerate([1, 2, 5, 4]):
+        store.add_review({"id": f"r{i}", "book_id": str(1 + i % 2), "reviewer": "R", "rating": rating, "comment": "c"})
+    store.compact()
+    store.add_review({"id": "r4", "book_id": "1", "reviewer": "R", "rating": 3, "comment": "c"})
+    
+    store.load()
+    assert [r["id"] for r in store.list_reviews("1")] == ["r0", "r2", "r4"]
+    store.delete_review("r2")
+    assert store.get_book("1")["rating"] == 2.0
+    assert store.get_book("2")["rating"] == 3.0
+
+def test_sqlite_seeded_from_json_store(tmp_path):
+    source = make_store(tmp_path)
+    source.add_book(make_book(1))
+    source.add_review({"id": "r1", "book_id": "1", "reviewer": "R", "rating": 5, "comment": "c"})
+    
+    store = SqliteCatalogStore(str(tmp_path / "catalog.db"), seed=source)
+    store.load()
+    assert store.dump() == source.dump()
+
+@pytest.mark.parametrize("durability", ["fsync", "group", "periodic"])
+def test_durability_modes_persist_writes(tmp_path, durability):
+    store = make_store(tmp_path, durability)
+    for i in range(5):
+        store.add_book(make_book(i))
+    store.log.close()
+    
+    restarted = JsonCatalogStore(store.books_file, store.reviews_file,
+                             log=MutationLog(store.log.path, durability=durability))
+    restarted.load()
+    assert [b["id"] for b in restarted.search_books(BookQuery())[1]] == ["0", "1", "2", "3", "4"]
+
+def test_group_commit_coalesces_concurrent_writes(tmp_path, monkeypatch):
+    store = make_store(tmp_path, "group")
+    fsyncs = []
+    real_fsync = os.fsync
+    monkeypatch.setattr(os, "fsync", lambda fd: (fsyncs.append(fd), real_fsync(fd)))
+    
+    threads = [threading.Thread(target=store.add_book, args=(make_book(i),)) for i in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    
+    assert store.search_books(BookQuery())[0] == 20
+    assert 1 <= len(fsyncs) < 20
+
+def test_malformed_snapshot_is_not_served_as_empty(tmp_path):
+    store = make_store(tmp_path)
+    with open(store.books_file, "w") as f:
+        f.write('[{"id": "1", "tit')
+    with pytest.raises(json.JSONDecodeError):
+        store.load()
+
+def test_unknown_durability_mode_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        MutationLog(str(tmp_path / "mutations.log"), durability="sometimes")
+
+def test_bk_tree_stays_bounded_under_churn():
+    rng = random.Random(5)
+    tree, live = BKTree(), set()
+    for round_no in range(50):
+        added = {"".join(rng.choice("abcdef") for _ in range(rng.randint(3, 8))) for _ in range(40)}
+        for term in added:
+            tree.add(term)
+        live |= added
+        for term in rng.sample(sorted(live), len(live) // 2):
+            tree.remove(term)
+            live.discard(term)
+        assert tree._nodes <= len(live) + max(BKTREE_DEAD_MINIMUM, BKTREE_DEAD_FRACTION * len(live))
+    for query in ["abc", "fedcba", "aaaa"]:
+        expected = sorted((levenshtein(query, term), term) for term in live if levenshtein(query, term) <= 2)
+        assert tree.search(query, 2) == expected
+
+def test_bitmap_matches_set_operations():
+    rng = random.Random(3)
+    # Dense and sparse containers across several chunks
+    sets = [set(rng.sample(range(200_000), size)) for size in (10, 3_000, 9_000, 60_000)]
+    sets.append(set(range(65_000, 140_000)))
+    bitmaps = [Bitmap(values) for values in sets]
+    for values, bitmap in zip(sets, bitmaps):
+        assert len(bitmap) == len(values)
+        assert list(bitmap) == sorted(values)
+    for (a, bitmap_a), (b, bitmap_b) in zip(zip(sets, bitmaps), zip(sets[1:], bitmaps[1:])):
+        assert list(bitmap_a & bitmap_b) == sorted(a & b)
+        assert list(bitmap_a | bitmap_b) == sorted(a | b)
+    assert list(intersect(bitmaps[1:])) == sorted(set.intersection(*sets[1:]))
+    
+    bitmap, values = Bitmap(), set()
+    for _ in range(20_000):
+        value = rng.randrange(140_000)
+        if rng.random() < 0.7:
+            bitmap.add(value)
+            values.add(value)
+        else:
+            bitmap.discard(value)
+            values.discard(value)
+        assert (value in bitmap) == (value in values)
+    assert list(bitmap) == sorted(values) and len(bitmap) == len(values)
+    for value in list(values):
+        bitmap.discard(value)
+    assert not bitmap and list(bitmap) == []
+
+def reference_search(books, query):
+    """Full-scan evaluation of a BookQuery, as search_books originally did it."""
+    hits = [b for b in books
+            if (not query.title or query.title.casefold() in b["title"].casefold())
+            and (not query.author or query.author.casefold() in b["author"].casefold())
+            and (not query.genre or query.genre.casefold() in b["genre"].casefold())
+            and (not query.tag or query.tag.casefold() in [t.casefold() for t in b["tags"]])
+            and (query.price_lt is None or b["price"] < query.price_lt)
+            and (query.price_lte is None or b["price"] <= query.price_lte)
+            and (query.price_gt is None or b["price"] > query.price_gt)
+            and (query.price_gte is None or b["price"] >= query.price_gte)
+            and (query.published_year is None or b["published_year"] == query.published_year)
+            and (query.year_from is None or b["published_year"] >= query.year_from)
+            and (query.year_to is None or b["published_year"] <= query.year_to)]
+    if query.sort_by:
+        hits.sort(key=lambda b: (b[query.sort_by], b["id"]), reverse=query.sort_desc)
+    elif query.after is not None:
+        hits.sort(key=lambda b: b["id"], reverse=query.sort_desc)
+    start = 0 if query.after is not None else (query.page - 1) * query.page_size
+    if query.after:
+        key = (lambda b: (b[query.sort_by], b["id"])) if query.sort_by else (lambda b: (b["id"], b["id"]))
+        hits = [b for b in hits if (key(b) < query.after if query.sort_desc else key(b) > query.after)]
+    return len(hits), [b["id"] for b in hits[start:start + query.page_size]]
+
+def populate_random_catalog(store, n=300, seed=7):
+    rng = random.Random(seed)
+    books = []
+    for i in range(n):
+        book = make_book(i, author=rng.choice(["Ann Lee", "Bob Stone", "Cy Leeds"]),
+                         genre=rng.choice(["Fiction", "Non-Fiction", "Poetry"]),
+                         price=rng.choice([5.0, 9.5, 10.0, 20.0, 42.0]),
+                         tags=rng.sample(["a", "B", "c"], rng.randint(0, 2)),
+                         published_year=rng.randint(1995, 2005), rating=rng.choice([0.0, 3.5, 4.0]))
+        books.append(book)
+        store.add_book(book)
+    for book in rng.sample(books, 30):
+        store.delete_book(book["id"])
+        books.remove(book)
+    for book in rng.sample(books, 30):
+        changes = {"price": rng.choice([1.0, 10.0]), "tags": ["c"]}
+        store.update_book(book["id"], changes)
+        book.update(changes)
+    return books
+
+SEARCH_FILTERS = [{}, {"author": "lee"}, {"author": "ee"}, {"author": "Lee Ann"}, {"title": "OOK 1"},
+                  {"title": "k 2", "genre": "ion"}, {"genre": "fiction"}, {"tag": "b"}, {"price_lt": 10},
+               {"price_gte": 10, "price_lte": 20}, {"year_from": 2000}, {"published_year": 1999},
+               {"author": "stone", "tag": "c", "price_gt": 5}, {"genre": "poetry", "year_to": 1998},
+               {"title": "ook 12", "price_gte": 9.5, "year_from": 1996}]
+
+def test_search_matches_full_scan(tmp_path):
+    store = make_store(tmp_path, "periodic")
+    books = populate_random_catalog(store)
+    for filter_args in SEARCH_FILTERS:
+        for sort_by in [None, "price", "rating", "published_year"]:
+            for sort_desc in [False, True]:
+                for page in [1, 3]:
+                    query = BookQuery(**filter_args, sort_by=sort_by, sort_desc=sort_desc, page=page, page_size=7)
+                    total, page_books = store.search_books(query)
+                    assert (total, [b["id"] for b in page_books]) == reference_search(books, query), query
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_keyset_pages_cover_results_once(tmp_path, backend):
+    if backend == "json":
+        store = make_store(tmp_path, "periodic")
+    else:
+        store = SqliteCatalogStore(str(tmp_path / "catalog.db"))
+        store.load()
+    books = populate_random_catalog(store, n=120)
+    for filter_args in SEARCH_FILTERS:
+        for sort_by in [None, "price", "rating"]:
+            for sort_desc in [False, True]:
+                expected = reference_search(books, BookQuery(**filter_args, sort_by=sort_by, sort_desc=sort_desc,
+                                                             after=(), page_size=1000))[1]
+                seen, after = [], ()
+                while True:
+                    query = BookQuery(**filter_args, sort_by=sort_by, sort_desc=sort_desc, after=after, page_size=7)
+                    total, page_books = store.search_books(query)
+                    assert total == len(expected)
+                    seen += [b["id"] for b in page_books]
+                    if len(page_books) < 7:
+                        break
+                    after = decode_cursor(encode_cursor(query, page_books[-1]), sort_by, sort_desc)
+                assert seen == expected, (filter_args, sort_by, sort_desc)
+
+def test_planner_drives_with_most_selective_index(tmp_path):
+    store = make_store(tmp_path, "periodic")
+    for i in range(100):
+        store.add_book(make_book(i, author="Rare" if i == 7 else "Common", tags=["even"] if i % 2 else [],
+                                 price=float(i)))
+    
+    total, books, plan = store.explain_search(BookQuery(author="rare", price_gte=5, tag="even"))
+    assert (total, [b["id"] for b in books]) == (1, ["7"])
+    steps = [(s["step"], s["access"], s["estimated_rows"], s["rows"]) for s in plan["steps"]]
+    # The single author match drives; the posting list is intersected, and the
+    # wide price range is checked on the remaining row instead of fetched
+    assert steps[:3] == [("author", "drive", 1, 1), ("tag", "index", 50, 1), ("price", "residual", 95, 1)]
+    assert steps[-1][:2] == ("page", "insertion order")
+    assert all(s["ms"] >= 0 for s in plan["steps"]) and plan["ms"] >= 0
+
+def test_backend_explain_search(store):
+    for i in range(5):
+        store.add_book(make_book(i, genre="Poetry" if i % 2 else "Fiction", price=float(i)))
+    
+    query = BookQuery(genre="poetry", price_lt=4, sort_by="price")
+    total, books, plan = store.explain_search(query)
+    assert (total, books) == store.search_books(query)
+    assert [b["id"] for b in books] == ["1", "3"]
+    assert plan["steps"][-1]["step"] == "page" and plan["steps"][-1]["rows"] == 2
+    assert all(s["access"] and s["ms"] >= 0 for s in plan["steps"])
+
+def test_column_mirror_matches_full_scan(tmp_path):
+    pytest.importorskip("numpy")
+    store = make_store(tmp_path, "periodic", column_mirror="on")
+    books = populate_random_catalog(store)
+    for filter_args in SEARCH_FILTERS:
+        for sort_by in [None, "price", "rating", "published_year"]:
+            for sort_desc in [False, True]:
+                for page in [1, 3, 40]:
+                    query = BookQuery(**filter_args, sort_by=sort_by, sort_desc=sort_desc, page=page, page_size=7)
+                    total, page_books = store.search_books(query)
+                    assert (total, [b["id"] for b in page_books]) == reference_search(books, query), query
+    
+    _, _, plan = store.explain_search(BookQuery(genre="fiction", price_gte=10, sort_by="rating"))
+    assert [s["access"] for s in plan["steps"]] == ["column mask", "argpartition by rating"]
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_facet_counts_match_full_scan(tmp_path, backend):
+    if backend == "json":
+        store = make_store(tmp_path, "periodic")
+    else:
+        store = SqliteCatalogStore(str(tmp_path / "catalog.db"), durability="periodic")
+        store.load()
+    books = populate_random_catalog(store)
+    by_id = {b["id"]: b for b in books}
+    # The last filter matches fewer books than there are authors to intersect
+    for filter_args in SEARCH_FILTERS + [{"title": "ook 5", "author": "stone"}]:
+        query = BookQuery(**filter_args)
+        hits = [by_id[book_id] for book_id in reference_search(books, BookQuery(**filter_args, page_size=1000))[1]]
+        expected = {name: {} for name in ("genre", "author", "tag")}
+        for book in hits:
+            for name, values in (("genre", [book["genre"]]), ("author", [book["author"]]),
+                                 ("tag", {t.casefold() for t in book["tags"]})):
+                for value in values:
+                    expected[name][value] = expected[name].get(value, 0) + 1
+        for name, edges in FACET_BUCKETS.items():
+            counts = [0] * (len(edges) + 1)
+            for book in hits:
+                counts[bisect.bisect_right(edges, book[name])] += 1
+            expected[name] = dict(zip(bucket_labels(edges), counts))
+        
+        facets = store.facet_counts(query)
+        facets["tag"] = {tag.casefold(): count for tag, count in facets["tag"].items()}
+        assert facets == expected, filter_args
+        assert list(store.facet_counts(query, size=1)["author"].values()) == \
+            sorted(expected["author"].values(), reverse=True)[:1]
+
+
+def test_binary_snapshot_restores_catalog(tmp_path):
+    store = make_store(tmp_path, "periodic")
+    books = populate_random_catalog(store)
+    store.add_review({"id": "r1", "book_id": books[0]["id"], "reviewer": "R", "rating": 5, "comment": "c"})
+    store.compact()
+    store.close()
+    
+    def restart():
+        restarted = JsonCatalogStore(store.books_file, store.reviews_file,
+                                     log=MutationLog(store.log.path, durability="periodic"), column_mirror="off")
+        restarted.load()
+        return restarted
+    
+    restarted = restart()
+    # Mapped, and indexes are only unpickled once a query needs them
+    assert restarted._snapshot is not None and "_by_author" not in vars(restarted)
+    assert restarted.dump() == store.dump()
+    for filter_args in SEARCH_FILTERS:
+        query = BookQuery(**filter_args, sort_by="price", page_size=7)
+        assert restarted.search_books(query) == store.search_books(query)
+    assert restarted.autocomplete("bo") == store.autocomplete("bo")
+    assert restarted.genres() == store.genres()
+    
+    # Mutations after the restore are logged and replayed over the snapshot
+    restarted.update_book(books[1]["id"], {"author": "Dee Moss"})
+    restarted.log.close()
+    assert [b["id"] for b in restart().search_books(BookQuery(author="moss"))[1]] == [books[1]["id"]]
+    
+    # Changed data files make the snapshot stale
+    with open(store.books_file, "w") as f:
+        json.dump([make_book(1)], f)
+    rebuilt = restart()
+    assert rebuilt._snapshot is None
+    assert [b["id"] for b in rebuilt.search_books(BookQuery())[1]] == ["1"]
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_compaction_writes_binary_snapshot(tmp_path):
+    store = make_store(tmp_path, "fsync")
+    books = populate_random_catalog(store)
+    store.compact()
+    store.delete_book(books[0]["id"])
+    
+    # Stopped without close(): the snapshot compaction wrote is still mapped
+    restarted = JsonCatalogStore(store.books_file, store.reviews_file,
+                                 log=MutationLog(store.log.path, durability="fsync"), column_mirror="off")
+    restarted.load()
+    assert restarted._snapshot is not None
+    assert restarted.dump() == store.dump()
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_store_writable_in_forked_worker(tmp_path):
+    store = make_store(tmp_path, "group")
+    store.add_book(make_book(1))
+    store.close()
+    store.load()
+    store.preload()
+    
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            store.after_fork()
+            store.add_book(make_book(2))
+            code = 0 if store.search_books(BookQuery())[0] == 2 else 1
+        finally:
+            os._exit(code)
+    assert os.waitpid(pid, 0)[1] == 0
+    
+    # The worker's write went through its own flusher to the shared log
+    store.log.close()
+    store.load()
+    assert store.get_book("2") is not None
+
+def test_stores_sharing_a_log_see_each_others_writes(tmp_path, monkeypatch, caplog):
+    # Catch up on requests only, not in the background
+    monkeypatch.setattr(config, "FOLLOW_INTERVAL_MS", 60_000)
+    # Two stores over the same files stand for two worker processes
+    first = make_store(tmp_path, "periodic")
+    second = JsonCatalogStore(first.books_file, first.reviews_file,
+                              log=MutationLog(first.log.path, durability="periodic"), column_mirror="off")
+    second.load()
+    
+    first.add_book(make_book(1, author="Ann Lee"))
+    assert second.get_book("1")["author"] == "Ann Lee"
+    second.update_book("1", {"author": "Bob Stone"})
+    assert [b["id"] for b in first.search_books(BookQuery(author="stone"))[1]] == ["1"]
+    
+    # Each rating is computed from every review, whichever store took it
+    first.add_review({"id": "r1", "book_id": "1", "reviewer": "R", "rating": 2, "comment": "c"})
+    second.add_review({"id": "r2", "book_id": "1", "reviewer": "R", "rating": 4, "comment": "c"})
+    assert first.get_book("1")["rating"] == second.get_book("1")["rating"] == 3.0
+    
+    # Writes after a compaction by one store reach the other
+    first.compact()
+    first.add_book(make_book(2))
+    assert second.get_book("2") is not None
+    second.delete_book("2")
+    assert first.get_book("2") is None
+    
+    # A store that missed whole rotations of the log reloads
+    for i in range(3, 6):
+        first.add_book(make_book(i))
+        first.compact()
+    assert [b["id"] for b in second.search_books(BookQuery())[1]] == ["1", "3", "4", "5"]
+    assert "reloading the catalog" in caplog.text
+    assert second.dump() == first.dump()
+
+def test_reads_do_not_wait_for_writers(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "FOLLOW_INTERVAL_MS", 60_000)
+    store = make_store(tmp_path, "periodic")
+    store.add_book(make_book(1))
+    
+    def try_search():
+        try:
+            return store.try_read(store.search_books, BookQuery())[0]
+        except WouldBlock:
+            return None
+    
+    # A write waiting for another process to release the log holds up no read
+    other = MutationLog(store.log.path, durability="periodic")
+    with other.locked():
+        writer = threading.Thread(target=store.add_book, args=(make_book(2),))
+        writer.start()
+        writer.join(0.2)
+        assert writer.is_alive()
+        assert try_search() == 1
+        assert store.get_book("1") is not None
+    writer.join()
+    assert try_search() == 2
+    
+    # Reads that would wait for a mutation being applied, or have to catch
+    # up with another process's writes first, are left to the caller
+    results = []
+    with store._lock:
+        reader = threading.Thread(target=lambda: results.append(try_search()))
+        reader.start()
+        reader.join()
+    assert results == [None]
+    second = JsonCatalogStore(store.books_file, store.reviews_file,
+                              log=MutationLog(store.log.path, durability="periodic"), column_mirror="off")
+    second.load()
+    second.add_book(make_book(3))
+    assert try_search() is None
+    assert store.search_books(BookQuery())[0] == 3
+    assert try_search() == 3
+
+def test_pinned_walk_sees_one_version(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "FOLLOW_INTERVAL_MS", 60_000)
+    store = make_store(tmp_path, "periodic")
+    # Another process sharing the log, continuing walks the first one starts
+    other = JsonCatalogStore(store.books_file, store.reviews_file,
+                             log=MutationLog(store.log.path, durability="periodic"), column_mirror="off")
+    other.load()
+    rng = random.Random(3)
+    books = populate_random_catalog(store, n=120)
+    added = 1000
+    for filter_args in SEARCH_FILTERS + [{"q": "book 1"}, {"author": "An Le", "fuzzy": True}]:
+        for sort_by in [None, "price"]:
+            for sort_desc in [False, True]:
+                version = store.version
+                full = BookQuery(**filter_args, sort_by=sort_by, sort_desc=sort_desc, after=(), page_size=1000)
+                expected_total, expected = store.search_books(full)
+                seen, after = [], ()
+                while True:
+                    query = BookQuery(**filter_args, sort_by=sort_by, sort_desc=sort_desc, after=after,
+                                      page_size=7, snapshot=version)
+                    total, page_books = rng.choice([store, other]).search_books(query)
+                    assert total == expected_total
+                    seen += page_books
+                    if len(page_books) < 7:
+                        break
+                    cursor = encode_cursor(query, page_books[-1])
+                    assert decode_snapshot(cursor) == version
+                    after = decode_cursor(cursor, sort_by, sort_desc)
+                    # Changes between pages are not seen by the walk
+                    book = rng.choice(books)
+                    action = rng.random()
+                    if action < 0.2:
+                        store.delete_book(book["id"])
+                        books.remove(book)
+                    elif action < 0.4:
+                        added += 1
+                        books.append(make_book(added, author="Ann Lee", price=rng.choice([1.0, 50.0])))
+                        other.add_book(books[-1])
+                    else:
+                        changes = rng.choice([{"price": rng.choice([1.0, 9.5, 50.0])}, {"title": f"Book {added}"},
+                                              {"tags": ["b"]}, {"author": "Bob Stone"}])
+                        rng.choice([store, other]).update_book(book["id"], changes)
+                        book.update(changes)
+                assert seen == expected, (filter_args, sort_by, sort_desc)
+    
+    # Replaced versions are only kept for a while
+    version = store.version
+    monkeypatch.setattr(config, "VERSION_RETENTION_S", 0)
+    store.update_book(books[0]["id"], {"price": 2.0})
+    store.update_book(books[0]["id"], {"price": 3.0})
+    with pytest.raises(SnapshotExpired):
+        store.search_books(BookQuery(after=(), snapshot=version))
+    assert store.search_books(BookQuery(after=(), snapshot=store.version))[0] == len(books)
+
+def test_writer_persists_mutations_in_batches(tmp_path, monkeypatch):
+    store = make_store(tmp_path, "fsync")
+    fsyncs = []
+    fsync = os.fsync
+    log_stat = os.stat(store.log.path)
+    # Only the fsyncs of this store's log: threads of other tests may still be compacting
+    monkeypatch.setattr(os, "fsync", lambda fd: os.path.samestat(os.fstat(fd), log_stat) and fsyncs.append(fd) or fsync(fd))
+    writer = CatalogWriter(store, batch_limit=8)
+    
+    async def submit_all():
+        results = await asyncio.gather(*[writer.submit(store.add_book, make_book(i)) for i in range(20)],
+                                       writer.submit(store.update_book, "missing", {"price": 1.0}),
+                                       writer.submit(store.add_book, None), return_exceptions=True)
+        await writer.stop()
+        return results
+    results = asyncio.run(submit_all())
+    
+    # Each mutation gets its own outcome, in submission order
+    assert [book["id"] for book in results[:20]] == [str(i) for i in range(20)]
+    assert results[20] is None and isinstance(results[21], TypeError)
+    assert store.search_books(BookQuery())[0] == 20
+    # One fsync per batch of up to 8 mutations
+    assert len(fsyncs) == 3